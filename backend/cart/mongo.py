@@ -1,14 +1,6 @@
 import secrets
 
-def ensure_indexes(mongo):
-    try:
-        mongo['carts'].create_index('user_email', unique=True)
-        mongo['carts'].create_index('items.product_sku')
-    except Exception:
-        pass
-
 def get_cart(mongo, email):
-    ensure_indexes(mongo)
     doc = mongo['carts'].find_one({'user_email': email})
     if not doc:
         doc = {'user_email': email, 'items': []}
@@ -16,7 +8,6 @@ def get_cart(mongo, email):
     return doc
 
 def add_item(mongo, email, product_doc, quantity):
-    ensure_indexes(mongo)
     item_id = 'CITEM-' + secrets.token_hex(6)
     mongo['carts'].update_one(
         {'user_email': email},
@@ -33,7 +24,6 @@ def add_item(mongo, email, product_doc, quantity):
     return item_id
 
 def update_item(mongo, email, item_id, quantity):
-    ensure_indexes(mongo)
     if int(quantity or 0) <= 0:
         mongo['carts'].update_one({'user_email': email}, {'$pull': {'items': {'item_id': item_id}}})
         return None
@@ -44,7 +34,6 @@ def update_item(mongo, email, item_id, quantity):
     return item_id
 
 def remove_item(mongo, email, item_id):
-    ensure_indexes(mongo)
     mongo['carts'].update_one({'user_email': email}, {'$pull': {'items': {'item_id': item_id}}})
 
 def public_cart(doc):
@@ -1,6 +1,10 @@
 from rest_framework import serializers
+from django.db.models import Prefetch
 from .models import Cart, CartItem
-from catalog.serializers import ProductSerializer
+from catalog.serializers import ProductSerializer, shape_product_queryset
+
+def cart_items_prefetch():
+    return Prefetch('items', queryset=shape_product_queryset(CartItem.objects.order_by('id'), prefix='product__', extra=('cart', 'quantity', 'product')))
 
 class CartItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer()
@@ -3,10 +3,11 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from .models import Cart, CartItem
 from catalog.models import Product
-from .serializers import CartSerializer, CartItemSerializer
+from .serializers import CartSerializer, CartItemSerializer, cart_items_prefetch
 from django.conf import settings
+from django.db.models import prefetch_related_objects
 from catalog.mongo import product_public
-from .mongo import ensure_indexes, get_cart, public_cart, add_item, update_item, remove_item
+from .mongo import get_cart, public_cart, add_item, update_item, remove_item
 
 def get_or_create_cart(user):
     cart, _ = Cart.objects.get_or_create(user=user)
@@ -24,6 +25,7 @@ class CartView(APIView):
             except Exception:
                 pass
         cart = get_or_create_cart(request.user)
+        prefetch_related_objects([cart], cart_items_prefetch())
         return Response(CartSerializer(cart).data)
 
 class CartItemsView(APIView):
@@ -1,12 +1,28 @@
 from django.apps import AppConfig
 from django.conf import settings
-from .mongo import ensure_indexes
+from django.db.models.signals import post_save, post_delete
+from stylesathi_backend.mongo_indexes import check_indexes
 
 class CatalogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'catalog'
 
     def ready(self):
+        from .models import Product, Category, ProductImage
+        from .cache import bump_catalog_version
+
+        def _bump(sender=None, raw=False, **kwargs):
+            if not raw:
+                bump_catalog_version()
+        for model in (Product, Category, ProductImage):
+            post_save.connect(_bump, sender=model, dispatch_uid=f'catalog_version_save_{model.__name__}')
+            post_delete.connect(_bump, sender=model, dispatch_uid=f'catalog_version_delete_{model.__name__}')
+        def _tombstone(sender=None, instance=None, **kwargs):
+            # Other workers' search and suggest indexes find deleted rows through these on catch-up
+            from .search import index_source, record_deleted
+            if index_source() == 'orm':
+                record_deleted('orm', [instance.pk])
+        post_delete.connect(_tombstone, sender=Product, dispatch_uid='catalog_product_tombstone')
         mongo = getattr(settings, 'MONGO_DB', None)
         if mongo is not None:
-            ensure_indexes(mongo)
+            check_indexes(mongo)
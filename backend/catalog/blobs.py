@@ -0,0 +1,164 @@
+import hashlib
+import os
+import tempfile
+import time
+from datetime import timedelta
+from urllib.parse import urlparse
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils import timezone
+from .models import MediaBlob, MediaReference
+
+# Uploads are stored once per content under blobs/<first two hex digits>/<sha256><ext>. A blob's URL never
+# changes meaning, so it is served as immutable, and products that upload the same file share it. The
+# MediaReference index records which products hold each blob; blobs left without any are collected.
+BLOB_DIR = 'blobs'
+
+def blob_grace():
+    return int(getattr(settings, 'MEDIA_BLOB_GRACE_SECONDS', 3600))
+
+def blob_ext(name):
+    ext = os.path.splitext(os.path.basename(name or ''))[1].lower()
+    return ext if 1 < len(ext) <= 10 and ext[1:].isalnum() else ''
+
+def blob_key(digest, ext):
+    return f'{BLOB_DIR}/{digest[:2]}/{digest}{ext}'
+
+def local_blob_path(key):
+    return os.path.join(str(settings.MEDIA_ROOT), *key.split('/'))
+
+def _chunks(data):
+    if isinstance(data, (bytes, bytearray)):
+        return [data]
+    if hasattr(data, 'seek'):
+        data.seek(0)
+    return data.chunks()
+
+def save_local_blob(data, name):
+    # Hashes the chunks while writing them to a temporary file, which becomes the blob only if it is new.
+    # Touches no database so it can run on upload threads; the product save registers the key.
+    tmp_dir = os.path.join(str(settings.MEDIA_ROOT), BLOB_DIR, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as dst:
+            for chunk in _chunks(data):
+                digest.update(chunk)
+                dst.write(chunk)
+        key = blob_key(digest.hexdigest(), blob_ext(name))
+        path = local_blob_path(key)
+        if os.path.exists(path):
+            # Restart the grace period so a concurrent sweep does not collect the blob this upload now relies on
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return key
+
+def _local_storage(storage):
+    return isinstance(storage, FileSystemStorage) and os.path.normpath(str(storage.location)) == os.path.normpath(str(settings.MEDIA_ROOT))
+
+def save_storage_blob(data, name, storage=None):
+    # Same for Django storage; a remote storage (Cloudinary) is only written when it does not have the blob yet
+    storage = storage or default_storage
+    if _local_storage(storage):
+        return save_local_blob(data, name)
+    digest = hashlib.sha256()
+    for chunk in _chunks(data):
+        digest.update(chunk)
+    key = blob_key(digest.hexdigest(), blob_ext(name))
+    if not storage.exists(key):
+        key = storage.save(key, ContentFile(data) if isinstance(data, (bytes, bytearray)) else data)
+    MediaBlob.objects.update_or_create(key=key, defaults={'touched_at': timezone.now()})
+    return key
+
+def blob_key_of(ref):
+    # Blob key behind a storage name or a media URL (absolute or not)
+    if not isinstance(ref, str) or not ref:
+        return None
+    if ref.startswith(BLOB_DIR + '/'):
+        return ref
+    media = '/' + getattr(settings, 'MEDIA_URL', '/media/').strip('/') + '/'
+    path = urlparse(ref).path
+    return path[len(media):] if path.startswith(media + BLOB_DIR + '/') else None
+
+def doc_blob_keys(doc):
+    from .media import variant_urls
+    refs = [doc.get('image_url'), doc.get('model_glb_url')] + list(doc.get('images') or []) + variant_urls(doc.get('image_variants'))
+    return {k for k in map(blob_key_of, refs) if k}
+
+def product_blob_keys(product):
+    from .media import variant_urls
+    refs = [getattr(product.image, 'name', ''), product.image_url, product.model_glb_url] + variant_urls(product.image_variants)
+    refs += [i.image.name for i in product.images.all() if i.image]
+    return {k for k in map(blob_key_of, refs) if k}
+
+def track_media(sku, keys):
+    # Makes the index hold exactly `keys` for this product, then collects what it let go of
+    if not sku:
+        return
+    keys = set(keys)
+    now = timezone.now()
+    MediaBlob.objects.filter(key__in=keys).update(touched_at=now)
+    blobs = dict(MediaBlob.objects.filter(key__in=keys).values_list('key', 'id'))
+    if keys - set(blobs):
+        MediaBlob.objects.bulk_create([MediaBlob(key=k, touched_at=now) for k in keys - set(blobs)], ignore_conflicts=True)
+        blobs = dict(MediaBlob.objects.filter(key__in=keys).values_list('key', 'id'))
+    stale = MediaReference.objects.filter(sku=sku).exclude(blob_id__in=blobs.values())
+    released = list(stale.values_list('blob_id', flat=True))
+    if released:
+        stale.delete()
+    MediaReference.objects.bulk_create([MediaReference(blob_id=i, sku=sku) for i in blobs.values()], ignore_conflicts=True)
+    if released:
+        collect_blobs(released)
+
+def release_media(sku):
+    track_media(sku, ())
+
+def delete_blob_file(key):
+    path = local_blob_path(key)
+    if os.path.exists(path):
+        os.remove(path)
+    if not _local_storage(default_storage):
+        try:
+            default_storage.delete(key)
+        except Exception:
+            pass
+
+def collect_blobs(ids=None, grace=None):
+    # Deletes blobs no product references that were not stored or referenced within the grace period. Rows of
+    # blobs that reached the remote store stay behind (without the local file) to remember their URL.
+    grace = blob_grace() if grace is None else grace
+    cutoff = timezone.now() - timedelta(seconds=grace)
+    qs = MediaBlob.objects.filter(touched_at__lt=cutoff, references__isnull=True)
+    if ids is not None:
+        qs = qs.filter(id__in=ids)
+    removed = 0
+    for blob_id, key, remote in qs.values_list('id', 'key', 'remote_url'):
+        path = local_blob_path(key)
+        exists = os.path.exists(path)
+        if (exists and os.path.getmtime(path) >= time.time() - grace) or (remote and not exists):
+            continue
+        # Checked again right before deleting, so a reference added meanwhile keeps the blob
+        still_free = MediaBlob.objects.filter(id=blob_id, touched_at__lt=cutoff, references__isnull=True)
+        if remote:
+            if still_free.exists():
+                os.remove(path)
+                removed += 1
+        elif still_free.delete()[0]:
+            delete_blob_file(key)
+            removed += 1
+    return removed
+
+def remote_urls(keys):
+    return dict(MediaBlob.objects.filter(key__in=keys).exclude(remote_url='').values_list('key', 'remote_url'))
+
+def remember_remote_urls(urls):
+    # Each blob goes to the remote store once; later products with the same bytes reuse its URL
+    for key, url in urls.items():
+        MediaBlob.objects.update_or_create(key=key, defaults={'remote_url': url, 'touched_at': timezone.now()})
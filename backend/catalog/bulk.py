@@ -0,0 +1,161 @@
+import logging
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from outbox.events import enqueue, mirrored_write
+from .models import Product
+from .mongo import COUNTED_FIELDS, counted_category, targeted_set
+
+logger = logging.getLogger(__name__)
+
+BULK_FIELDS = ('price', 'stock', 'in_stock')
+
+def parse_change(item):
+    # (sku, changes, error); stock without in_stock sets in_stock the way product_doc_from_request does
+    if not isinstance(item, dict):
+        return None, None, 'Expected an object'
+    sku = str(item.get('sku') or '').strip()
+    if not sku:
+        return None, None, 'Missing sku'
+    changes = {}
+    if 'price' in item:
+        try:
+            price = float(item['price'])
+        except (TypeError, ValueError):
+            price = -1
+        if isinstance(item['price'], bool) or price != price or price < 0 or price == float('inf'):
+            return sku, None, 'Invalid price'
+        changes['price'] = price
+    if 'stock' in item:
+        stock = item['stock']
+        if isinstance(stock, bool) or not isinstance(stock, int) or stock < 0:
+            return sku, None, 'Invalid stock'
+        changes['stock'] = stock
+    if 'in_stock' in item:
+        if not isinstance(item['in_stock'], bool):
+            return sku, None, 'Invalid in_stock'
+        changes['in_stock'] = item['in_stock']
+    elif 'stock' in changes:
+        changes['in_stock'] = changes['stock'] > 0
+    if not changes:
+        return sku, None, 'Nothing to update'
+    return sku, changes, None
+
+def write_mongo_changes(mongo, docs, changes, skus, guard):
+    # Returns (written skus, {sku: error}). Only in_stock moves a category counter, so those documents are
+    # updated one by one, reading their state before the write in the same operation; price and stock
+    # changes go out as one unordered bulk write.
+    from pymongo import UpdateOne
+    from pymongo.errors import BulkWriteError, PyMongoError
+    written, failed, deltas = [], {}, {}
+    plain = []
+    for sku in skus:
+        update = {'$set': targeted_set(changes[sku], with_public='public_base' in docs[sku])}
+        if 'in_stock' not in changes[sku]:
+            plain.append((sku, UpdateOne({'sku': sku, **guard}, update)))
+            continue
+        try:
+            before = mongo['products'].find_one_and_update({'sku': sku, **guard}, update, projection=COUNTED_FIELDS)
+        except PyMongoError as e:
+            failed[sku] = f'Write failed: {e}'
+            continue
+        if before is None:
+            failed[sku] = 'Product not found'
+            continue
+        written.append(sku)
+        old, new = counted_category(before), counted_category({**before, **changes[sku]})
+        if old != new:
+            if old:
+                deltas[old] = deltas.get(old, 0) - 1
+            if new:
+                deltas[new] = deltas.get(new, 0) + 1
+    if plain:
+        try:
+            mongo['products'].bulk_write([op for _, op in plain], ordered=False)
+        except BulkWriteError as e:
+            for err in (e.details or {}).get('writeErrors') or []:
+                failed[plain[err['index']][0]] = f"Write failed: {err.get('errmsg') or err.get('code')}"
+        except PyMongoError as e:
+            failed.update((sku, f'Write failed: {e}') for sku, _ in plain)
+        written += [sku for sku, _ in plain if sku not in failed]
+    counters = [UpdateOne({'name': name}, {'$inc': {'product_count': n}}, upsert=True) for name, n in deltas.items() if n]
+    if counters:
+        try:
+            mongo['categories'].bulk_write(counters, ordered=False)
+        except PyMongoError as e:
+            # The products are written; reconcile_category_counts repairs the counters
+            logger.warning('bulk: could not move category counters %s: %s', deltas, e)
+    return written, failed
+
+def apply_price_stock_changes(user, items):
+    # Each product is written to its primary store only; the outbox mirrors it to the other one
+    email = getattr(user, 'email', None)
+    is_admin = getattr(user, 'role', 'customer') == 'admin'
+    errors = []
+    changes = {}
+    positions = {}
+    for i, item in enumerate(items):
+        sku, change, problem = parse_change(item)
+        if problem:
+            errors.append({'index': i, 'sku': sku, 'error': problem})
+            continue
+        # Repeated SKUs merge in request order
+        changes.setdefault(sku, {}).update(change)
+        positions[sku] = i
+    skus = list(changes)
+    mongo = getattr(settings, 'MONGO_DB', None)
+    # One ownership read per store for the whole batch
+    docs = {}
+    if mongo is not None and skus:
+        from pymongo.errors import PyMongoError
+        projection = {'sku': 1, 'owner_email': 1, 'public_base': 1}
+        try:
+            docs = {d['sku']: d for d in mongo['products'].find({'sku': {'$in': skus}}, projection)}
+        except PyMongoError as e:
+            errors.extend({'index': positions[sku], 'sku': sku, 'error': f'Write failed: {e}'} for sku in skus)
+            errors.sort(key=lambda e: e['index'])
+            return [], errors
+    rows = {p.sku: p for p in Product.objects.filter(sku__in=skus).only('id', 'sku', 'owner_id', *BULK_FIELDS)} if skus else {}
+    allowed = []
+    for sku in skus:
+        doc, row = docs.get(sku), rows.get(sku)
+        if doc is None and row is None:
+            errors.append({'index': positions[sku], 'sku': sku, 'error': 'Product not found'})
+            continue
+        owns = (doc is not None and doc.get('owner_email') == email) or (doc is None and row.owner_id == user.id)
+        if not (owns or is_admin):
+            errors.append({'index': positions[sku], 'sku': sku, 'error': 'Forbidden'})
+            continue
+        allowed.append(sku)
+    updated = []
+    in_mongo = [sku for sku in allowed if sku in docs]
+    if in_mongo:
+        from pymongo.errors import PyMongoError
+        # The owner is part of every write's filter, so a product that changed hands after the read is left alone
+        guard = {} if is_admin else {'owner_email': email}
+        try:
+            with mirrored_write('product', *in_mongo):
+                written, failed = write_mongo_changes(mongo, docs, changes, in_mongo, guard)
+        except PyMongoError as e:
+            written, failed = [], {sku: f'Write failed: {e}' for sku in in_mongo}
+        updated += written
+        errors.extend({'index': positions[sku], 'sku': sku, 'error': problem} for sku, problem in failed.items())
+    dirty = []
+    fields = set()
+    for sku in allowed:
+        row = rows.get(sku)
+        if row is None or sku in docs:
+            continue
+        for f, v in changes[sku].items():
+            setattr(row, f, v)
+            fields.add(f)
+        row.updated_at = timezone.now()
+        dirty.append(row)
+    if dirty:
+        with transaction.atomic():
+            Product.objects.bulk_update(dirty, sorted(fields) + ['updated_at'], batch_size=500)
+            if mongo is not None:
+                enqueue('product', *[p.sku for p in dirty], target='mongo')
+        updated += [p.sku for p in dirty]
+    errors.sort(key=lambda e: e['index'])
+    return updated, errors
@@ -0,0 +1,184 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+from .models import CatalogVersion
+
+_MISSING = object()
+
+class LRUCache:
+    def __init__(self, max_entries=512, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[1] is not None and entry[1] < time.monotonic():
+                del self._data[key]
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = (time.monotonic() + ttl) if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > max(0, self.max_entries):
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate):
+        with self._lock:
+            stale = [k for k, (v, _) in self._data.items() if predicate(k, v)]
+            for k in stale:
+                del self._data[k]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {'entries': len(self._data), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+# Catalog version: a single ORM row shared by every worker; any catalog write bumps it,
+# which retires every cached response keyed on the previous value.
+_version_local = {'token': None, 'checked': 0.0}
+
+def catalog_version(max_age=None):
+    # max_age lets a caller reuse the token another lookup in the same request just read
+    ttl = float(getattr(settings, 'CATALOG_VERSION_TTL', 0) or 0) if max_age is None else max_age
+    now = time.monotonic()
+    if ttl and _version_local['token'] is not None and now - _version_local['checked'] < ttl:
+        return _version_local['token']
+    row = CatalogVersion.objects.filter(pk=1).values_list('version', 'updated_at').first()
+    token = (row[0], row[1].timestamp()) if row else (0, 0.0)
+    _version_local.update(token=token, checked=now)
+    return token
+
+def bump_catalog_version():
+    now = timezone.now()
+    if not CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1, updated_at=now):
+        CatalogVersion.objects.get_or_create(pk=1, defaults={'version': 1, 'updated_at': now})
+    _version_local.update(token=None, checked=0.0)
+    count_cache.clear()
+
+response_cache = LRUCache(max_entries=getattr(settings, 'CATALOG_CACHE_MAX_ENTRIES', 512))
+_endpoint_stats = {}
+
+def _normalized_params(params):
+    return tuple(sorted((k, v) for k in params for v in params.getlist(k) if v != ''))
+
+def _with_validators(response, endpoint, etag, last_modified):
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        policy = (getattr(settings, 'CATALOG_CACHE_CONTROL', None) or {}).get(endpoint)
+        if policy and not response.has_header('Cache-Control'):
+            response['Cache-Control'] = policy
+    return response
+
+def cached_response(endpoint, request, build, extra=(), shared=True):
+    # Validators come from the catalog version alone, so a matching conditional GET
+    # is answered with 304 before any product query runs.
+    version = catalog_version()
+    params = _normalized_params(request.query_params)
+    key = (endpoint, version, tuple(extra), params)
+    etag = '"%s"' % hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    last_modified = int(version[1]) or None
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return _with_validators(not_modified, endpoint, etag, last_modified)
+    max_entries = int(getattr(settings, 'CATALOG_CACHE_MAX_ENTRIES', 512) or 0)
+    if not shared or max_entries <= 0:
+        return _with_validators(build(), endpoint, etag, last_modified)
+    response_cache.max_entries = max_entries
+    stats = _endpoint_stats.setdefault(endpoint, {'hits': 0, 'misses': 0})
+    data = response_cache.get(key, _MISSING)
+    if data is not _MISSING:
+        stats['hits'] += 1
+        return _with_validators(Response(data), endpoint, etag, last_modified)
+    stats['misses'] += 1
+    response = build()
+    if response.status_code == 200 and isinstance(response, Response) and not getattr(response, 'uncacheable', False):
+        response_cache.set(key, response.data)
+    return _with_validators(response, endpoint, etag, last_modified)
+
+# Product documents by catalog version and lookup key (ObjectId, ORM id or SKU). Writes made by the outbox
+# and media workers only reach this process through the version, so a document is never reused to build a
+# response for a newer version than it was read at. Local writes also drop their SKU's entries right away.
+product_doc_cache = LRUCache(
+    max_entries=getattr(settings, 'CATALOG_DETAIL_CACHE_MAX_ENTRIES', 2048),
+    ttl=getattr(settings, 'CATALOG_DETAIL_CACHE_TTL', 60),
+)
+
+def cached_product_doc(mongo, key):
+    key = str(key)
+    cache_key = (catalog_version(max_age=1)[0], key)
+    doc = product_doc_cache.get(cache_key, _MISSING)
+    if doc is _MISSING:
+        from .mongo import find_product_doc
+        doc = find_product_doc(mongo, key, {'sku': 1, 'public': 1})
+        if doc is not None and not isinstance(doc.get('public'), dict):
+            doc = find_product_doc(mongo, key)
+        if doc is not None:
+            product_doc_cache.set(cache_key, doc)
+    return doc
+
+def invalidate_product_doc(*skus):
+    skus = {s for s in skus if s}
+    if skus:
+        product_doc_cache.delete_where(lambda key, doc: key[1] in skus or doc.get('sku') in skus)
+
+# Facet counts and totals by filter key; the catalog version is part of every key
+facet_cache = LRUCache(
+    max_entries=getattr(settings, 'CATALOG_FACET_CACHE_MAX_ENTRIES', 256),
+    ttl=getattr(settings, 'CATALOG_FACET_CACHE_TTL', 300),
+)
+
+# Category rows (with product counts) by source and catalog version
+category_cache = LRUCache(max_entries=8)
+
+# Exact listing totals by catalog version and filter key, so paging through a listing counts it once. Any
+# process's write bumps the version and retires them; local writes also clear the cache outright.
+count_cache = LRUCache(
+    max_entries=getattr(settings, 'CATALOG_COUNT_CACHE_MAX_ENTRIES', 1024),
+    ttl=getattr(settings, 'CATALOG_COUNT_CACHE_TTL', 30),
+)
+
+def cache_stats():
+    return {
+        **response_cache.stats(),
+        'version': catalog_version()[0],
+        'endpoints': {k: dict(v) for k, v in _endpoint_stats.items()},
+        'product_docs': product_doc_cache.stats(),
+        'facets': facet_cache.stats(),
+        'counts': count_cache.stats(),
+        'categories': category_cache.stats(),
+    }
@@ -0,0 +1,51 @@
+from django.conf import settings
+from .cache import catalog_version, count_cache
+
+# ?count=exact counts the filtered listing (cached per filter key), estimate trades accuracy
+# for a bounded scan, none skips the total for infinite-scroll clients.
+COUNT_MODES = ('exact', 'estimate', 'none')
+COUNT_FILTERS = ('category', 'brand', 'search', 'min_price', 'max_price')
+
+def count_mode(params):
+    raw = (params.get('count') or '').strip().lower() or getattr(settings, 'CATALOG_COUNT_DEFAULT', 'exact')
+    return raw if raw in COUNT_MODES else None
+
+def is_filtered(params):
+    return any(params.get(k) for k in COUNT_FILTERS)
+
+def count_limit():
+    return max(1, int(getattr(settings, 'CATALOG_COUNT_ESTIMATE_LIMIT', 10000) or 1))
+
+def listing_total(scope, params, mode, exact, estimate):
+    # (total, estimated); an exact count already cached for these filters is always preferred.
+    # scope separates listings over different base queries (public, one seller's products).
+    if mode == 'none':
+        return None, False
+    key = (scope, catalog_version(max_age=1)[0], tuple((k, params.get(k) or '') for k in COUNT_FILTERS))
+    cached = count_cache.get(key)
+    if cached is not None:
+        return cached, False
+    if mode == 'estimate':
+        total, estimated = estimate()
+    else:
+        total, estimated = exact(), False
+    if not estimated:
+        count_cache.set(key, total)
+    return total, estimated
+
+def mongo_total(collection, query, params, mode, scope='mongo'):
+    def estimate():
+        if not is_filtered(params):
+            # Collection metadata only; includes hidden and out-of-stock documents
+            return collection.estimated_document_count(), True
+        limit = count_limit()
+        n = collection.count_documents(query, limit=limit + 1)
+        return (limit, True) if n > limit else (n, False)
+    return listing_total(scope, params, mode, lambda: collection.count_documents(query), estimate)
+
+def orm_total(queryset, params, mode, scope='orm'):
+    def estimate():
+        limit = count_limit()
+        n = queryset.order_by()[:limit + 1].count()
+        return (limit, True) if n > limit else (n, False)
+    return listing_total(scope, params, mode, queryset.count, estimate)
@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.db.models import Count, Q
+from .cache import catalog_version, facet_cache
+
+FACETS = ('brand', 'category', 'price', 'in_stock')
+# Brand and category lists are cut to the most common values
+FACET_LIMIT = 50
+
+def requested_facets(params):
+    raw = (params.get('facets') or '').strip().lower()
+    if not raw:
+        return ()
+    if raw in ('1', 'true', 'all'):
+        return FACETS
+    wanted = {f.strip() for f in raw.split(',')}
+    return tuple(f for f in FACETS if f in wanted)
+
+def price_buckets():
+    return list(getattr(settings, 'CATALOG_PRICE_BUCKETS', None) or [0, 25, 50, 100, 250, 500, 1000])
+
+def facet_cache_key(source, params, facets):
+    # Paging and field selection do not change the counts, so every page of a listing shares one entry
+    filters = tuple((k, params.get(k) or '') for k in ('category', 'brand', 'search', 'min_price', 'max_price'))
+    return (source, catalog_version()[0], filters, tuple(facets))
+
+def _price_rows(counts):
+    bounds = price_buckets()
+    rows = []
+    for i, lo in enumerate(bounds):
+        hi = bounds[i + 1] if i + 1 < len(bounds) else None
+        n = counts.get(lo, 0)
+        if n:
+            rows.append({'min': lo, 'max': hi, 'count': n})
+    return rows
+
+# Each facet is counted under every active filter except its own, so picking a brand
+# still shows how many products the other brands would return.
+def mongo_facet_stages(filters, facets):
+    def match(skip=None):
+        cond = {}
+        for name, c in filters.items():
+            if name != skip:
+                cond.update(c)
+        return [{'$match': cond}] if cond else []
+    stages = {'total': match() + [{'$count': 'n'}]}
+    for f in facets:
+        if f == 'price':
+            bounds = price_buckets()
+            stages[f] = match(f) + [{'$bucket': {'groupBy': '$price', 'boundaries': bounds + [float('inf')], 'default': 'other'}}]
+        else:
+            key = '$' + f
+            stages[f] = match(f) + [{'$group': {'_id': key, 'count': {'$sum': 1}}}, {'$sort': {'count': -1, '_id': 1}}, {'$limit': FACET_LIMIT}]
+    return stages
+
+def mongo_facets_from(row, facets):
+    out = {}
+    for f in facets:
+        buckets = row.get(f) or []
+        if f == 'price':
+            out[f] = _price_rows({b['_id']: b['count'] for b in buckets if b.get('_id') != 'other'})
+        else:
+            out[f] = [{'value': b['_id'], 'count': b['count']} for b in buckets if b.get('_id') not in (None, '')]
+    total = row.get('total') or []
+    return out, (total[0]['n'] if total else 0)
+
+def orm_facets(base, filters, facets):
+    def scoped(skip=None):
+        qs = base
+        for name, cond in filters.items():
+            if name != skip:
+                qs = qs.filter(cond)
+        return qs
+    out = {}
+    for f in facets:
+        qs = scoped(f).order_by()
+        if f == 'price':
+            bounds = price_buckets()
+            aggs = {}
+            for i, lo in enumerate(bounds):
+                cond = Q(price__gte=lo)
+                if i + 1 < len(bounds):
+                    cond &= Q(price__lt=bounds[i + 1])
+                aggs[f'b{i}'] = Count('id', filter=cond)
+            counts = qs.aggregate(**aggs)
+            out[f] = _price_rows({lo: counts[f'b{i}'] for i, lo in enumerate(bounds)})
+            continue
+        column = 'category__name' if f == 'category' else f
+        rows = qs.exclude(**{f'{column}__isnull': True}).values(column).annotate(count=Count('id')).order_by('-count', column)[:FACET_LIMIT]
+        out[f] = [{'value': r[column], 'count': r['count']} for r in rows if r[column] not in (None, '')]
+    return out, scoped().count()
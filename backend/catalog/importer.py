@@ -0,0 +1,267 @@
+import csv
+import json
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.utils import timezone
+from .models import Category, Product, standard_category_name
+from .mongo import product_doc_from_request, counted_category, stored_time
+from .visibility import visibility_fields
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+# Error rows echoed back in the report; the failed count covers all of them
+MAX_REPORTED_ERRORS = 1000
+ORM_UPDATE_FIELDS = [
+    'title', 'price', 'original_price', 'category', 'brand', 'description', 'image_url', 'image_variants', 'model_glb_url',
+    'sketchfab_embed_url', 'in_stock', 'rating', 'features', 'stock', 'is_seed', 'is_public', 'owner', 'updated_at',
+]
+_TRUE = ('1', 'true', 'yes', 'y')
+_FALSE = ('0', 'false', 'no', 'n')
+
+def import_format(name='', content_type='', explicit=None):
+    if explicit:
+        return explicit if explicit in IMPORT_FORMATS else None
+    name = (name or '').lower()
+    content_type = (content_type or '').lower()
+    if name.endswith('.csv') or 'csv' in content_type:
+        return 'csv'
+    if name.endswith(('.ndjson', '.jsonl')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'ndjson'
+    return None
+
+def _text_lines(lines):
+    first = True
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if first:
+            line = line.lstrip('\ufeff')
+            first = False
+        yield line
+
+def iter_rows(lines, fmt):
+    # Yields (row number, dict or None, error); the source is read line by line, never as a whole
+    lines = _text_lines(lines)
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, {k.strip(): v for k, v in row.items() if k}, None
+        return
+    for n, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield n, None, 'Invalid JSON'
+            continue
+        if not isinstance(row, dict):
+            yield n, None, 'Expected a JSON object'
+            continue
+        yield n, row, None
+
+def row_doc(row, owner_email):
+    # Normalizes text cells the way product_doc_from_request expects them, then checks what it leaves open
+    data = {k: (v.strip() if isinstance(v, str) else v) for k, v in row.items()}
+    data = {k: v for k, v in data.items() if v not in (None, '')}
+    if isinstance(data.get('in_stock'), str):
+        flag = data['in_stock'].lower()
+        if flag not in _TRUE + _FALSE:
+            return None, 'Invalid in_stock'
+        data['in_stock'] = flag in _TRUE
+    if not (data.get('title') or data.get('name')):
+        return None, 'Missing title'
+    if not (data.get('category') or data.get('category_name')):
+        return None, 'Missing category'
+    for key in ('price', 'original_price', 'rating'):
+        if key in data:
+            try:
+                value = float(data[key])
+            except (TypeError, ValueError):
+                return None, f'Invalid {key}'
+            if value != value or value < 0:
+                return None, f'Invalid {key}'
+    for key, limit in (('title', 255), ('name', 255), ('sku', 64), ('brand', 128), ('category', 64), ('category_name', 64)):
+        if len(str(data.get(key) or '')) > limit:
+            return None, f'{key} is longer than {limit} characters'
+    if 'stock' in data:
+        try:
+            if int(data['stock']) < 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            return None, 'Invalid stock'
+    doc = product_doc_from_request(data, None, owner_email)
+    doc['category'] = standard_category_name(str(doc['category']).strip())
+    return doc, None
+
+def to_money(value):
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+class ProductImporter:
+    def __init__(self, owner, chunk_size=500, dry_run=False):
+        self.owner = owner
+        self.owner_email = getattr(owner, 'email', None)
+        self.chunk_size = max(1, int(chunk_size))
+        self.dry_run = dry_run
+        self.mongo = getattr(settings, 'MONGO_DB', None)
+        self.stats = {'rows': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'failed': 0, 'errors': [], 'batches': 0}
+        self.skus = set()
+
+    def error(self, row, sku, message):
+        self.stats['failed'] += 1
+        if len(self.stats['errors']) < MAX_REPORTED_ERRORS:
+            self.stats['errors'].append({'row': row, 'sku': sku or None, 'error': message})
+
+    def run(self, rows):
+        started = time.perf_counter()
+        batch = []
+        for n, row, problem in rows:
+            self.stats['rows'] += 1
+            if problem:
+                self.error(n, None, problem)
+                continue
+            doc, problem = row_doc(row, self.owner_email)
+            if problem:
+                self.error(n, row.get('sku'), problem)
+                continue
+            batch.append((n, doc))
+            if len(batch) >= self.chunk_size:
+                self.write(batch)
+                batch = []
+        if batch:
+            self.write(batch)
+        elapsed = time.perf_counter() - started
+        self.stats['seconds'] = round(elapsed, 3)
+        self.stats['rows_per_second'] = round(self.stats['rows'] / elapsed, 1) if elapsed > 0 else None
+        return self.stats
+
+    def write(self, batch):
+        # A SKU repeated within the batch keeps its last row, as separate upserts would
+        docs = {doc['sku']: (n, doc) for n, doc in batch}
+        foreign = self.foreign_skus(list(docs))
+        for sku in foreign:
+            self.error(docs.pop(sku)[0], sku, 'SKU belongs to another seller')
+        if not docs:
+            return
+        self.stats['batches'] += 1
+        if self.dry_run:
+            found = len(self.existing_orm(list(docs)))
+            self.stats['updated'] += found
+            self.stats['created'] += len(docs) - found
+            return
+        try:
+            if self.mongo is not None:
+                # Rows Mongo rejected are reported alone; the rest of the batch is written to the ORM as usual
+                for sku, problem in self.write_mongo([doc for _, doc in docs.values()]).items():
+                    self.error(docs.pop(sku)[0], sku, problem)
+            if docs:
+                self.write_orm([doc for _, doc in docs.values()])
+        except Exception as e:
+            for sku, (n, _) in docs.items():
+                self.error(n, sku, f'Batch write failed: {e}')
+        self.skus.update(docs)
+
+    def foreign_skus(self, skus):
+        owned_elsewhere = set(
+            Product.objects.filter(sku__in=skus).exclude(owner=self.owner).exclude(owner__isnull=True).values_list('sku', flat=True)
+        )
+        if self.mongo is not None:
+            for d in self.mongo['products'].find({'sku': {'$in': skus}, 'owner_email': {'$nin': [self.owner_email, None]}}, {'sku': 1}):
+                owned_elsewhere.add(d['sku'])
+        return owned_elsewhere
+
+    def existing_orm(self, skus):
+        return {p.sku: p for p in Product.objects.filter(sku__in=skus).select_related(None)}
+
+    def write_mongo(self, docs):
+        # Returns {sku: error} for the documents the unordered bulk write rejected; the others are written
+        from pymongo import UpdateOne
+        from pymongo.errors import BulkWriteError
+        before = {d['sku']: d for d in self.mongo['products'].find({'sku': {'$in': [d['sku'] for d in docs]}}, {'sku': 1, 'category': 1, 'is_public': 1, 'in_stock': 1})}
+        failed = {}
+        try:
+            self.mongo['products'].bulk_write([UpdateOne({'sku': d['sku']}, {'$set': d}, upsert=True) for d in docs], ordered=False)
+        except BulkWriteError as e:
+            for err in (e.details or {}).get('writeErrors') or []:
+                failed[docs[err['index']]['sku']] = f"Write failed: {err.get('errmsg') or err.get('code')}"
+            if not failed:
+                raise
+        # Category counters move by the net change per category of the documents that were written
+        written = [d for d in docs if d['sku'] not in failed]
+        deltas = {d['category']: 0 for d in written}
+        for doc in written:
+            old, new = counted_category(before.get(doc['sku'])), counted_category(doc)
+            if old != new:
+                if old:
+                    deltas[old] = deltas.get(old, 0) - 1
+                if new:
+                    deltas[new] = deltas.get(new, 0) + 1
+        counters = [UpdateOne({'name': name}, {'$inc': {'product_count': delta}}, upsert=True) for name, delta in deltas.items() if name]
+        if counters:
+            self.mongo['categories'].bulk_write(counters, ordered=False)
+        return failed
+
+    def write_orm(self, docs):
+        created, updated, unchanged = upsert_orm_products(docs, {d['sku']: self.owner.pk for d in docs}, self.chunk_size)
+        self.stats['created'] += created
+        self.stats['updated'] += updated
+        self.stats['unchanged'] += unchanged
+
+def orm_categories(names):
+    categories = {c.name: c for c in Category.objects.filter(name__in=names)}
+    for name in set(names) - set(categories):
+        categories[name], _ = Category.objects.get_or_create(name=name)
+    return categories
+
+def upsert_orm_products(docs, owner_ids, batch_size=500):
+    # Product documents -> ORM rows by SKU; owner_ids maps SKU to a user id (None keeps an existing row's owner).
+    # Updated rows take the document's updated_at, so the outbox can tell which store holds the newer copy.
+    # Returns (created, updated, unchanged).
+    categories = orm_categories({d.get('category') or '' for d in docs})
+    existing = {p.sku: p for p in Product.objects.filter(sku__in=[d['sku'] for d in docs]).select_related(None)}
+    now = timezone.now()
+    created, updated, unchanged = [], [], 0
+    for doc in docs:
+        flags = visibility_fields(doc['sku'], doc.get('brand'), doc.get('owner_email')) if 'is_public' not in doc else doc
+        values = {
+            'title': doc.get('title') or doc.get('name') or '',
+            'price': to_money(doc.get('price')),
+            'original_price': to_money(doc.get('original_price')),
+            'category_id': categories[doc.get('category') or ''].pk,
+            'brand': doc.get('brand') or '',
+            'description': doc.get('description') or '',
+            'image_url': doc.get('image_url') or '',
+            'image_variants': list(doc.get('image_variants') or []),
+            'model_glb_url': doc.get('model_glb_url') or '',
+            'sketchfab_embed_url': doc.get('sketchfab_embed_url') or '',
+            'in_stock': bool(doc.get('in_stock', True)),
+            'rating': float(doc.get('rating') or 0),
+            'features': list(doc.get('features') or []),
+            'stock': int(doc.get('stock') or 0),
+            'is_seed': bool(flags.get('is_seed')),
+            'is_public': bool(flags.get('is_public', True)),
+        }
+        owner_id = owner_ids.get(doc['sku'])
+        product = existing.get(doc['sku'])
+        if product is None:
+            created.append(Product(sku=doc['sku'], owner_id=owner_id, updated_at=now, **values))
+            continue
+        if owner_id is not None:
+            values['owner_id'] = owner_id
+        # Rows that would not change skip bulk_update, whose CASE statements dominate the cost
+        if all(getattr(product, k) == v for k, v in values.items()):
+            unchanged += 1
+            continue
+        for k, v in values.items():
+            setattr(product, k, v)
+        product.updated_at = stored_time(doc.get('updated_at')) or now
+        updated.append(product)
+    Product.objects.bulk_create(created, batch_size=batch_size)
+    # bulk_create stamps new rows with the current time (auto_now); give them their document's instead
+    stamps = {d['sku']: stored_time(d.get('updated_at')) for d in docs}
+    restamped = [p for p in created if p.pk and stamps.get(p.sku)]
+    for p in restamped:
+        p.updated_at = stamps[p.sku]
+    Product.objects.bulk_update(restamped, ['updated_at'], batch_size=min(batch_size, 100))
+    Product.objects.bulk_update(updated, ORM_UPDATE_FIELDS, batch_size=min(batch_size, 100))
+    return len(created), len(updated), unchanged
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from catalog.models import Product
+from catalog.visibility import visibility_fields
+
+class Command(BaseCommand):
+    help = 'Backfill is_seed/is_public visibility flags on Mongo product documents and ORM products in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Report how many products would change without writing')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        dry_run = options['dry_run']
+        mongo = getattr(settings, 'MONGO_DB', None)
+        if mongo is not None:
+            from pymongo import UpdateOne
+            scanned = changed = 0
+            last_id = None
+            projection = {'sku': 1, 'brand': 1, 'owner_email': 1, 'is_seed': 1, 'is_public': 1}
+            while True:
+                query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+                docs = list(mongo['products'].find(query, projection).sort('_id', 1).limit(batch_size))
+                if not docs:
+                    break
+                last_id = docs[-1]['_id']
+                ops = []
+                for d in docs:
+                    flags = visibility_fields(d.get('sku'), d.get('brand'), d.get('owner_email'))
+                    if any(d.get(k) != v for k, v in flags.items()):
+                        ops.append(UpdateOne({'_id': d['_id']}, {'$set': flags}))
+                scanned += len(docs)
+                changed += len(ops)
+                if ops and not dry_run:
+                    mongo['products'].bulk_write(ops, ordered=False)
+            self.stdout.write(f'Mongo products: scanned {scanned}, updated {changed}')
+        scanned = changed = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                Product.objects.filter(pk__gt=last_pk)
+                .select_related('owner')
+                .only('id', 'sku', 'brand', 'is_seed', 'is_public', 'owner', 'owner__email')
+                .order_by('pk')[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            dirty = []
+            for p in batch:
+                flags = visibility_fields(p.sku, p.brand, getattr(p.owner, 'email', None))
+                if p.is_seed != flags['is_seed'] or p.is_public != flags['is_public']:
+                    p.is_seed = flags['is_seed']
+                    p.is_public = flags['is_public']
+                    dirty.append(p)
+            scanned += len(batch)
+            changed += len(dirty)
+            if dirty and not dry_run:
+                Product.objects.bulk_update(dirty, ['is_seed', 'is_public'])
+        self.stdout.write(f'ORM products: scanned {scanned}, updated {changed}')
+        self.stdout.write(self.style.SUCCESS('Dry run complete' if dry_run else 'Visibility flags backfilled'))
@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from catalog.views import product_list_query
+from catalog.pagination import mongo_keyset_filter
+import secrets
+import time
+
+class Command(BaseCommand):
+    help = 'Compare deep-page latency of skip/limit and keyset (cursor) pagination on a scratch products collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--docs', type=int, default=50000, help='Number of synthetic products to insert')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--pages', default='1,10,100,1000,2000', help='Comma-separated page numbers to measure')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per page; the median is reported')
+        parser.add_argument('--category', default='', help='Also filter by this category (synthetic data uses Rings/Glasses/Watches/Shoes)')
+
+    def handle(self, *args, **options):
+        mongo = getattr(settings, 'MONGO_DB', None)
+        if mongo is None:
+            raise CommandError('MONGO_DB is not configured')
+        n = options['docs']
+        page_size = options['page_size']
+        pages = [int(p) for p in str(options['pages']).split(',') if p.strip()]
+        repeat = max(1, options['repeat'])
+        category = options['category'] or None
+        coll = mongo['bench_products_' + secrets.token_hex(3)]
+        cats = ['Rings', 'Glasses', 'Watches', 'Shoes']
+        try:
+            self.stdout.write(f'Inserting {n} products into {coll.name}...')
+            batch = []
+            for i in range(n):
+                batch.append({
+                    'title': f'Bench product {i}',
+                    'price': float(i % 500),
+                    'category': cats[i % len(cats)],
+                    'brand': f'Brand {i % 37}',
+                    'description': 'Synthetic product used for pagination benchmarks.',
+                    'in_stock': True,
+                    'owner_email': 'bench@stylesathi.com',
+                    'sku': f'BENCH-{i:08d}',
+                    'stock': 5,
+                })
+                if len(batch) >= 1000:
+                    coll.insert_many(batch, ordered=False)
+                    batch = []
+            if batch:
+                coll.insert_many(batch, ordered=False)
+            coll.create_index([('category', 1), ('_id', -1)])
+            query = product_list_query(category)
+            # Page boundaries are collected up front so keyset timings measure only the page fetch.
+            ids = [d['_id'] for d in coll.find(query, {'_id': 1}).sort('_id', -1)]
+            self.stdout.write(f'{"page":>8} {"skip/limit ms":>15} {"keyset ms":>12}')
+            for page in pages:
+                offset = (page - 1) * page_size
+                if offset >= len(ids):
+                    self.stdout.write(f'{page:>8} {"(past end)":>15}')
+                    continue
+                skip_ms = self._median_ms(repeat, lambda: list(coll.find(query).sort('_id', -1).skip(offset).limit(page_size)))
+                if offset:
+                    keyset = {**query, **mongo_keyset_filter({'id': str(ids[offset - 1])})}
+                else:
+                    keyset = query
+                keyset_ms = self._median_ms(repeat, lambda: list(coll.find(keyset).sort('_id', -1).limit(page_size)))
+                self.stdout.write(f'{page:>8} {skip_ms:>15.2f} {keyset_ms:>12.2f}')
+        finally:
+            coll.drop()
+
+    def _median_ms(self, repeat, fn):
+        samples = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - t0) * 1000)
+        samples.sort()
+        return samples[len(samples) // 2]
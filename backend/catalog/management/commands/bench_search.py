@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from catalog.views import product_list_query
+from catalog.search import build_index, tokenize
+import random
+import time
+
+class Command(BaseCommand):
+    help = 'Compare ?search= latency of the in-process BM25 index against the Mongo $text query it replaces'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=200, help='Number of queries sampled from product titles')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        mongo = getattr(settings, 'MONGO_DB', None)
+        if mongo is None:
+            raise CommandError('MONGO_DB is not configured')
+        page_size = options['page_size']
+        t0 = time.perf_counter()
+        index, _ = build_index('mongo')
+        self.stdout.write(f'Built index over {len(index)} product(s) in {(time.perf_counter() - t0) * 1000:.0f} ms')
+        words = sorted({t for d in mongo['products'].find({}, {'title': 1}).limit(5000) for t in tokenize(d.get('title')) if len(t) > 2})
+        if not words:
+            raise CommandError('No product titles to sample queries from')
+        rnd = random.Random(options['seed'])
+        queries = [rnd.choice(words) for _ in range(max(1, options['queries']))]
+        filters = {'is_public': True, 'in_stock': True}
+        index_ms = []
+        text_ms = []
+        for q in queries:
+            # Both sides produce a ranked first page plus the total, as the listing endpoint does
+            t0 = time.perf_counter()
+            ids = [doc_id for doc_id, _ in index.search(q, filters)]
+            from bson import ObjectId
+            page = [ObjectId(i) for i in ids[:page_size]]
+            list(mongo['products'].find({'_id': {'$in': page}}, {'public': 1}))
+            index_ms.append((time.perf_counter() - t0) * 1000)
+            query = product_list_query(search=q)
+            t0 = time.perf_counter()
+            mongo['products'].count_documents(query)
+            list(mongo['products'].find(query, {'public': 1, 'score': {'$meta': 'textScore'}}).sort([('score', {'$meta': 'textScore'})]).limit(page_size))
+            text_ms.append((time.perf_counter() - t0) * 1000)
+        self.stdout.write(f'{"":>8} {"p50 ms":>10} {"p95 ms":>10}')
+        for name, samples in (('bm25', index_ms), ('$text', text_ms)):
+            samples.sort()
+            p50 = samples[len(samples) // 2]
+            p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+            self.stdout.write(f'{name:>8} {p50:>10.2f} {p95:>10.2f}')
@@ -0,0 +1,181 @@
+import os
+import time
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+from concurrent.futures import ProcessPoolExecutor
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.utils import timezone
+from catalog.blobs import doc_blob_keys, product_blob_keys, save_local_blob, save_storage_blob, track_media
+from catalog.media import media_file, queue_media_upload, run_bounded
+from catalog.models import Product
+from catalog.mongo import _absolute_media_url, targeted_set
+from catalog.variants import group_variants, is_image_name, render_variants, variant_quality, variant_widths
+from catalog.views import product_changed
+from outbox.events import enqueue, mirrored_write
+
+# Originals larger than this are not downloaded with --fetch-remote
+FETCH_MAX_BYTES = 20 * 1024 * 1024
+
+def fetch_original(url, timeout):
+    with urlopen(Request(url, headers={'User-Agent': 'stylesathi-image-variants'}), timeout=timeout) as res:
+        data = res.read(FETCH_MAX_BYTES + 1)
+    if len(data) > FETCH_MAX_BYTES:
+        raise ValueError(f'Original is larger than {FETCH_MAX_BYTES} bytes')
+    return data
+
+class Command(BaseCommand):
+    help = 'Generate responsive derivatives (JPEG + WebP per IMAGE_VARIANT_WIDTHS) for product images uploaded before they existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Processes resizing images (default: one per CPU)')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--force', action='store_true', help='Regenerate products that already have derivatives')
+        parser.add_argument('--fetch-remote', action='store_true', help='Download originals that are not local media files (e.g. Cloudinary URLs)')
+        parser.add_argument('--fetch-timeout', type=float, default=30, help='Seconds allowed per remote original (default: 30)')
+
+    def handle(self, *args, **options):
+        self.batch_size = max(1, options['batch_size'])
+        self.force = options['force']
+        self.fetch_remote, self.fetch_timeout = options['fetch_remote'], options['fetch_timeout']
+        self.widths, self.quality = variant_widths(), variant_quality()
+        self.mongo = getattr(settings, 'MONGO_DB', None)
+        self.stats = {'products': 0, 'files': 0, 'skipped': 0, 'remote': 0, 'failed': 0}
+        started = time.monotonic()
+        # Decoding and resizing is CPU bound, so it runs in processes; this process only reads and writes files
+        with ProcessPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            if self.mongo is not None:
+                self.backfill_mongo(pool)
+            self.backfill_orm(pool)
+        self.stdout.write(self.style.SUCCESS(
+            ' '.join(f'{k}={v}' for k, v in self.stats.items()) + f' in {time.monotonic() - started:.1f}s'
+        ))
+        if self.stats['remote'] and not self.fetch_remote:
+            self.stderr.write(self.style.WARNING(
+                f"{self.stats['remote']} products have remote originals and were left without derivatives; rerun with --fetch-remote"
+            ))
+
+    def failed(self, sku, e):
+        self.stats['failed'] += 1
+        self.stderr.write(f'{sku}: {str(e) or e.__class__.__name__}')
+
+    def originals(self, docs):
+        # [(doc, bytes)] for the batch: local media files are read, remote URLs downloaded side by side with --fetch-remote
+        local, remote = [], []
+        for d in docs:
+            path = media_file(d['image_url'])
+            if path is not None:
+                if not is_image_name(path):
+                    self.stats['skipped'] += 1
+                elif os.path.isfile(path):
+                    local.append((d, path))
+                else:
+                    self.failed(d['sku'], FileNotFoundError(f"{d['image_url']} is missing from MEDIA_ROOT"))
+            elif urlparse(d['image_url']).scheme in ('http', 'https'):
+                self.stats['remote'] += 1
+                if self.fetch_remote:
+                    remote.append(d)
+            else:
+                self.stats['skipped'] += 1
+        out = []
+        for d, path in local:
+            try:
+                with open(path, 'rb') as f:
+                    out.append((d, f.read()))
+            except OSError as e:
+                self.failed(d['sku'], e)
+        fetched = run_bounded(fetch_original, [(d['image_url'], self.fetch_timeout) for d in remote], timeout=0)
+        for d, (data, error) in zip(remote, fetched):
+            if error:
+                self.failed(d['sku'], RuntimeError(f"Fetching {d['image_url']} failed: {error}"))
+            else:
+                out.append((d, data))
+        return out
+
+    def rendered(self, sku, future):
+        try:
+            return future.result()
+        except Exception as e:
+            self.failed(sku, e)
+            return None
+
+    def backfill_mongo(self, pool):
+        # Documents whose image is a local media file, or a remote one with --fetch-remote; derivatives are stored
+        # as local blobs so a configured remote uploader moves them along with the rest of the product's media
+        from pymongo import UpdateOne
+        query = {'image_url': {'$nin': [None, '']}}
+        if not self.force:
+            query['image_variants.0'] = {'$exists': False}
+        last_id = None
+        while True:
+            q = dict(query)
+            if last_id is not None:
+                q['_id'] = {'$gt': last_id}
+            docs = list(self.mongo['products'].find(q, {'sku': 1, 'image_url': 1, 'model_glb_url': 1, 'images': 1, 'public_base': 1}).sort('_id', 1).limit(self.batch_size))
+            if not docs:
+                break
+            last_id = docs[-1]['_id']
+            jobs = [(d, pool.submit(render_variants, data, self.widths, self.quality)) for d, data in self.originals(docs)]
+            ops, done = [], []
+            for d, future in jobs:
+                rendered = self.rendered(d['sku'], future)
+                if rendered is None:
+                    continue
+                items = [(width, fmt, _absolute_media_url(save_local_blob(body, f'w{width}.{ext}'))) for width, fmt, ext, body in rendered]
+                d['image_variants'] = group_variants(items)
+                self.stats['files'] += len(items)
+                # Skipped if the image was replaced meanwhile; its new upload brought its own derivatives
+                ops.append(UpdateOne({'_id': d['_id'], 'image_url': d['image_url']},
+                                     {'$set': targeted_set({'image_variants': d['image_variants']}, with_public='public_base' in d)}))
+                done.append(d)
+            if ops:
+                skus = [d['sku'] for d in done]
+                with mirrored_write('product', *skus):
+                    self.mongo['products'].bulk_write(ops, ordered=False)
+                for d in done:
+                    track_media(d['sku'], doc_blob_keys(d))
+                    queue_media_upload(self.mongo, d)
+                product_changed(*skus)
+                self.stats['products'] += len(done)
+
+    def backfill_orm(self, pool):
+        qs = Product.objects.exclude(image='').exclude(image__isnull=True)
+        if not self.force:
+            qs = qs.filter(image_variants=[])
+        last = 0
+        while True:
+            batch = list(qs.filter(id__gt=last).order_by('id').only('id', 'sku', 'image', 'image_url', 'model_glb_url', 'image_variants', 'updated_at').prefetch_related('images')[:self.batch_size])
+            if not batch:
+                break
+            last = batch[-1].id
+            jobs = []
+            for p in batch:
+                if not is_image_name(p.image.name):
+                    self.stats['skipped'] += 1
+                    continue
+                try:
+                    with default_storage.open(p.image.name, 'rb') as f:
+                        jobs.append((p, pool.submit(render_variants, f.read(), self.widths, self.quality)))
+                except Exception as e:
+                    self.failed(p.sku, e)
+            changed = []
+            for p, future in jobs:
+                rendered = self.rendered(p.sku, future)
+                if rendered is None:
+                    continue
+                items = [(width, fmt, default_storage.url(save_storage_blob(body, f'w{width}.{ext}'))) for width, fmt, ext, body in rendered]
+                p.image_variants = group_variants(items)
+                # bulk_update skips auto_now; the outbox compares updated_at to pick the newer copy
+                p.updated_at = timezone.now()
+                self.stats['files'] += len(items)
+                changed.append(p)
+            if changed:
+                Product.objects.bulk_update(changed, ['image_variants', 'updated_at'])
+                for p in changed:
+                    track_media(p.sku, product_blob_keys(p))
+                skus = [p.sku for p in changed]
+                if self.mongo is not None:
+                    enqueue('product', *skus, target='mongo')
+                product_changed(*skus)
+                self.stats['products'] += len(changed)
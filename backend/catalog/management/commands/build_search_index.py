@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from catalog.search import build_index, save_snapshot, index_source
+import time
+
+class Command(BaseCommand):
+    help = 'Build the product search index and write the snapshot that web workers load on start'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='', help='Snapshot file (defaults to SEARCH_INDEX_PATH)')
+
+    def handle(self, *args, **options):
+        path = options['path'] or getattr(settings, 'SEARCH_INDEX_PATH', '')
+        if not path:
+            raise CommandError('No snapshot path: set SEARCH_INDEX_PATH or pass --path')
+        source = index_source()
+        t0 = time.perf_counter()
+        index, synced_at = build_index(source)
+        save_snapshot(index, source, synced_at, path)
+        elapsed = time.perf_counter() - t0
+        self.stdout.write(self.style.SUCCESS(f'Indexed {len(index)} product(s) from {source} in {elapsed:.2f}s -> {path}'))
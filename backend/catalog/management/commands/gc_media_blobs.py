@@ -0,0 +1,87 @@
+import os
+import time
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.utils import timezone
+from catalog.blobs import BLOB_DIR, blob_grace, collect_blobs, doc_blob_keys, product_blob_keys
+from catalog.models import MediaBlob, MediaReference, Product
+
+class Command(BaseCommand):
+    help = 'Rebuild the media reference index from both catalogs, then delete blobs that no product uses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=None, help='Seconds an unreferenced blob is kept after its last use (default: MEDIA_BLOB_GRACE_SECONDS)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.batch_size = max(1, options['batch_size'])
+        grace = blob_grace() if options['grace'] is None else max(0, options['grace'])
+        started = time.monotonic()
+        pairs = self.live_pairs()
+        added, dropped = self.sync_index(pairs)
+        collected = collect_blobs(grace=grace)
+        orphans = self.remove_orphan_files(grace)
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(pairs)} reference(s): {added} added, {dropped} dropped; {collected} blob(s) collected, '
+            f'{orphans} untracked file(s) removed in {time.monotonic() - started:.1f}s'
+        ))
+
+    def live_pairs(self):
+        # (blob key, sku) for every blob a product in either store points at
+        pairs = set()
+        mongo = getattr(settings, 'MONGO_DB', None)
+        if mongo is not None:
+            last_id = None
+            while True:
+                query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+                docs = list(mongo['products'].find(query, {'sku': 1, 'image_url': 1, 'image_variants': 1, 'model_glb_url': 1, 'images': 1}).sort('_id', 1).limit(self.batch_size))
+                if not docs:
+                    break
+                last_id = docs[-1]['_id']
+                pairs.update((key, d['sku']) for d in docs if d.get('sku') for key in doc_blob_keys(d))
+        last = 0
+        while True:
+            batch = list(Product.objects.filter(id__gt=last).order_by('id').only('id', 'sku', 'image', 'image_url', 'model_glb_url', 'image_variants').prefetch_related('images')[:self.batch_size])
+            if not batch:
+                break
+            last = batch[-1].id
+            pairs.update((key, p.sku) for p in batch if p.sku for key in product_blob_keys(p))
+        return pairs
+
+    def sync_index(self, pairs):
+        now = timezone.now()
+        missing = {k for k, _ in pairs} - set(MediaBlob.objects.values_list('key', flat=True))
+        MediaBlob.objects.bulk_create([MediaBlob(key=k, touched_at=now) for k in missing], ignore_conflicts=True, batch_size=self.batch_size)
+        ids = dict(MediaBlob.objects.values_list('key', 'id'))
+        wanted = {(ids[k], sku) for k, sku in pairs}
+        existing = set(MediaReference.objects.values_list('blob_id', 'sku'))
+        # References added by requests since the scan may be dropped here; storing or tracking a blob touches it,
+        # so the grace period still protects it until the next save re-adds the reference
+        stale = {}
+        for blob_id, sku in existing - wanted:
+            stale.setdefault(sku, []).append(blob_id)
+        for sku, blob_ids in stale.items():
+            MediaReference.objects.filter(sku=sku, blob_id__in=blob_ids).delete()
+        MediaReference.objects.bulk_create([MediaReference(blob_id=b, sku=s) for b, s in wanted - existing], ignore_conflicts=True, batch_size=self.batch_size)
+        return len(wanted - existing), len(existing - wanted)
+
+    def remove_orphan_files(self, grace):
+        # Blob files with no index row, e.g. from a request that failed before saving its product
+        root = os.path.join(str(settings.MEDIA_ROOT), BLOB_DIR)
+        if not os.path.isdir(root):
+            return 0
+        known = set(MediaBlob.objects.values_list('key', flat=True))
+        cutoff = time.time() - grace
+        removed = 0
+        for folder, _, files in os.walk(root):
+            for name in files:
+                path = os.path.join(folder, name)
+                key = '/'.join([BLOB_DIR] + os.path.relpath(path, root).split(os.sep))
+                if key in known or os.path.getmtime(path) >= cutoff:
+                    continue
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
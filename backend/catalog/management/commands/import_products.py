@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from catalog.importer import ProductImporter, import_format, iter_rows, IMPORT_FORMATS
+from catalog.views import product_changed
+
+class Command(BaseCommand):
+    help = 'Bulk import products for one seller from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--owner', required=True, help='Email of the seller who will own the products')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=getattr(settings, 'CATALOG_IMPORT_CHUNK_SIZE', 500))
+        parser.add_argument('--dry-run', action='store_true', help='Validate rows and report without writing')
+
+    def handle(self, *args, **options):
+        owner = get_user_model().objects.filter(email=options['owner']).first()
+        if owner is None:
+            raise CommandError(f"No user with email {options['owner']}")
+        fmt = import_format(options['path'], '', options['format'])
+        if fmt is None:
+            raise CommandError('Cannot tell the format from the file name; pass --format')
+        importer = ProductImporter(owner, options['chunk_size'], dry_run=options['dry_run'])
+        with open(options['path'], 'rb') as fh:
+            stats = importer.run(iter_rows(fh, fmt))
+        if importer.skus:
+            product_changed(*importer.skus)
+        for err in stats['errors'][:50]:
+            self.stderr.write(f"row {err['row']}: {err['sku'] or '-'}: {err['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['rows']} row(s): {stats['created']} created, {stats['updated']} updated, {stats['unchanged']} unchanged, {stats['failed']} failed "
+            f"in {stats['seconds']}s ({stats['rows_per_second']} rows/s)"
+        ))
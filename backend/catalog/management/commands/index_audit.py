@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from catalog.views import product_list_query
+from catalog.pagination import mongo_sort, mongo_keyset_filter
+from stylesathi_backend.mongo_indexes import plan_summary
+
+SAMPLE_EMAIL = 'audit@stylesathi.com'
+
+# Filters and sorts mirror what the views send to Mongo; values are placeholders since only the shape matters.
+QUERY_SHAPES = [
+    ('products: public listing', 'products', product_list_query(), [('_id', -1)]),
+    ('products: public listing by category', 'products', product_list_query('Rings'), [('_id', -1)]),
+    ('products: listing by price', 'products', product_list_query(min_price=10, max_price=100), mongo_sort('price')),
+    ('products: category by price desc', 'products', product_list_query('Rings'), mongo_sort('-price')),
+    ('products: listing by rating', 'products', product_list_query(), mongo_sort('-rating')),
+    ('products: category by rating', 'products', product_list_query('Rings'), mongo_sort('-rating')),
+    ('products: search', 'products', product_list_query(None, 'ring'), None),
+    ('products: seller listing', 'products', {'owner_email': SAMPLE_EMAIL, 'is_seed': False}, [('_id', -1)]),
+    ('products: seller listing page', 'products', {'owner_email': SAMPLE_EMAIL, 'is_seed': False, **mongo_keyset_filter({'id': '65a000000000000000000001'})}, [('_id', -1)]),
+    ('products: by sku', 'products', {'sku': 'SKU-AUDIT'}, None),
+    ('categories: list', 'categories', {}, [('name', 1)]),
+    ('carts: by user', 'carts', {'user_email': SAMPLE_EMAIL}, None),
+    ('orders: by id', 'orders', {'order_id': 'ORD-AUDIT', 'user_email': SAMPLE_EMAIL}, None),
+    ('orders: seller listing', 'orders', {'items.owner_email': SAMPLE_EMAIL}, [('created_at', -1)]),
+    ('orders: seller detail', 'orders', {'order_id': 'ORD-AUDIT', 'items.owner_email': SAMPLE_EMAIL}, None),
+    ('orders: admin listing', 'orders', {}, [('created_at', -1)]),
+    ('users: by email', 'users', {'email': SAMPLE_EMAIL}, None),
+    ('users: admin listing', 'users', {'is_active': True}, [('date_joined', -1)]),
+]
+
+class Command(BaseCommand):
+    help = 'Explain the query shapes used by the views and report collection scans, blocking sorts and unused indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--strict', action='store_true', help='Exit non-zero when any query shape needs a COLLSCAN or blocking SORT')
+
+    def handle(self, *args, **options):
+        mongo = getattr(settings, 'MONGO_DB', None)
+        if mongo is None:
+            raise CommandError('MONGO_DB is not configured')
+        problems = 0
+        used = {}
+        for label, coll, query, sort in QUERY_SHAPES:
+            cursor = mongo[coll].find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            try:
+                summary = plan_summary(cursor.limit(20).explain())
+            except Exception as e:
+                self.stderr.write(f'{label}: explain failed ({e})')
+                continue
+            used.setdefault(coll, set()).update(summary['indexes'])
+            flags = [s for s in summary['stages'] if s in ('COLLSCAN', 'SORT')]
+            if flags:
+                problems += 1
+            status = ', '.join(sorted(set(flags))) or 'ok'
+            indexes = ', '.join(sorted(summary['indexes'])) or '-'
+            self.stdout.write(f'{label:<40} {status:<16} {indexes}')
+        self.stdout.write('')
+        for coll in sorted({c for _, c, _, _ in QUERY_SHAPES}):
+            try:
+                stats = list(mongo[coll].aggregate([{'$indexStats': {}}]))
+            except Exception:
+                stats = [{'name': n} for n in mongo[coll].index_information()]
+            for st in stats:
+                name = st.get('name')
+                if name == '_id_' or name in used.get(coll, set()):
+                    continue
+                ops = (st.get('accesses') or {}).get('ops')
+                self.stdout.write(f'unused by audited shapes: {coll}.{name}' + (f' (ops since restart: {ops})' if ops is not None else ''))
+        if problems and options['strict']:
+            raise CommandError(f'{problems} query shape(s) need a COLLSCAN or blocking SORT')
+        self.stdout.write(self.style.SUCCESS(f'Audited {len(QUERY_SHAPES)} query shapes, {problems} with problems'))
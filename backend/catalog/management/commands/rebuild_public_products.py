@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from catalog.mongo import build_product_public, public_url_base
+
+class Command(BaseCommand):
+    help = 'Recompute the stored public representation of Mongo products, e.g. after PUBLIC_BACKEND_URL or MEDIA_URL changes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rebuild every product, not only missing or stale ones')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        mongo = getattr(settings, 'MONGO_DB', None)
+        if mongo is None:
+            self.stdout.write('MONGO_DB is not configured; nothing to do')
+            return
+        from pymongo import UpdateOne
+        batch_size = max(1, options['batch_size'])
+        base = public_url_base()
+        stale = {} if options['all'] else {'$or': [{'public': {'$exists': False}}, {'public_base': {'$ne': base}}]}
+        rebuilt = 0
+        last_id = None
+        while True:
+            query = dict(stale)
+            if last_id is not None:
+                query['_id'] = {'$gt': last_id}
+            docs = list(mongo['products'].find(query, {'public': 0}).sort('_id', 1).limit(batch_size))
+            if not docs:
+                break
+            last_id = docs[-1]['_id']
+            ops = []
+            for d in docs:
+                public = build_product_public(d)
+                public.pop('id', None)
+                ops.append(UpdateOne({'_id': d['_id']}, {'$set': {'public': public, 'public_base': base}}))
+            mongo['products'].bulk_write(ops, ordered=False)
+            rebuilt += len(ops)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt public representation of {rebuilt} product(s) for {base}'))
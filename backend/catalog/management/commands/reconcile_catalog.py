@@ -0,0 +1,204 @@
+import secrets
+import time
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from cart.models import CartItem
+from catalog.cache import bump_catalog_version
+from catalog.importer import upsert_orm_products
+from catalog.mirror import doc_checksum, row_checksum, orm_product_doc
+from catalog.models import Product
+from catalog.search import record_deleted
+from orders.models import OrderItem
+from outbox.events import max_attempts
+from outbox.models import OutboxEvent
+
+def fresh_sku():
+    return 'SKU-' + secrets.token_hex(4).upper()
+
+class Command(BaseCommand):
+    help = 'Compare Mongo product documents with ORM products chunk by chunk and repair drift (including duplicate or blank SKUs)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', choices=('mongo', 'orm'), default='mongo', help='Store whose copy wins (default: mongo, which serves catalog reads)')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--prune', action='store_true', help='Delete products that exist only in the non-source store')
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without writing')
+        parser.add_argument('--report-every', type=float, default=5.0, help='Seconds between progress lines')
+
+    def handle(self, *args, **options):
+        self.mongo = getattr(settings, 'MONGO_DB', None)
+        if self.mongo is None:
+            self.stdout.write('MONGO_DB is not configured; there is only one catalog')
+            return
+        self.source = options['source']
+        self.chunk = max(1, options['chunk_size'])
+        self.prune = options['prune']
+        self.dry_run = options['dry_run']
+        self.report_every = options['report_every']
+        self.stats = {k: 0 for k in ('mongo_scanned', 'orm_scanned', 'same', 'differ', 'mongo_only', 'orm_only', 'renamed', 'written', 'pruned', 'pending', 'ordered')}
+        self.mongo_written = False
+        self.started = self.reported = time.monotonic()
+        self.dedupe_orm()
+        self.scan_mongo()
+        self.scan_orm()
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(' '.join(f'{k}={v}' for k, v in self.stats.items()))
+        if self.mongo_written and not self.dry_run:
+            call_command('reconcile_category_counts', stdout=self.stdout)
+        if self.stats['written'] or self.stats['pruned'] or (self.stats['renamed'] and not self.dry_run):
+            bump_catalog_version()
+        drift = self.stats['differ'] + self.stats['renamed'] + self.stats['mongo_only'] + self.stats['orm_only']
+        rate = (self.stats['mongo_scanned'] + self.stats['orm_scanned']) / max(elapsed, 1e-6)
+        prefix = 'Dry run: ' if self.dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}{drift} drifted, {self.stats['written']} written, {self.stats['pruned']} pruned in {elapsed:.1f}s ({rate:.0f} rows/s)"
+        ))
+
+    def progress(self):
+        now = time.monotonic()
+        if now - self.reported < self.report_every:
+            return
+        self.reported = now
+        rows = self.stats['mongo_scanned'] + self.stats['orm_scanned']
+        rate = rows / max(now - self.started, 1e-6)
+        self.stdout.write(f"scanned mongo={self.stats['mongo_scanned']} orm={self.stats['orm_scanned']} ({rate:.0f} rows/s), differ={self.stats['differ']}")
+
+    def dedupe_orm(self):
+        # SKUs are unique in the ORM, so the only collision left is the single blank one
+        blank = list(Product.objects.filter(sku='').only('id', 'sku'))
+        for p in blank:
+            p.sku = fresh_sku()
+        self.stats['renamed'] += len(blank)
+        if blank and not self.dry_run:
+            Product.objects.bulk_update(blank, ['sku'])
+
+    def mongo_chunks(self):
+        # Documents without a SKU first (by _id), then the rest in SKU order. Keyset on (sku, ids already seen at
+        # that sku) so duplicates that straddle a chunk boundary are neither skipped nor read twice.
+        blank = {'$or': [{'sku': {'$exists': False}}, {'sku': {'$in': [None, '']}}]}
+        last_id = None
+        while True:
+            query = {'$and': [blank, {'_id': {'$gt': last_id}}]} if last_id is not None else blank
+            docs = list(self.mongo['products'].find(query, {'public': 0}).sort('_id', 1).limit(self.chunk))
+            if not docs:
+                break
+            last_id = docs[-1]['_id']
+            yield docs, True
+        last_sku, seen = None, []
+        while True:
+            query = {'sku': {'$gte': last_sku, '$type': 'string'}, '_id': {'$nin': seen}} if last_sku is not None else {'sku': {'$gt': ''}}
+            docs = list(self.mongo['products'].find(query, {'public': 0}).sort('sku', 1).limit(self.chunk))
+            if not docs:
+                break
+            if docs[-1]['sku'] != last_sku:
+                seen = []
+            last_sku = docs[-1]['sku']
+            seen += [d['_id'] for d in docs if d['sku'] == last_sku]
+            yield docs, False
+
+    def scan_mongo(self):
+        from pymongo import UpdateOne
+        prev_sku = None
+        for docs, blank in self.mongo_chunks():
+            self.stats['mongo_scanned'] += len(docs)
+            renames = []
+            for d in docs:
+                # Sorted by SKU, so a repeat is always adjacent to the first copy, which keeps its SKU
+                if blank or d['sku'] == prev_sku:
+                    d['sku'] = fresh_sku()
+                    renames.append(UpdateOne({'_id': d['_id']}, {'$set': {'sku': d['sku'], 'public.sku': d['sku']}}))
+                else:
+                    prev_sku = d['sku']
+            self.stats['renamed'] += len(renames)
+            if renames and not self.dry_run:
+                self.mongo['products'].bulk_write(renames, ordered=False)
+            self.compare(docs)
+            self.progress()
+
+    def pending(self, skus):
+        # SKUs with a mirror write still queued in either direction; the worker will settle them, and copying
+        # either side now could undo the write it is about to apply
+        skus = [s for s in skus if s]
+        if not skus:
+            return set()
+        limit = max_attempts()
+        queued = {d['key'] for d in self.mongo['outbox'].find({'kind': 'product', 'key': {'$in': skus}, 'attempts': {'$lt': limit}}, {'key': 1})}
+        queued.update(OutboxEvent.objects.filter(kind='product', key__in=skus, attempts__lt=limit).values_list('key', flat=True))
+        return queued
+
+    def compare(self, docs):
+        from pymongo import UpdateOne
+        pending = self.pending([d['sku'] for d in docs])
+        if pending:
+            self.stats['pending'] += sum(1 for d in docs if d['sku'] in pending)
+            docs = [d for d in docs if d['sku'] not in pending]
+        rows = {p.sku: p for p in Product.objects.filter(sku__in=[d['sku'] for d in docs]).select_related('category', 'owner').prefetch_related('images')}
+        emails = {d.get('owner_email') for d in docs if d.get('owner_email')}
+        users = dict(get_user_model().objects.filter(email__in=emails).values_list('email', 'id'))
+        to_orm, to_mongo, mongo_only = [], [], []
+        for d in docs:
+            row = rows.get(d['sku'])
+            if row is None:
+                self.stats['mongo_only'] += 1
+                (to_orm if self.source == 'mongo' else mongo_only).append(d)
+                continue
+            owner = d.get('owner_email') if d.get('owner_email') in users else ''
+            if doc_checksum(d, owner) == row_checksum(row):
+                self.stats['same'] += 1
+                continue
+            self.stats['differ'] += 1
+            if self.source == 'mongo':
+                to_orm.append(d)
+            else:
+                to_mongo.append(orm_product_doc(row))
+        if self.dry_run:
+            return
+        if to_orm:
+            upsert_orm_products(to_orm, {d['sku']: users.get(d.get('owner_email')) for d in to_orm}, self.chunk)
+            self.stats['written'] += len(to_orm)
+        if to_mongo:
+            self.mongo['products'].bulk_write([UpdateOne({'sku': d['sku']}, {'$set': d}) for d in to_mongo], ordered=False)
+            self.stats['written'] += len(to_mongo)
+            self.mongo_written = True
+        if mongo_only and self.prune:
+            self.mongo['products'].delete_many({'_id': {'$in': [d['_id'] for d in mongo_only]}})
+            record_deleted('mongo', [d['_id'] for d in mongo_only])
+            self.stats['pruned'] += len(mongo_only)
+            self.mongo_written = True
+
+    def scan_orm(self):
+        # Second pass only looks for ORM rows that have no Mongo document; pairs were compared above
+        from pymongo import UpdateOne
+        last = ''
+        while True:
+            batch = list(Product.objects.filter(sku__gt=last).order_by('sku').only('id', 'sku')[:self.chunk])
+            if not batch:
+                break
+            last = batch[-1].sku
+            self.stats['orm_scanned'] += len(batch)
+            skus = [p.sku for p in batch]
+            present = {d['sku'] for d in self.mongo['products'].find({'sku': {'$in': skus}}, {'sku': 1})}
+            orphans = [s for s in skus if s not in present]
+            pending = self.pending(orphans)
+            self.stats['pending'] += len(pending)
+            orphans = [s for s in orphans if s not in pending]
+            self.stats['orm_only'] += len(orphans)
+            self.progress()
+            if not orphans or self.dry_run:
+                continue
+            if self.source == 'orm':
+                rows = Product.objects.filter(sku__in=orphans).select_related('category', 'owner').prefetch_related('images')
+                self.mongo['products'].bulk_write([UpdateOne({'sku': p.sku}, {'$set': orm_product_doc(p)}, upsert=True) for p in rows], ordered=False)
+                self.stats['written'] += len(orphans)
+                self.mongo_written = True
+            elif self.prune:
+                # Order lines protect their product; those rows are reported and kept
+                ordered = set(OrderItem.objects.filter(product__sku__in=orphans).values_list('product__sku', flat=True))
+                if ordered:
+                    self.stats['ordered'] += len(ordered)
+                    self.stderr.write(f"kept {len(ordered)} ORM-only product(s) that orders reference: {', '.join(sorted(ordered)[:20])}")
+                    orphans = [s for s in orphans if s not in ordered]
+                CartItem.objects.filter(product__sku__in=orphans).delete()
+                self.stats['pruned'] += Product.objects.filter(sku__in=orphans).delete()[1].get('catalog.Product', 0)
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from catalog.cache import bump_catalog_version
+
+class Command(BaseCommand):
+    help = 'Recompute product_count on Mongo category documents from the products collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted categories without writing')
+
+    def handle(self, *args, **options):
+        mongo = getattr(settings, 'MONGO_DB', None)
+        if mongo is None:
+            # ORM category counts are aggregated on read; nothing is stored to drift
+            self.stdout.write('MONGO_DB is not configured; nothing to reconcile')
+            return
+        from pymongo import UpdateOne
+        # Same rule as counted_category(): a missing flag counts as true
+        pipeline = [
+            {'$match': {'is_public': {'$ne': False}, 'in_stock': {'$ne': False}, 'category': {'$nin': [None, '']}}},
+            {'$group': {'_id': '$category', 'n': {'$sum': 1}}},
+        ]
+        actual = {row['_id']: row['n'] for row in mongo['products'].aggregate(pipeline)}
+        stored = {d['name']: d.get('product_count') for d in mongo['categories'].find({}, {'name': 1, 'product_count': 1}) if d.get('name')}
+        ops = []
+        for name in sorted(set(actual) | set(stored)):
+            n = actual.get(name, 0)
+            if stored.get(name) != n:
+                self.stdout.write(f'{name}: {stored.get(name)} -> {n}')
+                ops.append(UpdateOne({'name': name}, {'$set': {'product_count': n}}, upsert=True))
+        if ops and not options['dry_run']:
+            mongo['categories'].bulk_write(ops, ordered=False)
+            bump_catalog_version()
+        verb = 'would fix' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'{len(stored)} categories checked, {verb} {len(ops)}'))
@@ -1,6 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from catalog.models import Product
+from catalog.cache import bump_catalog_version
+from catalog.blobs import release_media
 import os
 
 class Command(BaseCommand):
@@ -27,6 +29,9 @@ class Command(BaseCommand):
                 full = os.path.join(settings.BASE_DIR, 'static', *str(rel).split('/'))
                 files.append(full)
         p.delete()
+        # Uploaded media is shared by content; the index decides whether anything else still uses it
+        release_media(p.sku)
+        bump_catalog_version()
         self.stdout.write(f'Deleted product {pid}')
         if purge:
             for f in files:
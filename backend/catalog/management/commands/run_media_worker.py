@@ -0,0 +1,58 @@
+import json
+import time
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from catalog.media import claim_media_job, run_media_job, remote_uploader
+
+class Command(BaseCommand):
+    help = 'Upload staged product media to the remote store and swap the final URLs into the product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process the jobs that are due and exit')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds to sleep when nothing is due')
+        parser.add_argument('--stats', action='store_true', help='Print queue depth and lag, then exit')
+
+    def handle(self, *args, **options):
+        mongo = getattr(settings, 'MONGO_DB', None)
+        if mongo is None:
+            self.stdout.write('MONGO_DB is not configured; product media is stored synchronously')
+            return
+        if options['stats']:
+            limit = int(getattr(settings, 'MEDIA_UPLOAD_MAX_ATTEMPTS', 5))
+            oldest = mongo['media_jobs'].find_one({'attempts': {'$lt': limit}}, {'created_at': 1}, sort=[('created_at', 1)])
+            self.stdout.write(json.dumps({
+                'pending': mongo['media_jobs'].count_documents({'attempts': {'$lt': limit}}),
+                'failed': mongo['media_jobs'].count_documents({'attempts': {'$gte': limit}}),
+                'lag_seconds': round((timezone.now() - oldest['created_at']).total_seconds(), 3) if oldest else 0.0,
+            }, indent=2))
+            return
+        if remote_uploader() is None:
+            self.stdout.write('No remote uploader is configured; staged files are already final')
+            return
+        errors = 0
+        while True:
+            try:
+                job = claim_media_job(mongo)
+                if job is None:
+                    if options['once']:
+                        break
+                    close_old_connections()
+                    time.sleep(options['poll'])
+                    continue
+                started = time.perf_counter()
+                uploaded = run_media_job(mongo, job)
+                errors = 0
+            except Exception as e:
+                # A lost Mongo or database connection must not end the worker; a claimed job comes back after its lease
+                errors += 1
+                delay = min(options['poll'] * 2 ** errors, float(getattr(settings, 'WORKER_MAX_BACKOFF', 60)))
+                self.stderr.write(f'media job failed ({str(e) or e.__class__.__name__}); retrying in {delay:.0f}s')
+                close_old_connections()
+                time.sleep(delay)
+                continue
+            if uploaded is None:
+                self.stderr.write(f"{job['sku']}: upload failed, will retry")
+            else:
+                self.stdout.write(f"{job['sku']}: {uploaded} file(s) in {time.perf_counter() - started:.2f}s")
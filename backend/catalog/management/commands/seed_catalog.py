@@ -2,6 +2,8 @@ from django.core.management.base import BaseCommand
 from catalog.models import Category, Product
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from catalog.mongo import derive_product_fields, save_product_doc
+from catalog.cache import bump_catalog_version
 
 class Command(BaseCommand):
     help = 'Seed initial categories and products'
@@ -125,8 +127,6 @@ class Command(BaseCommand):
         mongo = getattr(settings, 'MONGO_DB', None)
         if mongo is not None:
             try:
-                mongo['categories'].create_index('name', unique=True)
-                mongo['products'].create_index('sku', unique=True)
                 for name in categories:
                     mongo['categories'].update_one({'name': name}, {'$set': {'name': name}}, upsert=True)
                 for p in products:
@@ -146,7 +146,9 @@ class Command(BaseCommand):
                         'sku': p['sku'],
                         'stock': int(p['stock'] or 0),
                     }
-                    mongo['products'].update_one({'sku': p['sku']}, {'$set': doc}, upsert=True)
+                    derive_product_fields(doc)
+                    save_product_doc(mongo, doc)
             except Exception:
                 pass
+        bump_catalog_version()
         self.stdout.write(self.style.SUCCESS('Seeded categories and products'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from stylesathi_backend.mongo_indexes import INDEX_VERSION, applied_version, sync_indexes
+
+class Command(BaseCommand):
+    help = 'Build the Mongo indexes declared in stylesathi_backend.mongo_indexes when the stored version is out of date'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild even if _meta already records the current version')
+
+    def handle(self, *args, **options):
+        mongo = getattr(settings, 'MONGO_DB', None)
+        if mongo is None:
+            self.stdout.write('MONGO_DB is not configured; nothing to do')
+            return
+        before = applied_version(mongo)
+        result = sync_indexes(mongo, force=options['force'])
+        if result['skipped']:
+            self.stdout.write(f'Indexes already at version {INDEX_VERSION}')
+            return
+        for name in result['created']:
+            self.stdout.write(f'  ok {name}')
+        for err in result['errors']:
+            self.stderr.write(f'  failed {err}')
+        if result['errors']:
+            raise CommandError(f"{len(result['errors'])} index(es) failed; version left at {before}")
+        self.stdout.write(self.style.SUCCESS(f'Indexes synced from version {before} to {INDEX_VERSION}'))
@@ -0,0 +1,224 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+from functools import partial
+from urllib.parse import urlparse
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Product document fields that can hold uploaded media URLs
+MEDIA_FIELDS = ('image_url', 'image_variants', 'model_glb_url', 'images')
+
+def cloudinary_upload(path, name):
+    import importlib
+    upl = importlib.import_module('cloudinary.uploader')
+    res = upl.upload(
+        path,
+        resource_type='auto',
+        folder=os.environ.get('CLOUDINARY_UPLOAD_FOLDER', 'stylesathi/uploads'),
+        use_filename=True,
+        unique_filename=True,
+    )
+    return res.get('secure_url') or res.get('url') or ''
+
+def local_upload(path, name):
+    # Stand-in for a remote store in tests and benchmarks: copies into MEDIA_ROOT/remote after MEDIA_LOCAL_UPLOAD_DELAY seconds
+    from .mongo import _absolute_media_url
+    delay = float(getattr(settings, 'MEDIA_LOCAL_UPLOAD_DELAY', 0) or 0)
+    if delay:
+        time.sleep(delay)
+    target = os.path.join(str(settings.MEDIA_ROOT), 'remote')
+    os.makedirs(target, exist_ok=True)
+    shutil.copyfile(path, os.path.join(target, name))
+    return _absolute_media_url('remote/' + name)
+
+def remote_uploader():
+    # MEDIA_UPLOADER names an upload(path, name) -> url callable; otherwise Cloudinary when it is configured
+    path = getattr(settings, 'MEDIA_UPLOADER', '')
+    if path:
+        return import_string(path)
+    if not os.environ.get('CLOUDINARY_CLOUD_NAME'):
+        return None
+    try:
+        import importlib
+        importlib.import_module('cloudinary.uploader')
+    except Exception:
+        return None
+    return cloudinary_upload
+
+def uploads_async():
+    return bool(getattr(settings, 'MEDIA_UPLOAD_ASYNC', True)) and remote_uploader() is not None
+
+def upload_limits():
+    return max(1, int(getattr(settings, 'MEDIA_UPLOAD_CONCURRENCY', 4))), float(getattr(settings, 'MEDIA_UPLOAD_TIMEOUT', 60))
+
+def _finish_late(on_late, a, fut):
+    # Runs on the upload thread once a call reported as timed out completes after all
+    try:
+        if not fut.cancelled() and fut.exception() is None:
+            on_late(a, fut.result())
+    except Exception as e:
+        logger.warning('media: could not record late result of %s: %s', fut, e)
+    finally:
+        if threading.current_thread().name.startswith('media-upload'):
+            from django.db import connection
+            connection.close()
+
+def run_bounded(fn, args, limit=None, timeout=None, on_late=None):
+    # Calls fn(*a) for each a in args on at most `limit` threads; returns [(result, error)] in input order.
+    # Calls still running at the deadline (0 for none) are reported as timed out and left to finish in the
+    # background; on_late(a, result) is then called with what each of them eventually returns.
+    default_limit, default_timeout = upload_limits()
+    limit = limit or default_limit
+    timeout = timeout if timeout is not None else default_timeout
+    if not args:
+        return []
+    pool = ThreadPoolExecutor(max_workers=min(limit, len(args)), thread_name_prefix='media-upload')
+    futures = [pool.submit(fn, *a) for a in args]
+    wait(futures, timeout=timeout or None)
+    pool.shutdown(wait=False, cancel_futures=True)
+    out = []
+    for a, fut in zip(args, futures):
+        if not fut.done():
+            out.append((None, f'Timed out after {timeout:g}s'))
+            if on_late is not None:
+                fut.add_done_callback(partial(_finish_late, on_late, a))
+        elif fut.cancelled():
+            out.append((None, 'Cancelled'))
+        elif fut.exception() is not None:
+            out.append((None, str(fut.exception()) or fut.exception().__class__.__name__))
+        else:
+            out.append((fut.result(), None))
+    return out
+
+def media_file(url):
+    # Where any MEDIA_URL URL lives under MEDIA_ROOT, whether or not the file is still there
+    if not isinstance(url, str):
+        return None
+    media = '/' + getattr(settings, 'MEDIA_URL', '/media/').strip('/') + '/'
+    path = urlparse(url).path
+    if not path.startswith(media):
+        return None
+    root = os.path.normpath(str(settings.MEDIA_ROOT))
+    full = os.path.normpath(os.path.join(root, path[len(media):]))
+    return full if full.startswith(root + os.sep) else None
+
+def media_path(url):
+    # Local file behind any MEDIA_URL URL, if it is on disk
+    full = media_file(url)
+    return full if full is not None and os.path.isfile(full) else None
+
+def staged_path(url):
+    # Local upload not yet on the remote store: a blob, or a file staged under uploads/ before blobs existed
+    path = media_path(url)
+    if path is None:
+        return None
+    rel = os.path.relpath(path, str(settings.MEDIA_ROOT)).split(os.sep)
+    return path if rel[0] in ('uploads', 'blobs') else None
+
+def variant_urls(variants):
+    return [u for v in variants or [] if isinstance(v, dict) for k, u in v.items() if k != 'width']
+
+def staged_urls(doc):
+    urls = [doc.get('image_url'), doc.get('model_glb_url')] + list(doc.get('images') or []) + variant_urls(doc.get('image_variants'))
+    return [u for u in urls if staged_path(u)]
+
+def queue_media_upload(mongo, doc):
+    # One job per product; the request has already answered with the staged (locally served) URLs
+    if not uploads_async() or not staged_urls(doc):
+        return False
+    now = timezone.now()
+    mongo['media_jobs'].update_one(
+        {'sku': doc['sku']},
+        {'$set': {'available_at': now}, '$setOnInsert': {'created_at': now, 'attempts': 0}},
+        upsert=True,
+    )
+    return True
+
+def upload_product_media(mongo, sku, upload=None):
+    from outbox.events import mirrored_write
+    from .blobs import blob_key_of, doc_blob_keys, remember_remote_urls, remote_urls, track_media
+    from .mongo import targeted_set
+    upload = upload or remote_uploader()
+    doc = mongo['products'].find_one({'sku': sku}, {f: 1 for f in MEDIA_FIELDS + ('public_base',)})
+    if doc is None or upload is None:
+        return 0
+    urls = list(dict.fromkeys(staged_urls(doc)))
+    if not urls:
+        return 0
+    keys = {u: blob_key_of(u) for u in urls}
+    # Blobs another product already sent keep that URL; the rest upload side by side
+    known = remote_urls([k for k in keys.values() if k])
+    final = {u: known[keys[u]] for u in urls if keys[u] in known}
+    todo = [u for u in urls if u not in final]
+    paths = [staged_path(u) for u in todo]
+    # An upload that finishes after the deadline is remembered, so the retry reuses it and gc knows the blob
+    by_path = {p: keys[u] for u, p in zip(todo, paths)}
+    def late(a, result):
+        if result and by_path[a[0]]:
+            remember_remote_urls({by_path[a[0]]: result})
+        elif result:
+            logger.warning('media: %s reached the remote store after its job gave up: %s', a[1], result)
+    for url, path, (result, error) in zip(todo, paths, run_bounded(upload, [(p, os.path.basename(p)) for p in paths], on_late=late)):
+        if error or not result:
+            raise RuntimeError(f'Upload of {os.path.basename(path)} failed: {error or "no URL returned"}')
+        final[url] = result
+    remember_remote_urls({keys[u]: final[u] for u in todo if keys[u]})
+    changes = {}
+    for f in ('image_url', 'model_glb_url'):
+        if doc.get(f) in final:
+            changes[f] = final[doc[f]]
+    if any(u in final for u in doc.get('images') or []):
+        changes['images'] = [final.get(u, u) for u in doc['images']]
+    if any(u in final for u in variant_urls(doc.get('image_variants'))):
+        changes['image_variants'] = [{k: final.get(u, u) if k != 'width' else u for k, u in v.items()} for v in doc['image_variants']]
+    # Only swap if the media fields are still the ones uploaded; a concurrent edit gets a fresh job
+    match = {'sku': sku, **{f: doc.get(f) for f in MEDIA_FIELDS if f in doc}}
+    with mirrored_write('product', sku):
+        res = mongo['products'].update_one(match, {'$set': targeted_set(changes, with_public='public_base' in doc)})
+    if not res.matched_count:
+        raise RuntimeError('Product media changed during upload')
+    # Local blobs this product no longer uses are collected once nothing else references them
+    track_media(sku, doc_blob_keys({**doc, **changes}))
+    for url in final:
+        if not keys[url]:
+            try:
+                os.remove(staged_path(url))
+            except Exception:
+                pass
+    return len(final)
+
+def claim_media_job(mongo):
+    from pymongo import ReturnDocument
+    now = timezone.now()
+    lease = timedelta(seconds=int(getattr(settings, 'MEDIA_UPLOAD_LEASE_SECONDS', 300)))
+    return mongo['media_jobs'].find_one_and_update(
+        {'available_at': {'$lte': now}, 'attempts': {'$lt': int(getattr(settings, 'MEDIA_UPLOAD_MAX_ATTEMPTS', 5))}},
+        {'$set': {'available_at': now + lease}},
+        sort=[('available_at', 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+def run_media_job(mongo, job):
+    from outbox.events import retry_delay
+    from .views import product_changed
+    try:
+        uploaded = upload_product_media(mongo, job['sku'])
+    except Exception as e:
+        attempts = (job.get('attempts') or 0) + 1
+        mongo['media_jobs'].update_one({'_id': job['_id']}, {'$set': {
+            'attempts': attempts, 'available_at': timezone.now() + retry_delay(attempts), 'last_error': (str(e) or e.__class__.__name__)[:1000],
+        }})
+        return None
+    # A job re-queued while this one ran has a new available_at and stays for another pass
+    mongo['media_jobs'].delete_one({'_id': job['_id'], 'available_at': job['available_at']})
+    if uploaded:
+        product_changed(job['sku'])
+    return uploaded
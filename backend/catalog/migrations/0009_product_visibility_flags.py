@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0008_remove_productimage_url_product_image_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='is_public',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='is_seed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['is_public', 'in_stock', 'category', '-id'], name='catalog_prod_public_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0011_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('in_stock', True), ('is_public', True)), fields=['price', 'id'], name='catalog_prod_list_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('in_stock', True), ('is_public', True)), fields=['rating', 'id'], name='catalog_prod_list_rating_idx'),
+        ),
+    ]
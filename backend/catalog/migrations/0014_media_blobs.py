@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0013_product_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('remote_url', models.URLField(blank=True, max_length=500)),
+                ('touched_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MediaReference',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sku', models.CharField(db_index=True, max_length=64)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='references', to='catalog.mediablob')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='mediareference',
+            constraint=models.UniqueConstraint(fields=('blob', 'sku'), name='catalog_media_ref_unique'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0014_media_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
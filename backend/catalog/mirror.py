@@ -0,0 +1,135 @@
+import hashlib
+import json
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from cart.models import CartItem
+from .models import Product, standard_category_name
+from .importer import upsert_orm_products, to_money
+from .mongo import product_doc_from_request, save_product_doc, delete_product_doc, stored_time
+from .serializers import storage_url
+
+# Outbox handlers: each copies the current state of the given SKUs from the primary store, so
+# repeated or out-of-order events for one SKU all converge on the same mirror row. Products are written
+# on both sides (Mongo creates, ORM /manage edits), so a copy only lands when its source's updated_at is
+# newer than the target's, and a delete only when the target has not changed since the delete was queued.
+# A stale event therefore cannot put back an edit the other store has made since.
+
+def _newer(source, target):
+    source, target = stored_time(source), stored_time(target)
+    return target is None or (source is not None and source > target)
+
+def products_to_orm(mongo, skus, queued_at=None):
+    queued_at = queued_at or {}
+    docs = list(mongo['products'].find({'sku': {'$in': skus}}, {'public': 0, 'public_base': 0}))
+    gone = set(skus) - {d['sku'] for d in docs}
+    with transaction.atomic():
+        # Locked so an ORM edit cannot land between the comparison and the copy
+        stamps = dict(Product.objects.select_for_update().filter(sku__in=skus).values_list('sku', 'updated_at'))
+        doomed = [s for s in gone if s in stamps and (queued_at.get(s) is None or not _newer(stamps[s], queued_at[s]))]
+        if doomed:
+            # Cart lines protect their product, so they go first
+            CartItem.objects.filter(product__sku__in=doomed).delete()
+            Product.objects.filter(sku__in=doomed).delete()
+        docs = [d for d in docs if d['sku'] not in stamps or _newer(d.get('updated_at'), stamps[d['sku']])]
+        if docs:
+            emails = {d.get('owner_email') for d in docs if d.get('owner_email')}
+            users = dict(get_user_model().objects.filter(email__in=emails).values_list('email', 'id'))
+            upsert_orm_products(docs, {d['sku']: users.get(d.get('owner_email')) for d in docs})
+    return {}
+
+def product_image_url(product):
+    return product.image_url or (storage_url(product.image.name) if product.image else '')
+
+def orm_product_doc(product):
+    # The Mongo document for an ORM row; expects category, owner and images to be loaded with it
+    return product_doc_from_request({'title': product.title,
+                                     'price': product.price,
+                                     'original_price': product.original_price,
+                                     'category': product.category.name,
+                                     'brand': product.brand,
+                                     'description': product.description,
+                                     'image_url': product_image_url(product),
+                                     'image_variants': list(product.image_variants or []),
+                                     'images': [storage_url(i.image.name) for i in product.images.all() if i.image],
+                                     'model_glb_url': product.model_glb_url,
+                                     'sketchfab_embed_url': product.sketchfab_embed_url,
+                                     'in_stock': bool(product.in_stock),
+                                     'rating': product.rating,
+                                     'features': list(product.features or []),
+                                     'sku': product.sku,
+                                     'stock': product.stock}, {}, getattr(product.owner, 'email', None))
+
+def _checksum(fields):
+    return hashlib.blake2b(json.dumps(fields, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+# Fields both stores hold; images and the derived visibility flags are left out
+def doc_checksum(doc, owner_email=''):
+    return _checksum({
+        'title': doc.get('title') or doc.get('name') or '',
+        'price': to_money(doc.get('price')),
+        'original_price': to_money(doc.get('original_price')),
+        'category': standard_category_name(str(doc.get('category') or '').strip()),
+        'brand': doc.get('brand') or '',
+        'description': doc.get('description') or '',
+        'image_url': doc.get('image_url') or '',
+        'model_glb_url': doc.get('model_glb_url') or '',
+        'sketchfab_embed_url': doc.get('sketchfab_embed_url') or '',
+        'in_stock': bool(doc.get('in_stock', True)),
+        'rating': round(float(doc.get('rating') or 0), 4),
+        'features': list(doc.get('features') or []),
+        'stock': int(doc.get('stock') or 0),
+        'owner': owner_email or '',
+    })
+
+def row_checksum(product):
+    return _checksum({
+        'title': product.title,
+        'price': to_money(product.price),
+        'original_price': to_money(product.original_price),
+        'category': standard_category_name(product.category.name),
+        'brand': product.brand or '',
+        'description': product.description or '',
+        'image_url': product_image_url(product),
+        'model_glb_url': product.model_glb_url or '',
+        'sketchfab_embed_url': product.sketchfab_embed_url or '',
+        'in_stock': bool(product.in_stock),
+        'rating': round(float(product.rating or 0), 4),
+        'features': list(product.features or []),
+        'stock': int(product.stock or 0),
+        'owner': getattr(product.owner, 'email', None) or '',
+    })
+
+def products_to_mongo(mongo, skus, queued_at=None):
+    from .views import product_changed
+    queued_at = queued_at or {}
+    rows = {p.sku: p for p in Product.objects.filter(sku__in=skus).select_related('category', 'owner').prefetch_related('images')}
+    stamps = {d['sku']: d.get('updated_at') for d in mongo['products'].find({'sku': {'$in': skus}}, {'sku': 1, 'updated_at': 1})}
+    errors, applied = {}, []
+    for sku in skus:
+        product = rows.get(sku)
+        try:
+            if product is None:
+                if sku in stamps:
+                    # The guard re-checks the stamp in the delete itself, so a Mongo write made meanwhile survives
+                    since = stored_time(queued_at.get(sku))
+                    guard = {'$or': [{'updated_at': None}, {'updated_at': {'$lte': since}}]} if since else {}
+                    if delete_product_doc(mongo, {'sku': sku, **guard}) is not None:
+                        applied.append(sku)
+                continue
+            if sku in stamps and not _newer(product.updated_at, stamps[sku]):
+                continue
+            doc = orm_product_doc(product)
+            doc['updated_at'] = stored_time(product.updated_at) or doc['updated_at']
+            if sku in stamps:
+                if save_product_doc(mongo, doc, guard={'$or': [{'updated_at': None}, {'updated_at': {'$lt': doc['updated_at']}}]}) is None:
+                    continue
+            else:
+                save_product_doc(mongo, doc)
+            mongo['categories'].update_one({'name': doc['category']}, {'$set': {'name': doc['category']}}, upsert=True)
+            applied.append(sku)
+        except Exception as e:
+            errors[sku] = str(e) or e.__class__.__name__
+    if applied:
+        # Mongo serves the catalog reads, so its caches only go stale once the mirror lands
+        product_changed(*applied)
+    return errors
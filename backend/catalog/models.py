@@ -1,5 +1,12 @@
 from django.db import models
 from django.conf import settings
+from .visibility import visibility_fields
+
+def standard_category_name(name):
+    raw = (name or '').strip()
+    if raw.lower() in {'cap/hat', 'hat', 'cap'}:
+        return 'Hat/Cap'
+    return name
 
 class Category(models.Model):
     name = models.CharField(max_length=64, unique=True)
@@ -8,10 +15,7 @@ class Category(models.Model):
         return self.name
     
     def save(self, *args, **kwargs):
-        raw = (self.name or '').strip()
-        low = raw.lower()
-        if low in {'cap/hat', 'hat', 'cap'}:
-            self.name = 'Hat/Cap'
+        self.name = standard_category_name(self.name)
         super().save(*args, **kwargs)
 
 class Product(models.Model):
@@ -25,6 +29,8 @@ class Product(models.Model):
     image = models.ImageField(upload_to='uploads/', null=True, blank=True)
     # Backward-compatible URL field used when image is provided as URL
     image_url = models.URLField(blank=True)
+    # Fixed-width derivatives of the primary image: [{'width': 200, 'jpeg': url, 'webp': url}, ...]
+    image_variants = models.JSONField(default=list, blank=True)
     # Optional GLB model URL (saved to storage or provided as absolute URL)
     model_glb_url = models.URLField(blank=True)
     sketchfab_embed_url = models.URLField(blank=True)
@@ -34,6 +40,11 @@ class Product(models.Model):
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='products', on_delete=models.CASCADE, null=True, blank=True)
     sku = models.CharField(max_length=64, blank=True, unique=True)
     stock = models.PositiveIntegerField(default=0)
+    # Derived from sku/brand/owner on save; listings filter on these instead of seed exclusions
+    is_seed = models.BooleanField(default=False)
+    is_public = models.BooleanField(default=True)
+    # Lets the in-process search index catch up on rows changed by other workers
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         indexes = [
@@ -42,11 +53,32 @@ class Product(models.Model):
             models.Index(fields=['in_stock']),
             models.Index(fields=['owner']),
             models.Index(fields=['price']),
+            models.Index(fields=['is_public', 'in_stock', 'category', '-id'], condition=models.Q(is_public=True), name='catalog_prod_public_idx'),
+            # Sorted listings walk these in order; the condition restricts them to rows a listing can return
+            models.Index(fields=['price', 'id'], condition=models.Q(is_public=True, in_stock=True), name='catalog_prod_list_price_idx'),
+            models.Index(fields=['rating', 'id'], condition=models.Q(is_public=True, in_stock=True), name='catalog_prod_list_rating_idx'),
         ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        owner_email = getattr(self.owner, 'email', None) if self.owner_id else None
+        flags = visibility_fields(self.sku, self.brand, owner_email)
+        self.is_seed = flags['is_seed']
+        self.is_public = flags['is_public']
+        super().save(*args, **kwargs)
+
+class CatalogVersion(models.Model):
+    # Single row (pk=1) bumped on every catalog write; response caches key on it
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+class ProductTombstone(models.Model):
+    # Products deleted from the ORM catalog, so in-process indexes in every worker drop them on catch-up
+    product_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(db_index=True)
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='uploads/', null=True, blank=True)
@@ -54,3 +86,20 @@ class ProductImage(models.Model):
 
     def __str__(self):
         return f"{self.product_id}:{getattr(self.image, 'name', '')}"
+
+class MediaBlob(models.Model):
+    # One content-addressed upload (blobs/<aa>/<sha256><ext>), shared by every product that stored the same bytes
+    key = models.CharField(max_length=255, unique=True)
+    remote_url = models.URLField(max_length=500, blank=True)
+    # Storing or referencing the blob again restarts the grace period before an unreferenced blob is collected
+    touched_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.key
+
+class MediaReference(models.Model):
+    blob = models.ForeignKey(MediaBlob, related_name='references', on_delete=models.CASCADE)
+    sku = models.CharField(max_length=64, db_index=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['blob', 'sku'], name='catalog_media_ref_unique')]
@@ -1,65 +1,67 @@
 import os
 import secrets
+from datetime import datetime, timezone as dt_timezone
 from django.conf import settings
+from django.utils import timezone
+from .variants import variant_srcset
+from .visibility import visibility_fields
 
-def _uploads_dir():
-    return os.path.join(str(settings.MEDIA_ROOT), 'uploads')
-
-def _save_file(f, name_prefix):
+def _save_file(f, variants=None, uploaded=None):
+    # Files are stored content-addressed under MEDIA_ROOT/blobs (see catalog.blobs), so the same bytes are written
+    # once and keep one URL. With a remote uploader (Cloudinary) configured they are handed to the media worker
+    # (see catalog.media) unless MEDIA_UPLOAD_ASYNC is off, in which case they upload here.
+    # When `variants` is a list, responsive derivatives of an image are stored the same way and appended there.
+    # When `uploaded` is a dict, blob keys sent to the remote uploader are recorded there with their URLs.
     if not f:
         return ''
-    cld = None
-    upl = None
-    try:
-        import importlib
-        cld = importlib.import_module('cloudinary')
-        upl = importlib.import_module('cloudinary.uploader')
-    except Exception:
-        cld = None
-        upl = None
-    try:
-        if cld and hasattr(cld, 'config') and getattr(cld, 'config') and os.environ.get('CLOUDINARY_CLOUD_NAME'):
+    from .blobs import local_blob_path, save_local_blob
+    from .media import remote_uploader, uploads_async
+    from .variants import group_variants, is_image_name, local_variants
+    key = save_local_blob(f, getattr(f, 'name', ''))
+    rendered = []
+    if variants is not None and is_image_name(key):
+        try:
+            rendered = local_variants(key)
+        except Exception:
+            pass
+    upload = remote_uploader()
+    sync = upload is not None and not uploads_async()
+    def store(key):
+        if sync:
             try:
-                upload_res = upl.upload(
-                    f,
-                    resource_type='auto',
-                    folder=os.environ.get('CLOUDINARY_UPLOAD_FOLDER', 'stylesathi/uploads'),
-                    use_filename=True,
-                    unique_filename=True,
-                )
-                return upload_res.get('secure_url') or upload_res.get('url') or ''
+                url = upload(local_blob_path(key), os.path.basename(key))
+                if url:
+                    if uploaded is not None:
+                        uploaded[key] = url
+                    return url
             except Exception:
                 pass
-    except Exception:
-        pass
-    os.makedirs(_uploads_dir(), exist_ok=True)
-    orig = os.path.basename(getattr(f, 'name', 'file'))
-    safe = ''.join([c if (c.isalnum() or c in ('-', '_', '.')) else '_' for c in orig])
-    filename = f"{name_prefix}_{secrets.token_hex(2)}_{safe}"
-    safe_path = os.path.join(_uploads_dir(), filename)
-    with open(safe_path, 'wb') as dst:
-        for chunk in f.chunks():
-            dst.write(chunk)
-    return _absolute_media_url('uploads/' + filename)
+        return _absolute_media_url(key)
+    if variants is not None:
+        variants.extend(group_variants([(width, fmt, store(k)) for width, fmt, k in rendered]))
+    return store(key)
+
+def _public_backend_url():
+    return os.environ.get('PUBLIC_BACKEND_URL') or ('http://127.0.0.1:8000' if getattr(settings, 'DEBUG', False) else 'https://stylesathi-backend.onrender.com')
+
+def public_url_base():
+    # Fingerprint of everything product_public bakes into URLs; a change means stored representations are stale
+    return _public_backend_url().rstrip('/') + '|' + getattr(settings, 'MEDIA_URL', '/media/') + '|v' + str(PUBLIC_VERSION)
 
 def _absolute_media_url(rel_path: str) -> str:
-    base = os.environ.get('PUBLIC_BACKEND_URL') or ('http://127.0.0.1:8000' if getattr(settings, 'DEBUG', False) else 'https://stylesathi-backend.onrender.com')
+    base = _public_backend_url()
     media = getattr(settings, 'MEDIA_URL', '/media/')
     media = media if media.startswith('/') else ('/' + media)
     return base.rstrip('/') + media.rstrip('/') + '/' + str(rel_path).lstrip('/')
 
-def product_doc_from_request(data, files, owner_email):
+def product_doc_from_request(data, files, owner_email, upload_errors=None):
+    # upload_errors, when given, collects {'field', 'file', 'error'} for every uploaded file that could not be stored
     sku = (data.get('sku') or '').strip()
     if not sku:
         sku = 'SKU-' + secrets.token_hex(4).upper()
     image_url = data.get('image_url') if data.get('image_url') not in (None, '') else None
     model_glb_url = data.get('model_glb_url') if data.get('model_glb_url') not in (None, '') else None
-    img = files.get('image') if files else None
-    glb = files.get('model_glb') if files else None
-    if img:
-        image_url = _save_file(img, f"product_{secrets.token_hex(2)}")
-    if glb:
-        model_glb_url = _save_file(glb, f"product_{secrets.token_hex(2)}")
+    image_variants = data.get('image_variants') if isinstance(data.get('image_variants'), list) else []
     images_list = []
     raw_images = data.get('images')
     if raw_images is not None:
@@ -73,17 +75,30 @@ def product_doc_from_request(data, files, owner_email):
                 images_list = [s.strip() for s in raw_images.split(',') if s.strip()]
         elif isinstance(raw_images, list):
             images_list = raw_images
-    try:
-        if files and hasattr(files, 'getlist'):
-            for f in files.getlist('images'):
-                try:
-                    u = _save_file(f, f"product_{secrets.token_hex(2)}")
-                    if u:
-                        images_list.append(u)
-                except Exception:
-                    pass
-    except Exception:
-        pass
+    uploads = []
+    if files:
+        uploads = [(field, files.get(field)) for field in ('image', 'model_glb') if files.get(field)]
+        if hasattr(files, 'getlist'):
+            uploads += [('images', f) for f in files.getlist('images') if f]
+    if uploads:
+        from .blobs import remember_remote_urls
+        from .media import run_bounded
+        # The main image, the GLB and the gallery upload side by side; results come back in request order.
+        # Remote copies of a file that timed out are recorded on its blob once they land, for gc and later uploads.
+        main_variants = []
+        results = run_bounded(_save_file, [(f, main_variants if field == 'image' else None, {}) for field, f in uploads],
+                              on_late=lambda a, url: remember_remote_urls(a[2]))
+        for (field, f), (url, error) in zip(uploads, results):
+            if error or not url:
+                if upload_errors is not None:
+                    upload_errors.append({'field': field, 'file': os.path.basename(getattr(f, 'name', '') or ''), 'error': error or 'Upload failed'})
+            elif field == 'image':
+                image_url = url
+                image_variants = main_variants
+            elif field == 'model_glb':
+                model_glb_url = url
+            else:
+                images_list.append(url)
     cat = data.get('category') or data.get('category_name')
     try:
         price = float(data.get('price') or 0)
@@ -108,7 +123,7 @@ def product_doc_from_request(data, files, owner_email):
                 feats = [str(parsed)]
         except Exception:
             feats = [s.strip() for s in feats.split(',') if s.strip()]
-    return {
+    return derive_product_fields({
         'title': (data.get('title') or data.get('name') or '').strip(),
         'price': price,
         'original_price': original_price,
@@ -116,6 +131,7 @@ def product_doc_from_request(data, files, owner_email):
         'brand': ((data.get('brand') or '').strip() or None),
         'description': ((data.get('description') or '').strip() or None),
         'image_url': image_url,
+        'image_variants': image_variants,
         'images': images_list,
         'model_glb_url': model_glb_url,
         'sketchfab_embed_url': ((data.get('sketchfab_embed_url') or '').strip() or None),
@@ -125,65 +141,225 @@ def product_doc_from_request(data, files, owner_email):
         'owner_email': owner_email,
         'sku': sku,
         'stock': stock,
-    }
-
-def product_public(doc):
-    cat_name = doc.get('category') if isinstance(doc.get('category'), str) else (doc.get('category', {}).get('name') if isinstance(doc.get('category'), dict) else '')
-    img = doc.get('image_url') or ''
-    if isinstance(img, str):
-        if img.startswith('/media/'):
-            rel = img[len('/media/'):]
-            img = _absolute_media_url(rel)
-        elif img.startswith('/'):
-            base = os.environ.get('PUBLIC_BACKEND_URL') or ('http://127.0.0.1:8000' if getattr(settings, 'DEBUG', False) else 'https://stylesathi-backend.onrender.com')
-            img = base.rstrip('/') + img
-    glb = doc.get('model_glb_url') or ''
-    if isinstance(glb, str):
-        if glb.startswith('/media/'):
-            relg = glb[len('/media/'):]
-            glb = _absolute_media_url(relg)
-        elif glb.startswith('/'):
-            base = os.environ.get('PUBLIC_BACKEND_URL') or ('http://127.0.0.1:8000' if getattr(settings, 'DEBUG', False) else 'https://stylesathi-backend.onrender.com')
-            glb = base.rstrip('/') + glb
-    imgs = []
-    try:
-        for u in doc.get('images') or []:
-            if isinstance(u, str):
-                if u.startswith('/media/'):
-                    rel = u[len('/media/'):]
-                    imgs.append(_absolute_media_url(rel))
-                elif u.startswith('/'):
-                    base = os.environ.get('PUBLIC_BACKEND_URL') or ('http://127.0.0.1:8000' if getattr(settings, 'DEBUG', False) else 'https://stylesathi-backend.onrender.com')
-                    imgs.append(base.rstrip('/') + u)
-                else:
-                    imgs.append(u)
-    except Exception:
-        imgs = []
-    return {
-        'id': str(doc.get('_id')),
-        'title': doc.get('title') or doc.get('name'),
-        'price': float(doc.get('price') or 0),
-        'original_price': float(doc.get('original_price') or 0),
-        'category': {'id': None, 'name': cat_name},
-        'brand': doc.get('brand') or '',
-        'description': doc.get('description') or '',
-        'image_url': img,
-        'images': imgs,
-        'model_glb_url': glb,
-        'sketchfab_embed_url': doc.get('sketchfab_embed_url') or '',
-        'in_stock': bool(doc.get('in_stock', True)),
-        'rating': float(doc.get('rating') or 0),
-        'features': doc.get('features') or [],
-        'owner': None,
-        'sku': doc.get('sku') or '',
-        'stock': int(doc.get('stock') or 0),
-    }
-
-def ensure_indexes(mongo):
+    })
+
+def derive_product_fields(doc):
+    doc.update(visibility_fields(doc.get('sku'), doc.get('brand'), doc.get('owner_email')))
+    # Store the absolutized public representation so reads stream it without rebuilding
+    public = build_product_public(doc)
+    public.pop('id', None)
+    doc['public'] = public
+    doc['public_base'] = public_url_base()
+    doc['updated_at'] = timezone.now()
+    return doc
+
+PUBLIC_FIELDS = (
+    'id', 'title', 'price', 'original_price', 'category', 'brand', 'description', 'image_url', 'image_variants',
+    'srcset', 'images', 'model_glb_url', 'sketchfab_embed_url', 'in_stock', 'rating', 'features', 'owner', 'sku', 'stock',
+)
+# Bumped when PUBLIC_FIELDS changes so rebuild_public_products refreshes every stored representation
+PUBLIC_VERSION = 2
+# Named sparse fieldsets, selected with ?view=
+FIELD_PRESETS = {
+    'card': ('id', 'title', 'price', 'original_price', 'category', 'brand', 'image_url', 'srcset', 'in_stock', 'rating', 'sku'),
+}
+# Document keys each public field is built from; drives the Mongo projection
+_SOURCE_FIELDS = {
+    'id': ('_id',),
+    'title': ('title', 'name'),
+    'price': ('price',),
+    'original_price': ('original_price',),
+    'category': ('category',),
+    'brand': ('brand',),
+    'description': ('description',),
+    'image_url': ('image_url',),
+    'image_variants': ('image_variants',),
+    'srcset': ('image_variants',),
+    'images': ('images',),
+    'model_glb_url': ('model_glb_url',),
+    'sketchfab_embed_url': ('sketchfab_embed_url',),
+    'in_stock': ('in_stock',),
+    'rating': ('rating',),
+    'features': ('features',),
+    'owner': (),
+    'sku': ('sku',),
+    'stock': ('stock',),
+}
+
+def requested_fields(params):
+    raw = params.get('fields')
+    if raw:
+        fields = [f.strip() for f in str(raw).split(',') if f.strip() in _SOURCE_FIELDS]
+        return tuple(dict.fromkeys(fields)) or None
+    return FIELD_PRESETS.get(params.get('view') or '')
+
+def mongo_projection(fields):
+    if not fields:
+        return {'_id': 1, 'public': 1}
+    projection = {'_id': 1}
+    for f in fields:
+        if f != 'id':
+            projection['public.' + f] = 1
+    return projection
+
+def _source_projection(fields):
+    projection = {'_id': 1}
+    for f in (fields or PUBLIC_FIELDS):
+        for src in _SOURCE_FIELDS.get(f, ()):
+            projection[src] = 1
+    return projection
+
+def _public_url(u):
+    if u.startswith('/media/'):
+        return _absolute_media_url(u[len('/media/'):])
+    if u.startswith('/'):
+        return _public_backend_url().rstrip('/') + u
+    return u
+
+def _public_category(doc):
+    cat = doc.get('category')
+    cat_name = cat if isinstance(cat, str) else (cat.get('name') if isinstance(cat, dict) else '')
+    return {'id': None, 'name': cat_name}
+
+def _public_images(doc):
     try:
-        mongo['categories'].create_index('name', unique=True)
-        mongo['products'].create_index('sku', unique=True)
-        mongo['products'].create_index([('category', 1)])
-        mongo['products'].create_index([('title', 'text'), ('brand', 'text'), ('description', 'text')])
+        return [_public_url(u) for u in (doc.get('images') or []) if isinstance(u, str)]
     except Exception:
-        pass
+        return []
+
+def _public_variants(doc):
+    out = []
+    for v in doc.get('image_variants') or []:
+        if isinstance(v, dict) and v.get('width'):
+            out.append({k: (_public_url(u) if isinstance(u, str) else u) for k, u in v.items()})
+    return out
+
+def _public_file_url(key):
+    def build(doc):
+        u = doc.get(key) or ''
+        return _public_url(u) if isinstance(u, str) else u
+    return build
+
+_PUBLIC_BUILDERS = {
+    'id': lambda doc: str(doc.get('_id')),
+    'title': lambda doc: doc.get('title') or doc.get('name'),
+    'price': lambda doc: float(doc.get('price') or 0),
+    'original_price': lambda doc: float(doc.get('original_price') or 0),
+    'category': _public_category,
+    'brand': lambda doc: doc.get('brand') or '',
+    'description': lambda doc: doc.get('description') or '',
+    'image_url': _public_file_url('image_url'),
+    'image_variants': _public_variants,
+    'srcset': lambda doc: variant_srcset(_public_variants(doc)),
+    'images': _public_images,
+    'model_glb_url': _public_file_url('model_glb_url'),
+    'sketchfab_embed_url': lambda doc: doc.get('sketchfab_embed_url') or '',
+    'in_stock': lambda doc: bool(doc.get('in_stock', True)),
+    'rating': lambda doc: float(doc.get('rating') or 0),
+    'features': lambda doc: doc.get('features') or [],
+    'owner': lambda doc: None,
+    'sku': lambda doc: doc.get('sku') or '',
+    'stock': lambda doc: int(doc.get('stock') or 0),
+}
+
+def build_product_public(doc, fields=None):
+    return {f: _PUBLIC_BUILDERS[f](doc) for f in (fields or PUBLIC_FIELDS)}
+
+def product_public(doc, fields=None):
+    public = doc.get('public')
+    if not isinstance(public, dict):
+        return build_product_public(doc, fields)
+    out = {}
+    for f in (fields or PUBLIC_FIELDS):
+        out[f] = str(doc.get('_id')) if f == 'id' else public.get(f)
+    return out
+
+def find_product_doc(mongo, key, projection=None):
+    # Detail lookups accept the ObjectId strings the list endpoint returns, ORM ids and SKUs
+    key = str(key or '').strip()
+    if not key:
+        return None
+    if len(key) == 24:
+        try:
+            from bson import ObjectId
+            doc = mongo['products'].find_one({'_id': ObjectId(key)}, projection)
+            if doc:
+                return doc
+        except Exception:
+            pass
+    if key.isdigit():
+        from .models import Product
+        sku = Product.objects.filter(pk=int(key)).values_list('sku', flat=True).first()
+        if sku:
+            doc = mongo['products'].find_one({'sku': sku}, projection)
+            if doc:
+                return doc
+    return mongo['products'].find_one({'sku': key}, projection)
+
+def products_public(collection, docs, fields=None):
+    # Documents written before the public representation existed are re-read with their source fields
+    legacy_ids = [d.get('_id') for d in docs if not isinstance(d.get('public'), dict)]
+    legacy = {}
+    if legacy_ids:
+        for d in collection.find({'_id': {'$in': legacy_ids}}, _source_projection(fields)):
+            legacy[d['_id']] = d
+    return [product_public(legacy.get(d.get('_id'), d), fields) for d in docs]
+
+# Each category document carries product_count: how many public, in-stock products list under it.
+# Product writes go through save_product_doc/delete_product_doc, which read the previous state in the
+# same atomic operation as the write and move the counters with $inc.
+COUNTED_FIELDS = {'category': 1, 'is_public': 1, 'in_stock': 1}
+
+def counted_category(doc):
+    if not doc or not doc.get('is_public', True) or not doc.get('in_stock', True):
+        return None
+    return doc.get('category') or None
+
+def adjust_category_counts(mongo, before, after):
+    old, new = counted_category(before), counted_category(after)
+    if old == new:
+        return
+    if old:
+        mongo['categories'].update_one({'name': old}, {'$inc': {'product_count': -1}})
+    if new:
+        mongo['categories'].update_one({'name': new}, {'$inc': {'product_count': 1}}, upsert=True)
+
+def stored_time(value):
+    # A datetime as both stores can hold it, to whole milliseconds (Mongo's precision), so stamps from either
+    # side compare; pymongo hands back naive UTC. None for anything else.
+    if not isinstance(value, datetime):
+        return None
+    if settings.USE_TZ:
+        value = timezone.make_aware(value, dt_timezone.utc) if timezone.is_naive(value) else value.astimezone(dt_timezone.utc)
+    elif timezone.is_aware(value):
+        value = timezone.make_naive(value)
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+def save_product_doc(mongo, doc, guard=None):
+    # With a guard the stored document must also match it; otherwise nothing is written and None is returned
+    if guard:
+        before = mongo['products'].find_one_and_update({'sku': doc['sku'], **guard}, {'$set': doc}, projection=COUNTED_FIELDS)
+        if before is None:
+            return None
+    else:
+        before = mongo['products'].find_one_and_update({'sku': doc['sku']}, {'$set': doc}, projection=COUNTED_FIELDS, upsert=True)
+    adjust_category_counts(mongo, before, {**(before or {}), **doc})
+    return before
+
+def delete_product_doc(mongo, query):
+    before = mongo['products'].find_one_and_delete(query, projection=COUNTED_FIELDS)
+    adjust_category_counts(mongo, before, None)
+    if before is not None:
+        from .search import record_deleted
+        record_deleted('mongo', [before['_id']])
+    return before
+
+def targeted_set(changes, with_public=True):
+    # $set for a few source fields plus their copies in the materialized public representation
+    sets = dict(changes)
+    if with_public:
+        for f, sources in _SOURCE_FIELDS.items():
+            if any(src in changes for src in sources):
+                sets['public.' + f] = _PUBLIC_BUILDERS[f](changes)
+    sets['updated_at'] = timezone.now()
+    return sets
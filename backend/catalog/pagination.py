@@ -0,0 +1,161 @@
+import base64
+import json
+from decimal import Decimal
+from django.db.models import Q
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from .counts import count_mode, orm_total
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    if not token or not isinstance(token, str):
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw.decode('utf-8'))
+    except Exception:
+        return None
+    return values if isinstance(values, dict) else None
+
+# Listing sorts as (field, direction); every sort ends on the id in the same direction, so
+# equal prices or ratings still page deterministically and one index serves both directions.
+LISTING_SORTS = {
+    'newest': (None, -1),
+    'price': ('price', 1),
+    '-price': ('price', -1),
+    'rating': ('rating', 1),
+    '-rating': ('rating', -1),
+}
+
+def mongo_sort(sort='newest'):
+    field, direction = LISTING_SORTS[sort]
+    return [(field, direction), ('_id', direction)] if field else [('_id', direction)]
+
+def orm_ordering(sort='newest'):
+    field, direction = LISTING_SORTS[sort]
+    prefix = '-' if direction < 0 else ''
+    return [prefix + field, prefix + 'id'] if field else [prefix + 'id']
+
+def mongo_cursor_for(doc, sort='newest'):
+    values = {'id': str(doc.get('_id'))}
+    field = LISTING_SORTS[sort][0]
+    if field:
+        values.update(s=sort, k=doc.get(field))
+    return encode_cursor(values)
+
+def mongo_keyset_filter(values, sort='newest'):
+    # The next page starts strictly after the last (key, _id) seen, in the direction of the sort.
+    field, direction = LISTING_SORTS[sort]
+    if values.get('s', 'newest') != sort:
+        return None
+    try:
+        from bson import ObjectId
+        oid = ObjectId(str(values.get('id')))
+    except Exception:
+        return None
+    op = '$gt' if direction > 0 else '$lt'
+    if not field:
+        return {'_id': {op: oid}}
+    key = values.get('k')
+    # Documents without the field (or with null) sort before every number: first ascending, last descending
+    if key is None:
+        if direction > 0:
+            return {'$or': [{field: None, '_id': {op: oid}}, {field: {'$ne': None}}]}
+        return {field: None, '_id': {op: oid}}
+    if isinstance(key, bool) or not isinstance(key, (int, float)):
+        return None
+    # The range on the sort key gives the index scan its start; the $or only settles ties
+    keyset = {field: {op + 'e': key}, '$or': [{field: {op: key}}, {'_id': {op: oid}}]}
+    return keyset if direction > 0 else {'$or': [keyset, {field: None}]}
+
+def orm_cursor_for(obj, sort='newest'):
+    values = {'id': obj.pk}
+    field = LISTING_SORTS[sort][0]
+    if field:
+        key = getattr(obj, field)
+        values.update(s=sort, k=str(key) if isinstance(key, Decimal) else key)
+    return encode_cursor(values)
+
+def orm_keyset_filter(values, sort='newest'):
+    field, direction = LISTING_SORTS[sort]
+    if values.get('s', 'newest') != sort:
+        return None
+    pk = values.get('id')
+    if isinstance(pk, bool) or not isinstance(pk, int):
+        return None
+    op = 'gt' if direction > 0 else 'lt'
+    if not field:
+        return Q(**{f'id__{op}': pk})
+    try:
+        key = Decimal(str(values.get('k')))
+    except Exception:
+        return None
+    if not key.is_finite():
+        return None
+    return Q(**{f'{field}__{op}e': key}) & (Q(**{f'{field}__{op}': key}) | Q(**{f'id__{op}': pk}))
+
+def page_params(params, default_size=20, max_size=100):
+    # (page, page_size, cursor values); an unreadable cursor comes back as False
+    try:
+        page = max(1, int(params.get('page', '1')))
+    except Exception:
+        page = 1
+    try:
+        page_size = min(max_size, max(1, int(params.get('page_size', default_size))))
+    except Exception:
+        page_size = default_size
+    token = params.get('cursor')
+    after = decode_cursor(token) if token else None
+    if token and after is None:
+        after = False
+    return page, page_size, after
+
+class ProductPagination(BasePagination):
+    # Same envelope as the Mongo listing: page/page_size or an opaque keyset cursor, and a total
+    # chosen by ?count= (see counts.py)
+    default_page_size = 20
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        self.page, self.page_size, self.after = page_params(params, self.default_page_size, self.max_page_size)
+        if self.after is False:
+            raise ParseError('Invalid cursor')
+        sort = params.get('sort') if params.get('sort') in LISTING_SORTS else 'newest'
+        # Relevance-ranked search results have no key to seek on, so their cursors carry an offset
+        ranked = getattr(view, 'rank_ordered', False)
+        offset = (self.page - 1) * self.page_size
+        if self.after and ranked:
+            offset = self.after.get('o')
+            if isinstance(offset, bool) or not isinstance(offset, int) or offset < 0:
+                raise ParseError('Invalid cursor')
+        elif self.after:
+            keyset = orm_keyset_filter(self.after, sort)
+            if keyset is None:
+                raise ParseError('Invalid cursor')
+        self.total, self.estimated = orm_total(queryset, params, count_mode(params) or 'exact', getattr(view, 'count_scope', 'orm'))
+        if self.total is not None and getattr(view, 'search_capped', False):
+            # Counted from a ranking SEARCH_MAX_RESULTS cut short
+            self.estimated = True
+        if self.after and not ranked:
+            queryset = queryset.filter(keyset)
+            offset = 0
+        rows = list(queryset[offset:offset + self.page_size + 1])
+        if len(rows) <= self.page_size:
+            self.next_cursor = None
+        elif ranked:
+            self.next_cursor = encode_cursor({'o': offset + self.page_size})
+        else:
+            self.next_cursor = orm_cursor_for(rows[self.page_size - 1], sort)
+        return rows[:self.page_size]
+
+    def get_paginated_response(self, data):
+        body = {'results': data, 'page': None if self.after else self.page, 'page_size': self.page_size, 'total': self.total, 'next_cursor': self.next_cursor}
+        if self.estimated:
+            body['total_estimated'] = True
+        return Response(body)
@@ -0,0 +1,331 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime
+from django.conf import settings
+from django.utils import timezone
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+# A title or brand hit says more about a product than a word buried in its description
+FIELD_WEIGHTS = {'title': 3.0, 'brand': 2.0, 'category': 2.0, 'features': 1.0, 'description': 1.0}
+# Expanded prefix terms score below an exact term and are capped so one-letter queries stay cheap
+PREFIX_WEIGHT = 0.5
+MAX_PREFIX_TERMS = 50
+SNAPSHOT_FORMAT = 2
+
+def tokenize(text):
+    return _TOKEN_RE.findall(str(text or '').lower())
+
+def _field_text(value):
+    if isinstance(value, (list, tuple)):
+        return ' '.join(str(v) for v in value)
+    if isinstance(value, dict):
+        return str(value.get('name') or '')
+    return str(value or '')
+
+class SearchIndex:
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.docs = {}
+        self.sku_ids = {}
+        self.total_len = 0.0
+        self._vocab = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def upsert(self, doc_id, doc):
+        tf = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            source = doc.get(field)
+            if field == 'title' and not source:
+                source = doc.get('name')
+            for term in tokenize(_field_text(source)):
+                tf[term] = tf.get(term, 0.0) + weight
+        meta = {
+            'sku': doc.get('sku') or '',
+            'category': _field_text(doc.get('category')).lower(),
+            'brand': str(doc.get('brand') or '').lower(),
+            'in_stock': bool(doc.get('in_stock', True)),
+            'is_public': bool(doc.get('is_public', True)),
+        }
+        self._put(str(doc_id), tf, meta)
+
+    def _put(self, doc_id, tf, meta):
+        with self._lock:
+            self.remove(doc_id)
+            length = sum(tf.values())
+            self.docs[doc_id] = {'tf': tf, 'len': length, 'meta': meta}
+            self.total_len += length
+            for term, w in tf.items():
+                bucket = self.postings.get(term)
+                if bucket is None:
+                    bucket = self.postings[term] = {}
+                    self._vocab = None
+                bucket[doc_id] = w
+            if meta.get('sku'):
+                self.sku_ids[meta['sku']] = doc_id
+
+    def remove(self, doc_id):
+        with self._lock:
+            entry = self.docs.pop(str(doc_id), None)
+            if entry is None:
+                return False
+            self.total_len -= entry['len']
+            for term in entry['tf']:
+                bucket = self.postings.get(term)
+                if bucket is not None:
+                    bucket.pop(str(doc_id), None)
+                    if not bucket:
+                        del self.postings[term]
+                        self._vocab = None
+            sku = entry['meta'].get('sku')
+            if sku and self.sku_ids.get(sku) == str(doc_id):
+                del self.sku_ids[sku]
+            return True
+
+    def _expand(self, token):
+        if self._vocab is None:
+            self._vocab = sorted(self.postings)
+        vocab = self._vocab
+        out = []
+        i = bisect_left(vocab, token)
+        while i < len(vocab) and vocab[i].startswith(token) and len(out) < MAX_PREFIX_TERMS:
+            out.append((vocab[i], 1.0 if vocab[i] == token else PREFIX_WEIGHT))
+            i += 1
+        return out
+
+    def search(self, query, filters=None, limit=None):
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        filters = {k: v for k, v in (filters or {}).items() if v is not None}
+        for key in ('category', 'brand'):
+            if key in filters:
+                filters[key] = str(filters[key]).lower()
+        with self._lock:
+            n = len(self.docs)
+            if not n:
+                return []
+            avgdl = (self.total_len / n) or 1.0
+            scores = {}
+            for token in tokens:
+                terms = self._expand(token) if len(token) > 1 else [(token, 1.0)]
+                for term, boost in terms:
+                    bucket = self.postings.get(term)
+                    if not bucket:
+                        continue
+                    idf = math.log(1 + (n - len(bucket) + 0.5) / (len(bucket) + 0.5))
+                    for doc_id, tf in bucket.items():
+                        dl = self.docs[doc_id]['len']
+                        s = boost * idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * dl / avgdl))
+                        scores[doc_id] = scores.get(doc_id, 0.0) + s
+            if filters:
+                scores = {d: s for d, s in scores.items() if all(self.docs[d]['meta'].get(k) == v for k, v in filters.items())}
+        ranked = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))
+        return ranked[:limit] if limit else ranked
+
+    def to_snapshot(self):
+        with self._lock:
+            return {'docs': {d: {'tf': e['tf'], 'meta': e['meta']} for d, e in self.docs.items()}}
+
+    @classmethod
+    def from_snapshot(cls, data):
+        index = cls()
+        for doc_id, entry in (data.get('docs') or {}).items():
+            index._put(doc_id, entry.get('tf') or {}, entry.get('meta') or {})
+        return index
+
+# Process-wide index over the primary product store (Mongo when configured, otherwise the ORM).
+_state = {'index': None, 'source': None, 'synced_at': None, 'checked': 0.0, 'building': None}
+_state_lock = threading.Lock()
+TEXT_PROJECTION = {'title': 1, 'name': 1, 'brand': 1, 'description': 1, 'features': 1, 'category': 1, 'in_stock': 1, 'is_public': 1, 'sku': 1, 'rating': 1}
+
+def index_source():
+    return 'mongo' if getattr(settings, 'MONGO_DB', None) is not None else 'orm'
+
+def iter_source_docs(source, since=None, skus=None):
+    if source == 'mongo':
+        query = {}
+        if since is not None:
+            query['updated_at'] = {'$gte': since}
+        if skus is not None:
+            query['sku'] = {'$in': list(skus)}
+        for d in settings.MONGO_DB['products'].find(query, TEXT_PROJECTION).batch_size(1000):
+            yield str(d['_id']), d
+        return
+    from .models import Product
+    qs = Product.objects.select_related('category').only(
+        'id', 'title', 'brand', 'description', 'features', 'in_stock', 'is_public', 'sku', 'rating', 'category__name'
+    )
+    if since is not None:
+        qs = qs.filter(updated_at__gte=since)
+    if skus is not None:
+        qs = qs.filter(sku__in=list(skus))
+    for p in qs.iterator(chunk_size=1000):
+        yield str(p.pk), {
+            'title': p.title, 'brand': p.brand, 'description': p.description, 'features': p.features,
+            'category': p.category.name, 'in_stock': p.in_stock, 'is_public': p.is_public, 'sku': p.sku, 'rating': p.rating,
+        }
+
+def live_ids(source, doc_ids):
+    # Which of doc_ids still exist; one _id-only lookup
+    if source == 'mongo':
+        from bson import ObjectId
+        oids = [ObjectId(i) for i in doc_ids if ObjectId.is_valid(i)]
+        return {str(d['_id']) for d in settings.MONGO_DB['products'].find({'_id': {'$in': oids}}, {'_id': 1})} if oids else set()
+    from .models import Product
+    pks = [int(i) for i in doc_ids if str(i).isdigit()]
+    return {str(pk) for pk in Product.objects.filter(pk__in=pks).values_list('pk', flat=True)} if pks else set()
+
+# Deleted products are recorded for this long; an index that has not caught up within it is rebuilt
+TOMBSTONE_TTL_SECONDS = 7 * 24 * 3600
+
+def record_deleted(source, doc_ids):
+    # Other processes' in-process indexes learn of deletes from these on their next catch-up
+    doc_ids = [str(i) for i in doc_ids if i is not None]
+    if not doc_ids:
+        return
+    now = timezone.now()
+    if source == 'mongo':
+        settings.MONGO_DB['product_tombstones'].insert_many([{'doc_id': i, 'deleted_at': now} for i in doc_ids])
+        return
+    from datetime import timedelta
+    from .models import ProductTombstone
+    ProductTombstone.objects.bulk_create([ProductTombstone(product_id=int(i), deleted_at=now) for i in doc_ids if i.isdigit()])
+    ProductTombstone.objects.filter(deleted_at__lt=now - timedelta(seconds=TOMBSTONE_TTL_SECONDS)).delete()
+
+def deleted_since(source, since):
+    if source == 'mongo':
+        return [d['doc_id'] for d in settings.MONGO_DB['product_tombstones'].find({'deleted_at': {'$gte': since}}, {'doc_id': 1})]
+    from .models import ProductTombstone
+    return [str(i) for i in ProductTombstone.objects.filter(deleted_at__gte=since).values_list('product_id', flat=True)]
+
+def drop_deleted(index, doc_ids, source=None):
+    # Deletes leave no updated_at for the catch-up scan to find when another process made them (outbox and
+    # media workers, reconcile_catalog --prune), so ranked hits are checked against the store before use
+    if not doc_ids:
+        return doc_ids
+    live = live_ids(source or index_source(), doc_ids)
+    for doc_id in doc_ids:
+        if doc_id not in live:
+            index.remove(doc_id)
+    return [d for d in doc_ids if d in live]
+
+def _source_size(source):
+    if source == 'mongo':
+        return settings.MONGO_DB['products'].estimated_document_count()
+    from .models import Product
+    return Product.objects.count()
+
+def _snapshot_path():
+    return str(getattr(settings, 'SEARCH_INDEX_PATH', '') or '')
+
+def build_index(source=None):
+    source = source or index_source()
+    started = timezone.now()
+    index = SearchIndex()
+    for doc_id, doc in iter_source_docs(source):
+        index.upsert(doc_id, doc)
+    return index, started
+
+def save_snapshot(index, source, synced_at, path=None):
+    path = path or _snapshot_path()
+    if not path:
+        return None
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        json.dump({'format': SNAPSHOT_FORMAT, 'source': source, 'synced_at': synced_at.isoformat(), **index.to_snapshot()}, fh, separators=(',', ':'))
+    os.replace(tmp, path)
+    return path
+
+def _load_snapshot(source):
+    path = _snapshot_path()
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as fh:
+            data = json.load(fh)
+        if data.get('format') != SNAPSHOT_FORMAT or data.get('source') != source:
+            return None
+        return SearchIndex.from_snapshot(data), datetime.fromisoformat(data['synced_at'])
+    except Exception:
+        return None
+
+def _build_in_background(source):
+    from django.db import connection
+    try:
+        index, synced_at = build_index(source)
+        try:
+            save_snapshot(index, source, synced_at)
+        except Exception:
+            pass
+        with _state_lock:
+            if _state['index'] is None or _state['source'] != source:
+                _state.update(index=index, source=source, synced_at=synced_at, checked=0.0)
+    except Exception:
+        # The next request starts another attempt
+        pass
+    finally:
+        _state['building'] = None
+        connection.close()
+
+def get_search_index():
+    # None while there is no index yet; callers then keep their database search path
+    if not getattr(settings, 'SEARCH_INDEX_ENABLED', True):
+        return None
+    source = index_source()
+    with _state_lock:
+        now = time.monotonic()
+        if _state['index'] is None or _state['source'] != source:
+            loaded = _load_snapshot(source)
+            if loaded is None:
+                # Without a snapshot, a large catalog is indexed on a thread rather than inside this request
+                if _source_size(source) > int(getattr(settings, 'SEARCH_INDEX_INLINE_BUILD_LIMIT', 5000)):
+                    if _state['building'] != source:
+                        _state['building'] = source
+                        threading.Thread(target=_build_in_background, args=(source,), daemon=True, name='search-index-build').start()
+                    return None
+                index, synced_at = build_index(source)
+                try:
+                    save_snapshot(index, source, synced_at)
+                except Exception:
+                    pass
+            else:
+                index, synced_at = loaded
+            _state.update(index=index, source=source, synced_at=synced_at, checked=0.0)
+        # Catch up on writes made by other workers since the last sync
+        if now - _state['checked'] >= float(getattr(settings, 'SEARCH_INDEX_REFRESH', 5)):
+            started = timezone.now()
+            for doc_id, doc in iter_source_docs(source, since=_state['synced_at']):
+                _state['index'].upsert(doc_id, doc)
+            for doc_id in deleted_since(source, _state['synced_at']):
+                _state['index'].remove(doc_id)
+            _state.update(synced_at=started, checked=now)
+        return _state['index']
+
+def reset_search_index():
+    with _state_lock:
+        _state.update(index=None, source=None, synced_at=None, checked=0.0, building=None)
+
+def reindex_products(*skus):
+    index = _state['index']
+    skus = {s for s in skus if s}
+    if index is None or not skus:
+        return
+    found = set()
+    for doc_id, doc in iter_source_docs(_state['source'], skus=skus):
+        index.upsert(doc_id, doc)
+        found.add(doc.get('sku'))
+    for sku in skus - found:
+        doc_id = index.sku_ids.get(sku)
+        if doc_id is not None:
+            index.remove(doc_id)
@@ -1,29 +1,88 @@
 from rest_framework import serializers
 from django.conf import settings
 from django.core.files.storage import default_storage
+from django.db.models import Prefetch
+from functools import lru_cache
 import os
 import json
 from .models import Product, Category
 from .models import ProductImage
+from .blobs import save_storage_blob
+from .variants import group_variants, storage_variants, variant_srcset
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'name']
 
+# Model columns needed to render each public field; used with .only() for sparse fieldsets
+PRODUCT_SOURCE_COLUMNS = {
+    'id': ('id',),
+    'title': ('title',),
+    'price': ('price',),
+    'original_price': ('original_price',),
+    'category': ('category', 'category__name'),
+    'brand': ('brand',),
+    'description': ('description',),
+    'image_url': ('image_url', 'image'),
+    'image_variants': ('image_variants',),
+    'srcset': ('image_variants',),
+    'images': (),
+    'model_glb_url': ('model_glb_url',),
+    'sketchfab_embed_url': ('sketchfab_embed_url',),
+    'in_stock': ('in_stock',),
+    'rating': ('rating',),
+    'features': ('features',),
+    'owner': ('owner',),
+    'sku': ('sku',),
+    'stock': ('stock',),
+}
+
+def shape_product_queryset(qs, fields=None, prefix='', extra=()):
+    # Loads exactly what ProductSerializer renders: needed columns only, the category join and one
+    # images prefetch, so N products cost a fixed number of queries. prefix/extra shape querysets of
+    # rows that nest a product (cart and order items).
+    fields = fields or tuple(PRODUCT_SOURCE_COLUMNS)
+    columns = {prefix + 'id', *extra}
+    for f in fields:
+        columns.update(prefix + c for c in PRODUCT_SOURCE_COLUMNS.get(f, ()))
+    qs = qs.select_related(None)
+    if prefix:
+        qs = qs.select_related(prefix.rstrip('_'))
+    if 'category' in fields:
+        qs = qs.select_related(prefix + 'category')
+    if 'images' in fields:
+        qs = qs.prefetch_related(Prefetch(prefix + 'images', queryset=ProductImage.objects.only('id', 'product', 'image').order_by('id')))
+    return qs.only(*sorted(columns))
+
+@lru_cache(maxsize=4096)
+def storage_url(name):
+    # Storage URLs are a pure function of the stored name (local media or Cloudinary), so each is built once per process
+    return default_storage.url(name)
+
 class ProductSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     category_name = serializers.CharField(write_only=True, required=False)
     category_id = serializers.IntegerField(write_only=True, required=False)
     image = serializers.ImageField(write_only=True, required=False)
     images = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
     model_glb = serializers.FileField(write_only=True, required=False)
     features = serializers.ListField(child=serializers.CharField(), required=False, allow_empty=True)
 
     class Meta:
         model = Product
-        fields = ['id', 'title', 'price', 'original_price', 'category', 'category_name', 'category_id', 'brand', 'description', 'image_url', 'images', 'image', 'model_glb', 'model_glb_url', 'sketchfab_embed_url', 'in_stock', 'rating', 'features', 'owner', 'sku', 'stock']
-        read_only_fields = ['owner']
+        fields = ['id', 'title', 'price', 'original_price', 'category', 'category_name', 'category_id', 'brand', 'description', 'image_url', 'image_variants', 'srcset', 'images', 'image', 'model_glb', 'model_glb_url', 'sketchfab_embed_url', 'in_stock', 'rating', 'features', 'owner', 'sku', 'stock']
+        read_only_fields = ['owner', 'image_variants']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Sparse fieldsets: drop readable fields the caller did not ask for
+        fields = self.context.get('fields')
+        if fields:
+            for name in list(self.fields):
+                if name not in fields and not self.fields[name].write_only:
+                    self.fields.pop(name)
 
     def to_internal_value(self, data):
         # Normalize features if provided as JSON string
@@ -130,20 +189,21 @@ class ProductSerializer(serializers.ModelSerializer):
         # Save primary image if provided
         if image is not None:
             try:
-                product.image.save(image.name, image, save=True)
+                product.image = save_storage_blob(image, image.name)
                 if getattr(product.image, 'url', ''):
                     url = product.image.url
                     if request:
                         url = request.build_absolute_uri(url)
                     product.image_url = url
-                    product.save(update_fields=['image_url'])
+                    product.image_variants = self._variants(product.image.name)
+                product.save(update_fields=['image', 'image_url', 'image_variants'])
             except Exception:
                 pass
 
         # Save GLB file if provided using default storage
         if model_glb is not None:
             try:
-                name = default_storage.save(f"uploads/{model_glb.name}", model_glb)
+                name = save_storage_blob(model_glb, model_glb.name)
                 url = default_storage.url(name)
                 if request:
                     url = request.build_absolute_uri(url)
@@ -157,8 +217,7 @@ class ProductSerializer(serializers.ModelSerializer):
             try:
                 for imgf in request.FILES.getlist('images'):
                     try:
-                        pi = ProductImage(product=product)
-                        pi.image.save(imgf.name, imgf, save=True)
+                        pi = ProductImage.objects.create(product=product, image=save_storage_blob(imgf, imgf.name))
                         images_urls.append(request.build_absolute_uri(pi.image.url) if getattr(pi.image, 'url', '') else '')
                     except Exception:
                         pass
@@ -201,18 +260,22 @@ class ProductSerializer(serializers.ModelSerializer):
         # File updates (cloud or media)
         if image is not None:
             try:
-                instance.image.save(image.name, image, save=True)
+                instance.image = save_storage_blob(image, image.name)
                 if getattr(instance.image, 'url', ''):
                     url = instance.image.url
                     request = self.context.get('request')
                     if request:
                         url = request.build_absolute_uri(url)
                     instance.image_url = url
+                    instance.image_variants = self._variants(instance.image.name)
             except Exception:
                 pass
+        elif validated_data.get('image_url', instance.image_url) != instance.image_url:
+            # Derivatives of the previous image would no longer match
+            instance.image_variants = []
         if model_glb is not None:
             try:
-                name = default_storage.save(f"uploads/{model_glb.name}", model_glb)
+                name = save_storage_blob(model_glb, model_glb.name)
                 url = default_storage.url(name)
                 request = self.context.get('request')
                 if request:
@@ -228,8 +291,10 @@ class ProductSerializer(serializers.ModelSerializer):
             try:
                 for imgf in request.FILES.getlist('images'):
                     try:
-                        pi = ProductImage(product=instance)
-                        pi.image.save(imgf.name, imgf, save=True)
+                        key = save_storage_blob(imgf, imgf.name)
+                        # Re-uploading a gallery image the product already has adds nothing
+                        if not instance.images.filter(image=key).exists():
+                            ProductImage.objects.create(product=instance, image=key)
                     except Exception:
                         pass
             except Exception:
@@ -240,30 +305,64 @@ class ProductSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
-    def get_images(self, obj):
+    def _variants(self, name):
+        # Responsive derivatives of a stored image; files Pillow cannot read simply get none
         request = self.context.get('request')
+        try:
+            saved = storage_variants(name)
+        except Exception:
+            return []
+        return group_variants([(w, fmt, request.build_absolute_uri(default_storage.url(n)) if request else default_storage.url(n)) for w, fmt, n in saved])
+
+    def _absolute(self, url):
+        request = self.context.get('request')
+        if not request or not url:
+            return url
+        if url.startswith('/'):
+            # The scheme and host are resolved once per request rather than once per URL
+            base = self.context.get('_absolute_base')
+            if base is None:
+                base = self.context['_absolute_base'] = request.build_absolute_uri('/')[:-1]
+            return base + url
+        if '://' in url:
+            return url
+        return request.build_absolute_uri(url)
+
+    def _file_url(self, f):
+        name = getattr(f, 'name', '') or ''
+        if not name:
+            return ''
+        url = storage_url(name) if f.storage is default_storage else f.url
+        return self._absolute(url)
+
+    def get_images(self, obj):
         urls = []
         try:
             for im in getattr(obj, 'images').all():
-                u = getattr(im.image, 'url', '')
+                u = self._file_url(im.image)
                 if u:
-                    urls.append(request.build_absolute_uri(u) if request else u)
+                    urls.append(u)
         except Exception:
             pass
         return urls
 
+    def _absolute_variants(self, variants):
+        return [{k: (self._absolute(u) if isinstance(u, str) else u) for k, u in v.items()} for v in (variants or []) if isinstance(v, dict)]
+
+    def get_srcset(self, obj):
+        return variant_srcset(self._absolute_variants(obj.image_variants))
+
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        request = self.context.get('request')
         # Normalize image_url to absolute
-        if getattr(instance, 'image', None) and getattr(instance.image, 'url', ''):
-            url = instance.image.url
-            data['image_url'] = request.build_absolute_uri(url) if request else url
-        elif isinstance(data.get('image_url'), str):
-            url = data['image_url']
-            if request and url.startswith('/'):
-                data['image_url'] = request.build_absolute_uri(url)
+        image_file = self._file_url(instance.image) if 'image_url' in data and getattr(instance, 'image', None) else ''
+        if image_file:
+            data['image_url'] = image_file
+        elif isinstance(data.get('image_url'), str) and data['image_url'].startswith('/'):
+            data['image_url'] = self._absolute(data['image_url'])
+        if 'image_variants' in data:
+            data['image_variants'] = self._absolute_variants(data['image_variants'])
         # model_glb_url absolute
-        if isinstance(data.get('model_glb_url'), str) and data['model_glb_url'] and request and data['model_glb_url'].startswith('/'):
-            data['model_glb_url'] = request.build_absolute_uri(data['model_glb_url'])
+        if isinstance(data.get('model_glb_url'), str) and data['model_glb_url'].startswith('/'):
+            data['model_glb_url'] = self._absolute(data['model_glb_url'])
         return data
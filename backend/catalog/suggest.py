@@ -0,0 +1,220 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from django.conf import settings
+from django.utils import timezone
+from .search import TOMBSTONE_TTL_SECONDS, _source_size, deleted_since, iter_source_docs, index_source, tokenize
+
+# Every word start of a title is a key, so "ring" finds "Gold ring"; long titles keep only the first few
+MAX_KEYS_PER_ENTRY = 6
+# Every key under a prefix is ranked, so one- and two-letter prefixes (the widest ranges) keep their
+# answers until an entry under them changes
+MEMO_PREFIX_LEN = 2
+MAX_GROUP = 3
+
+def _keys_for(text):
+    words = tokenize(text)
+    return [' '.join(words[i:]) for i in range(min(len(words), MAX_KEYS_PER_ENTRY))]
+
+class SuggestIndex:
+    def __init__(self):
+        self._keys = []
+        self.entries = {}
+        self.products = {}
+        self.sku_ids = {}
+        self._bulk = False
+        self._memo = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _forget(self, entry):
+        # Only the memoized prefixes this entry answers can change
+        if not self._memo:
+            return
+        heads = {key[:n] for key in entry['keys'] for n in range(1, MEMO_PREFIX_LEN + 1)}
+        for memo_key in [k for k in self._memo if k[0] in heads]:
+            del self._memo[memo_key]
+
+    def _add_entry(self, eid, text, **extra):
+        entry = {'text': text, 'keys': _keys_for(text), **extra}
+        self.entries[eid] = entry
+        self._forget(entry)
+        for key in entry['keys']:
+            if self._bulk:
+                self._keys.append((key, eid))
+            else:
+                insort(self._keys, (key, eid))
+        return entry
+
+    def load(self, docs):
+        # Full builds append and sort once instead of paying an insort per key
+        with self._lock:
+            self._bulk = True
+            try:
+                for doc_id, doc in docs:
+                    self.upsert(doc_id, doc)
+            finally:
+                self._bulk = False
+                self._keys.sort()
+        return self
+
+    def _drop_entry(self, eid):
+        entry = self.entries.pop(eid, None)
+        if entry is None:
+            return
+        self._forget(entry)
+        for key in entry['keys']:
+            if self._bulk:
+                self._keys.remove((key, eid))
+                continue
+            i = bisect_left(self._keys, (key, eid))
+            if i < len(self._keys) and self._keys[i] == (key, eid):
+                del self._keys[i]
+
+    def _count(self, eid, text, delta):
+        entry = self.entries.get(eid)
+        if entry is None:
+            if delta <= 0 or not text:
+                return
+            entry = self._add_entry(eid, text, type='brand' if eid.startswith('b:') else 'category', score=0)
+        entry['score'] += delta
+        self._forget(entry)
+        if entry['score'] <= 0:
+            self._drop_entry(eid)
+
+    def upsert(self, doc_id, doc):
+        doc_id = str(doc_id)
+        with self._lock:
+            self.remove(doc_id)
+            if not doc.get('is_public', True) or not doc.get('in_stock', True):
+                return
+            title = str(doc.get('title') or doc.get('name') or '').strip()
+            brand = str(doc.get('brand') or '').strip()
+            category = doc.get('category')
+            category = str((category.get('name') if isinstance(category, dict) else category) or '').strip()
+            if title:
+                self._add_entry('p:' + doc_id, title, type='product', score=float(doc.get('rating') or 0), id=doc_id, sku=doc.get('sku') or '')
+            refs = []
+            if brand:
+                refs.append(('b:' + brand.lower(), brand))
+            if category:
+                refs.append(('c:' + category.lower(), category))
+            for eid, text in refs:
+                self._count(eid, text, 1)
+            self.products[doc_id] = {'sku': doc.get('sku') or '', 'refs': [eid for eid, _ in refs]}
+            if doc.get('sku'):
+                self.sku_ids[doc['sku']] = doc_id
+
+    def remove(self, doc_id):
+        doc_id = str(doc_id)
+        with self._lock:
+            info = self.products.pop(doc_id, None)
+            if info is None:
+                return False
+            self._drop_entry('p:' + doc_id)
+            if self.sku_ids.get(info['sku']) == doc_id:
+                del self.sku_ids[info['sku']]
+            for eid in info['refs']:
+                self._count(eid, None, -1)
+            return True
+
+    def remove_sku(self, sku):
+        doc_id = self.sku_ids.get(sku)
+        return self.remove(doc_id) if doc_id is not None else False
+
+    def suggest(self, q, limit=8):
+        prefix = ' '.join(tokenize(q))
+        if not prefix:
+            return []
+        with self._lock:
+            memo_key = (prefix, limit)
+            if len(prefix) <= MEMO_PREFIX_LEN and memo_key in self._memo:
+                return list(self._memo[memo_key])
+            seen = {}
+            # Keys are lowercase letters, digits and spaces, so every key under the prefix sorts before this bound
+            stop = bisect_left(self._keys, (prefix + '\uffff',))
+            for key, eid in self._keys[bisect_left(self._keys, (prefix,)):stop]:
+                # A match at the start of the text outranks one further in
+                leading = key == self.entries[eid]['keys'][0]
+                seen[eid] = seen.get(eid, False) or leading
+            by_type = {'category': [], 'brand': [], 'product': []}
+            for eid, leading in seen.items():
+                by_type[self.entries[eid]['type']].append((eid, leading))
+            rank = lambda kv: (not kv[1], -self.entries[kv[0]]['score'], self.entries[kv[0]]['text'])
+            groups = {
+                kind: [self.entries[eid] for eid, _ in heapq.nsmallest(limit if kind == 'product' else MAX_GROUP, items, key=rank)]
+                for kind, items in by_type.items()
+            }
+            out = []
+            for kind in ('category', 'brand'):
+                for entry in groups[kind]:
+                    out.append({'type': kind, 'text': entry['text'], 'count': int(entry['score'])})
+            for entry in groups['product']:
+                out.append({'type': 'product', 'text': entry['text'], 'id': entry['id'], 'sku': entry['sku'], 'rating': entry['score']})
+            # Products fill whatever room the category and brand rows leave
+            out = out[:limit]
+            if len(prefix) <= MEMO_PREFIX_LEN:
+                self._memo[memo_key] = out
+        return list(out)
+
+_state = {'index': None, 'source': None, 'synced_at': None, 'checked': 0.0, 'building': None}
+_state_lock = threading.Lock()
+
+def _build_in_background(source):
+    from django.db import connection
+    try:
+        started = timezone.now()
+        index = SuggestIndex().load(iter_source_docs(source))
+        with _state_lock:
+            if _state['index'] is None or _state['source'] != source:
+                _state.update(index=index, source=source, synced_at=started, checked=0.0)
+    except Exception:
+        # The next request starts another attempt
+        pass
+    finally:
+        _state['building'] = None
+        connection.close()
+
+def get_suggest_index():
+    # None while a large catalog is being indexed on a thread; callers answer with no suggestions meanwhile
+    source = index_source()
+    with _state_lock:
+        now = time.monotonic()
+        stale = _state['synced_at'] is not None and (timezone.now() - _state['synced_at']).total_seconds() >= TOMBSTONE_TTL_SECONDS
+        if _state['index'] is None or _state['source'] != source or stale:
+            if _source_size(source) > int(getattr(settings, 'SEARCH_INDEX_INLINE_BUILD_LIMIT', 5000)):
+                if _state['building'] != source:
+                    _state['building'] = source
+                    threading.Thread(target=_build_in_background, args=(source,), daemon=True, name='suggest-index-build').start()
+                return None if _state['source'] != source else _state['index']
+            started = timezone.now()
+            index = SuggestIndex().load(iter_source_docs(source))
+            _state.update(index=index, source=source, synced_at=started, checked=now)
+        elif now - _state['checked'] >= float(getattr(settings, 'SEARCH_INDEX_REFRESH', 5)):
+            # Catch up on writes and deletes made by other workers since the last sync
+            started = timezone.now()
+            for doc_id, doc in iter_source_docs(source, since=_state['synced_at']):
+                _state['index'].upsert(doc_id, doc)
+            for doc_id in deleted_since(source, _state['synced_at']):
+                _state['index'].remove(doc_id)
+            _state.update(synced_at=started, checked=now)
+        return _state['index']
+
+def reset_suggest_index():
+    with _state_lock:
+        _state.update(index=None, source=None, synced_at=None, checked=0.0, building=None)
+
+def reindex_suggestions(*skus):
+    index = _state['index']
+    skus = {s for s in skus if s}
+    if index is None or not skus:
+        return
+    found = set()
+    for doc_id, doc in iter_source_docs(_state['source'], skus=skus):
+        index.upsert(doc_id, doc)
+        found.add(doc.get('sku'))
+    for sku in skus - found:
+        index.remove_sku(sku)
@@ -1,8 +1,22 @@
+import hashlib
+import json
+import os
+import secrets
+from unittest import skipUnless
 from django.test import TestCase
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
-from .models import Category, Product
+from .models import Category, Product, MediaBlob, MediaReference
+from .blobs import blob_key, blob_key_of, collect_blobs, local_blob_path
 from .serializers import ProductSerializer
+from .mongo import product_public, product_doc_from_request, mongo_projection, requested_fields, counted_category
+from .cache import LRUCache, cache_stats, product_doc_cache, invalidate_product_doc, facet_cache
+from .pagination import encode_cursor, decode_cursor, mongo_keyset_filter, mongo_sort, LISTING_SORTS
+from .views import product_list_query, _merge_query
+from .search import SearchIndex, reset_search_index
+from .facets import mongo_facet_stages
+from .suggest import SuggestIndex, reset_suggest_index
+from stylesathi_backend.mongo_indexes import plan_summary, INDEXES
 
 
 class ProductsCategoryFilterTests(TestCase):
@@ -81,3 +95,1064 @@ class ProductFileValidationTests(TestCase):
         ser = ProductSerializer(data=data, context={'request': type('obj', (), {'FILES': {'model_glb': bad_glb}})()})
         self.assertFalse(ser.is_valid())
         self.assertIn('model_glb', ser.errors)
+
+class CursorTokenTests(TestCase):
+    def test_cursor_round_trip_is_opaque(self):
+        token = encode_cursor({'id': '65a000000000000000000001'})
+        self.assertNotIn('=', token)
+        self.assertEqual(decode_cursor(token), {'id': '65a000000000000000000001'})
+
+    def test_invalid_cursor_rejected(self):
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+        self.assertIsNone(mongo_keyset_filter({'id': 'zzz'}))
+
+class ProductVisibilityTests(TestCase):
+    def test_save_derives_visibility_flags(self):
+        cat = Category.objects.create(name='Glasses')
+        seed = Product.objects.create(title='Seed', price=1, category=cat, brand='sample', sku='SKU-SEED-1')
+        real = Product.objects.create(title='Real', price=1, category=cat, brand='Ray-Ban', sku='SKU-REAL-1')
+        self.assertTrue(seed.is_seed)
+        self.assertFalse(seed.is_public)
+        self.assertFalse(real.is_seed)
+        self.assertTrue(real.is_public)
+
+    def test_listing_hides_seed_products(self):
+        cat = Category.objects.create(name='Glasses')
+        Product.objects.create(title='Seed', price=1, category=cat, sku='GLB-SAMPLE-001')
+        Product.objects.create(title='Real', price=1, category=cat, brand='Ray-Ban', sku='SKU-REAL-2')
+        resp = self.client.get("/api/products/")
+        titles = [p['title'] for p in resp.json()['results']]
+        self.assertEqual(titles, ['Real'])
+
+class IndexAuditPlanTests(TestCase):
+    def test_plan_summary_flags_collscan_and_sort(self):
+        explain = {'queryPlanner': {'winningPlan': {'stage': 'SORT', 'inputStage': {'stage': 'COLLSCAN'}}}}
+        self.assertEqual(plan_summary(explain)['stages'], ['SORT', 'COLLSCAN'])
+
+    def test_plan_summary_reads_sbe_index_names(self):
+        explain = {'queryPlanner': {'winningPlan': {'queryPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': 'public_listing'}}}}}
+        summary = plan_summary(explain)
+        self.assertEqual(summary['indexes'], {'public_listing'})
+        self.assertNotIn('COLLSCAN', summary['stages'])
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        cat = Category.objects.create(name='Glasses')
+        Product.objects.create(title='Aviator', price=10, category=cat, brand='Ray-Ban', description='Long text', sku='SKU-AV-1')
+
+    def test_fields_param_trims_orm_listing(self):
+        resp = self.client.get("/api/products/?fields=id,title,price")
+        self.assertEqual(set(resp.json()['results'][0]), {'id', 'title', 'price'})
+
+    def test_card_view_preset(self):
+        resp = self.client.get("/api/products/?view=card")
+        item = resp.json()['results'][0]
+        self.assertIn('image_url', item)
+        self.assertNotIn('description', item)
+        self.assertEqual(item['category']['name'], 'Glasses')
+
+    def test_mongo_projection_and_trimmed_public(self):
+        fields = requested_fields({'fields': 'title,bogus,category'})
+        self.assertEqual(fields, ('title', 'category'))
+        self.assertEqual(mongo_projection(fields), {'_id': 1, 'public.title': 1, 'public.category': 1})
+        doc = {'_id': 'x', 'title': 'T', 'category': 'Rings', 'description': 'unused'}
+        self.assertEqual(product_public(doc, fields), {'title': 'T', 'category': {'id': None, 'name': 'Rings'}})
+
+    def test_public_representation_is_materialized_on_write(self):
+        doc = product_doc_from_request({'title': 'T', 'category': 'Rings', 'image_url': '/media/uploads/a.png', 'price': '5'}, {}, 'a@b.com')
+        self.assertTrue(doc['public']['image_url'].endswith('/media/uploads/a.png'))
+        self.assertTrue(doc['public']['image_url'].startswith('http'))
+        doc['_id'] = 'abc'
+        self.assertEqual(product_public(doc, ('id', 'price')), {'id': 'abc', 'price': 5.0})
+
+class ResponseCacheTests(TestCase):
+    def test_lru_evicts_least_recently_used(self):
+        lru = LRUCache(max_entries=2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.evictions, 1)
+
+    def test_listing_served_from_cache_until_catalog_changes(self):
+        cat = Category.objects.create(name='Watches')
+        Product.objects.create(title='First', price=1, category=cat, sku='SKU-CACHE-1')
+        url = "/api/products/?category=Watches&page_size=7"
+        before = cache_stats()['endpoints'].get('products', {'hits': 0})['hits']
+        self.assertEqual(len(self.client.get(url).json()['results']), 1)
+        self.assertEqual(len(self.client.get(url).json()['results']), 1)
+        self.assertEqual(cache_stats()['endpoints']['products']['hits'], before + 1)
+        Product.objects.create(title='Second', price=1, category=cat, sku='SKU-CACHE-2')
+        self.assertEqual(len(self.client.get(url).json()['results']), 2)
+
+    def test_cache_stats_requires_authentication(self):
+        self.assertIn(self.client.get("/api/products/cache/stats").status_code, (401, 403))
+
+class ConditionalCatalogReadTests(TestCase):
+    def test_matching_etag_returns_304_without_querying_products(self):
+        cat = Category.objects.create(name='Shoes')
+        Product.objects.create(title='Loafer', price=1, category=cat, sku='SKU-ETAG-1')
+        first = self.client.get("/api/products/?category=Shoes")
+        etag = first.headers['ETag']
+        self.assertTrue(first.headers.get('Last-Modified'))
+        self.assertEqual(first.headers.get('Cache-Control'), 'public, no-cache')
+        # Only the catalog version row is read
+        with self.assertNumQueries(1):
+            second = self.client.get("/api/products/?category=Shoes", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 304)
+        Product.objects.create(title='Boot', price=1, category=cat, sku='SKU-ETAG-2')
+        third = self.client.get("/api/products/?category=Shoes", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third.headers['ETag'], etag)
+
+    def test_category_list_has_etag(self):
+        resp = self.client.get("/api/products/categories")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.client.get("/api/products/categories", HTTP_IF_NONE_MATCH=resp.headers['ETag']).status_code, 304)
+
+class CategoryCountTests(TestCase):
+    def test_category_list_counts_listed_products(self):
+        rings = Category.objects.create(name='Rings')
+        Category.objects.create(name='Shoes')
+        Product.objects.create(title='A', price=1, category=rings, sku='SKU-CC-1')
+        Product.objects.create(title='B', price=1, category=rings, sku='SKU-CC-2')
+        Product.objects.create(title='C', price=1, category=rings, sku='SKU-CC-3', in_stock=False)
+        counts = {c['name']: c['product_count'] for c in self.client.get("/api/products/categories").json()}
+        self.assertEqual((counts['Rings'], counts['Shoes']), (2, 0))
+        Product.objects.filter(sku='SKU-CC-3').update(in_stock=True)
+        # Counts follow catalog writes, which bump the version
+        Product.objects.create(title='D', price=1, category=rings, sku='SKU-CC-4')
+        counts = {c['name']: c['product_count'] for c in self.client.get("/api/products/categories").json()}
+        self.assertEqual(counts['Rings'], 4)
+
+    def test_counted_category_follows_listing_visibility(self):
+        self.assertEqual(counted_category({'category': 'Rings'}), 'Rings')
+        self.assertIsNone(counted_category({'category': 'Rings', 'in_stock': False}))
+        self.assertIsNone(counted_category({'category': 'Rings', 'is_public': False}))
+        self.assertIsNone(counted_category(None))
+
+class ProductDetailLookupTests(TestCase):
+    def test_orm_detail_accepts_int_and_rejects_unknown_string_ids(self):
+        cat = Category.objects.create(name='Rings')
+        p = Product.objects.create(title='Band', price=1, category=cat, sku='SKU-DET-1')
+        self.assertEqual(self.client.get(f"/api/products/{p.pk}").json()['sku'], 'SKU-DET-1')
+        self.assertEqual(self.client.get("/api/products/65a000000000000000000001").status_code, 404)
+
+    def test_invalidate_drops_every_key_for_a_sku(self):
+        product_doc_cache.set((1, '65a000000000000000000002'), {'sku': 'SKU-DET-2'})
+        product_doc_cache.set((1, 'SKU-DET-2'), {'sku': 'SKU-DET-2'})
+        product_doc_cache.set((1, 'SKU-OTHER'), {'sku': 'SKU-OTHER'})
+        invalidate_product_doc('SKU-DET-2')
+        self.assertIsNone(product_doc_cache.get((1, '65a000000000000000000002')))
+        self.assertIsNone(product_doc_cache.get((1, 'SKU-DET-2')))
+        self.assertEqual(product_doc_cache.get((1, 'SKU-OTHER')), {'sku': 'SKU-OTHER'})
+
+    def test_cached_doc_is_not_reused_for_a_newer_catalog_version(self):
+        from .cache import bump_catalog_version, cached_product_doc, catalog_version
+        product_doc_cache.clear()
+        bump_catalog_version()
+        product_doc_cache.set((catalog_version()[0], 'SKU-DET-3'), {'sku': 'SKU-DET-3', 'public': {'title': 'Old'}})
+        self.assertEqual(cached_product_doc(None, 'SKU-DET-3')['public']['title'], 'Old')
+        # Another process wrote the product and bumped the version; the stale document must be read again
+        bump_catalog_version()
+        products = type('Products', (), {'find_one': lambda self, query, projection=None: {'sku': 'SKU-DET-3', 'public': {'title': 'New'}}})()
+        self.assertEqual(cached_product_doc({'products': products}, 'SKU-DET-3')['public']['title'], 'New')
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.index = SearchIndex()
+        self.index.upsert('1', {'title': 'Gold ring', 'brand': 'Acme', 'description': 'A plain band', 'category': 'Rings', 'sku': 'S1'})
+        self.index.upsert('2', {'title': 'Leather watch', 'brand': 'Acme', 'description': 'Pairs well with a gold ring', 'category': 'Watches', 'sku': 'S2'})
+        self.index.upsert('3', {'title': 'Sunglasses', 'brand': 'Goldline', 'description': 'Polarized', 'category': 'Glasses', 'in_stock': False, 'sku': 'S3'})
+
+    def test_title_hits_outrank_description_hits(self):
+        self.assertEqual([d for d, _ in self.index.search('ring')], ['1', '2'])
+
+    def test_prefix_matches_partial_words(self):
+        self.assertEqual([d for d, _ in self.index.search('leath')], ['2'])
+        self.assertEqual({d for d, _ in self.index.search('gol')}, {'1', '2', '3'})
+
+    def test_filters_and_removal(self):
+        self.assertEqual([d for d, _ in self.index.search('gold', {'in_stock': True, 'category': 'rings'})], ['1'])
+        self.index.remove('1')
+        self.assertEqual([d for d, _ in self.index.search('ring')], ['2'])
+        self.assertNotIn('S1', self.index.sku_ids)
+
+    def test_snapshot_round_trip(self):
+        restored = SearchIndex.from_snapshot(self.index.to_snapshot())
+        self.assertEqual(restored.search('gold'), self.index.search('gold'))
+
+class ProductSearchListingTests(TestCase):
+    def setUp(self):
+        reset_search_index()
+        self.cat = Category.objects.create(name='Rings')
+
+    def tearDown(self):
+        reset_search_index()
+
+    def test_orm_listing_ranks_by_relevance(self):
+        b = Product.objects.create(title='Diamond ring', price=2, category=self.cat, sku='SKU-SR-2')
+        a = Product.objects.create(title='Silver band', description='Goes with any ring', price=1, category=self.cat, sku='SKU-SR-1')
+        resp = self.client.get('/api/products/', {'search': 'ring'})
+        self.assertEqual([p['sku'] for p in resp.json()['results']], [b.sku, a.sku])
+
+    def test_totals_cut_by_the_result_cap_are_estimated(self):
+        for i in range(3):
+            Product.objects.create(title=f'Opal ring {i}', price=1, category=self.cat, sku=f'SKU-SR-CAP-{i}')
+        with self.settings(SEARCH_MAX_RESULTS=2, CATALOG_CACHE_MAX_ENTRIES=0):
+            body = self.client.get('/api/products/', {'search': 'opal'}).json()
+            self.assertEqual((body['total'], body.get('total_estimated')), (2, True))
+        with self.settings(SEARCH_MAX_RESULTS=3, CATALOG_CACHE_MAX_ENTRIES=0):
+            self.assertNotIn('total_estimated', self.client.get('/api/products/', {'search': 'opal'}).json())
+
+    def test_index_follows_product_writes(self):
+        self.client.get('/api/products/', {'search': 'ring'})
+        Product.objects.create(title='Opal ring', price=3, category=self.cat, sku='SKU-SR-3')
+        from .views import product_changed
+        product_changed('SKU-SR-3')
+        self.assertEqual([p['sku'] for p in self.client.get('/api/products/', {'search': 'opal'}).json()['results']], ['SKU-SR-3'])
+        Product.objects.filter(sku='SKU-SR-3').delete()
+        product_changed('SKU-SR-3')
+        self.assertEqual(self.client.get('/api/products/', {'search': 'opal'}).json()['results'], [])
+
+    def test_large_catalogs_without_a_snapshot_search_the_database_meanwhile(self):
+        from .search import get_search_index
+        Product.objects.create(title='Opal ring', price=3, category=self.cat, sku='SKU-SR-6')
+        with self.settings(SEARCH_INDEX_INLINE_BUILD_LIMIT=0, SEARCH_INDEX_PATH=''):
+            from unittest import mock
+            with mock.patch('catalog.search.threading.Thread') as thread:
+                self.assertIsNone(get_search_index())
+                self.assertIsNone(get_search_index())
+            thread.assert_called_once()
+            self.assertEqual([p['sku'] for p in self.client.get('/api/products/', {'search': 'opal'}).json()['results']], ['SKU-SR-6'])
+
+@skipUnless(os.environ.get('MONGO_TEST_URI'), 'set MONGO_TEST_URI to search against a real MongoDB')
+class MongoSearchListingTests(TestCase):
+    def setUp(self):
+        import pymongo
+        from django.test import override_settings
+        reset_search_index()
+        self.client_db = pymongo.MongoClient(os.environ['MONGO_TEST_URI'])
+        self.mongo = self.client_db['stylesathi_search_' + secrets.token_hex(3)]
+        self.settings = override_settings(MONGO_DB=self.mongo, SEARCH_INDEX_PATH='')
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.client_db.drop_database(self.mongo.name)
+        reset_search_index()
+
+    def test_deletes_by_other_processes_drop_out_of_results(self):
+        from .mongo import save_product_doc
+        for sku, title in (('SKU-MS-1', 'Opal ring'), ('SKU-MS-2', 'Opal pendant')):
+            save_product_doc(self.mongo, product_doc_from_request({'title': title, 'price': 3, 'category': 'Rings', 'sku': sku, 'stock': 1}, None, None))
+        self.assertEqual(self.client.get('/api/products/', {'search': 'opal'}).json()['total'], 2)
+        # Deleted by a worker: this process's index is never told, only the catalog version moves
+        self.mongo['products'].delete_one({'sku': 'SKU-MS-1'})
+        from .cache import bump_catalog_version
+        bump_catalog_version()
+        body = self.client.get('/api/products/', {'search': 'opal'}).json()
+        self.assertEqual(([p['sku'] for p in body['results']], body['total']), (['SKU-MS-2'], 1))
+
+    def test_totals_cut_by_the_result_cap_are_estimated(self):
+        from django.test import override_settings
+        from .mongo import save_product_doc
+        for i in range(3):
+            save_product_doc(self.mongo, product_doc_from_request({'title': f'Opal ring {i}', 'price': 3, 'category': 'Rings', 'sku': f'SKU-MS-CAP-{i}', 'stock': 1}, None, None))
+        with override_settings(SEARCH_MAX_RESULTS=2, CATALOG_CACHE_MAX_ENTRIES=0):
+            body = self.client.get('/api/products/', {'search': 'opal'}).json()
+            self.assertEqual((body['total'], body.get('total_estimated')), (2, True))
+            self.assertIs(self.client.get('/api/products/', {'search': 'opal', 'sort': 'price'}).json().get('total_estimated'), True)
+
+class ProductFacetTests(TestCase):
+    def setUp(self):
+        facet_cache.clear()
+        rings = Category.objects.create(name='Rings')
+        watches = Category.objects.create(name='Watches')
+        Product.objects.create(title='Gold ring', brand='Acme', price=20, category=rings, sku='SKU-F-1')
+        Product.objects.create(title='Silver ring', brand='Acme', price=60, category=rings, sku='SKU-F-2')
+        Product.objects.create(title='Plain ring', brand='Orbit', price=75, category=rings, sku='SKU-F-3')
+        Product.objects.create(title='Steel watch', brand='Acme', price=1500, category=watches, sku='SKU-F-4', in_stock=False)
+
+    def test_orm_facets_exclude_their_own_filter(self):
+        body = self.client.get('/api/products/', {'facets': 'all', 'brand': 'Acme'}).json()
+        self.assertEqual(sorted(p['sku'] for p in body['results']), ['SKU-F-1', 'SKU-F-2'])
+        self.assertEqual(body['total'], 2)
+        self.assertEqual(body['facets']['brand'], [{'value': 'Acme', 'count': 2}, {'value': 'Orbit', 'count': 1}])
+        self.assertEqual(body['facets']['category'], [{'value': 'Rings', 'count': 2}])
+        self.assertEqual(body['facets']['in_stock'], [{'value': True, 'count': 2}, {'value': False, 'count': 1}])
+        self.assertEqual([(b['min'], b['count']) for b in body['facets']['price']], [(0, 1), (50, 1)])
+
+    def test_facet_counts_are_cached_by_filter_key(self):
+        self.client.get('/api/products/', {'facets': 'brand', 'view': 'card'})
+        hits = facet_cache.hits
+        body = self.client.get('/api/products/', {'facets': 'brand'}).json()
+        self.assertEqual(facet_cache.hits, hits + 1)
+        self.assertEqual(body['facets']['brand'][0], {'value': 'Acme', 'count': 2})
+
+    def test_mongo_stages_share_one_pipeline(self):
+        stages = mongo_facet_stages({'in_stock': {'in_stock': True}, 'brand': {'brand': 'Acme'}}, ('brand', 'price'))
+        self.assertEqual(set(stages), {'total', 'brand', 'price'})
+        self.assertEqual(stages['brand'][0], {'$match': {'in_stock': True}})
+        self.assertEqual(stages['total'][0], {'$match': {'in_stock': True, 'brand': 'Acme'}})
+
+@skipUnless(os.environ.get('MONGO_TEST_URI'), 'set MONGO_TEST_URI to facet against a real MongoDB')
+class MongoFacetListingTests(TestCase):
+    def setUp(self):
+        import pymongo
+        from django.test import override_settings
+        from .cache import response_cache
+        from .mongo import save_product_doc
+        facet_cache.clear()
+        response_cache.clear()
+        self.client_db = pymongo.MongoClient(os.environ['MONGO_TEST_URI'])
+        self.mongo = self.client_db['stylesathi_facets_' + secrets.token_hex(3)]
+        self.settings = override_settings(MONGO_DB=self.mongo)
+        self.settings.enable()
+        for sku, brand in (('SKU-MF-1', 'Acme'), ('SKU-MF-2', 'Acme'), ('SKU-MF-3', 'Orbit')):
+            save_product_doc(self.mongo, product_doc_from_request({'title': 'Ring', 'brand': brand, 'price': 3, 'category': 'Rings', 'sku': sku, 'stock': 1}, None, None))
+
+    def tearDown(self):
+        self.settings.disable()
+        self.client_db.drop_database(self.mongo.name)
+
+    def test_cached_counts_skip_the_aggregation(self):
+        from unittest import mock
+        first = self.client.get('/api/products/', {'facets': 'brand'}).json()
+        self.assertEqual(first['facets']['brand'][0], {'value': 'Acme', 'count': 2})
+        with mock.patch('catalog.views.mongo_facet_stages', side_effect=AssertionError('aggregated')):
+            body = self.client.get('/api/products/', {'facets': 'brand', 'page_size': 2}).json()
+        self.assertEqual((body['facets'], len(body['results']), body['total']), (first['facets'], 2, 3))
+        self.assertTrue(body['next_cursor'])
+
+    def test_failed_counts_are_flagged_and_logged(self):
+        from unittest import mock
+        with mock.patch('catalog.views.mongo_facet_stages', side_effect=RuntimeError('boom')), self.assertLogs('catalog.views', 'ERROR'):
+            body = self.client.get('/api/products/', {'facets': 'brand'}).json()
+        self.assertEqual(len(body['results']), 3)
+        self.assertIs(body['facets_unavailable'], True)
+        self.assertEqual(self.client.get('/api/products/', {'facets': 'brand'}).json()['facets']['brand'][0]['count'], 2)
+
+class SuggestIndexTests(TestCase):
+    def setUp(self):
+        self.index = SuggestIndex()
+        self.index.upsert('1', {'title': 'Gold ring', 'brand': 'Goldline', 'category': 'Rings', 'rating': 4.0, 'sku': 'S1'})
+        self.index.upsert('2', {'title': 'Golden hoop earrings', 'brand': 'Acme', 'category': 'Rings', 'rating': 4.8, 'sku': 'S2'})
+        self.index.upsert('3', {'title': 'Rose gold watch', 'brand': 'Acme', 'category': 'Watches', 'rating': 5.0, 'sku': 'S3'})
+
+    def test_leading_matches_rank_by_rating(self):
+        products = [r['sku'] for r in self.index.suggest('gol') if r['type'] == 'product']
+        self.assertEqual(products, ['S2', 'S1', 'S3'])
+        self.assertEqual([r['text'] for r in self.index.suggest('gol') if r['type'] == 'brand'], ['Goldline'])
+
+    def test_brand_and_category_counts_follow_removal(self):
+        self.assertEqual(self.index.suggest('ring')[0], {'type': 'category', 'text': 'Rings', 'count': 2})
+        self.index.remove_sku('S1')
+        self.index.remove('2')
+        self.assertEqual([r for r in self.index.suggest('ring') if r['type'] == 'category'], [])
+        self.assertEqual(self.index.suggest('acme')[0]['count'], 1)
+
+    def test_results_are_bounded(self):
+        for i in range(50):
+            self.index.upsert(f'x{i}', {'title': f'Gold chain {i}', 'sku': f'X{i}'})
+        self.assertEqual(len(self.index.suggest('g', limit=5)), 5)
+        self.assertEqual(self.index.suggest('   '), [])
+
+    def test_short_prefixes_rank_every_match(self):
+        # 300 low-rated titles sort ahead of the best one alphabetically; it still comes first
+        for i in range(300):
+            self.index.upsert(f'a{i}', {'title': f'Gadget {i:03d}', 'rating': 1.0, 'sku': f'A{i}'})
+        self.index.upsert('z', {'title': 'Gzhel vase', 'rating': 5.0, 'sku': 'Z'})
+        self.assertEqual([r['sku'] for r in self.index.suggest('g') if r['type'] == 'product'][0], 'Z')
+        self.index.upsert('y', {'title': 'Gzhel cup', 'rating': 4.9, 'sku': 'Y'})
+        self.assertEqual([r['sku'] for r in self.index.suggest('g') if r['type'] == 'product'][:2], ['Z', 'Y'])
+
+    def test_writes_forget_only_their_own_prefixes(self):
+        self.index.suggest('g')
+        self.index.suggest('ro')
+        self.index.upsert('4', {'title': 'Gold bangle', 'rating': 4.9, 'sku': 'S4'})
+        self.assertNotIn(('g', 8), self.index._memo)
+        self.assertIn(('ro', 8), self.index._memo)
+        self.assertEqual([r['sku'] for r in self.index.suggest('g') if r['type'] == 'product'][:2], ['S4', 'S2'])
+
+class ProductSuggestEndpointTests(TestCase):
+    def setUp(self):
+        reset_suggest_index()
+
+    def tearDown(self):
+        reset_suggest_index()
+
+    def test_suggest_endpoint(self):
+        cat = Category.objects.create(name='Rings')
+        Product.objects.create(title='Opal ring', price=1, category=cat, sku='SKU-SG-1', rating=4)
+        Product.objects.create(title='Opal pendant', price=1, category=cat, sku='SKU-SG-2', in_stock=False)
+        resp = self.client.get('/api/products/suggest', {'q': 'opa'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([r['sku'] for r in resp.json()['results']], ['SKU-SG-1'])
+        self.assertIn('max-age', resp['Cache-Control'])
+        # Deleted without this process hearing of it; the catch-up finds the tombstone
+        Product.objects.filter(sku='SKU-SG-1').delete()
+        with self.settings(SEARCH_INDEX_REFRESH=0):
+            self.assertEqual(self.client.get('/api/products/suggest', {'q': 'opa'}).json()['results'], [])
+
+    def test_large_catalogs_suggest_nothing_while_indexing(self):
+        cat = Category.objects.create(name='Rings')
+        Product.objects.create(title='Opal ring', price=1, category=cat, sku='SKU-SG-3')
+        from unittest import mock
+        with self.settings(SEARCH_INDEX_INLINE_BUILD_LIMIT=0), mock.patch('catalog.suggest.threading.Thread') as thread:
+            self.assertEqual(self.client.get('/api/products/suggest', {'q': 'opa'}).json()['results'], [])
+            self.assertEqual(self.client.get('/api/products/suggest', {'q': 'opa'}).json()['results'], [])
+        thread.assert_called_once()
+
+class SortedListingTests(TestCase):
+    def setUp(self):
+        self.cat = Category.objects.create(name='Rings')
+        for i, (price, rating) in enumerate([(30, 4.5), (10, 3.0), (20, 5.0), (20, 1.0)]):
+            Product.objects.create(title=f'Ring {i}', price=price, rating=rating, category=self.cat, sku=f'SKU-SORT-{i}')
+
+    def test_orm_sort_and_price_range(self):
+        skus = lambda params: [p['sku'] for p in self.client.get('/api/products/', params).json()['results']]
+        self.assertEqual(skus({'sort': 'price'}), ['SKU-SORT-1', 'SKU-SORT-2', 'SKU-SORT-3', 'SKU-SORT-0'])
+        self.assertEqual(skus({'sort': '-price'}), ['SKU-SORT-0', 'SKU-SORT-3', 'SKU-SORT-2', 'SKU-SORT-1'])
+        self.assertEqual(skus({'sort': '-rating', 'min_price': '15', 'max_price': '25'}), ['SKU-SORT-2', 'SKU-SORT-3'])
+        self.assertEqual(self.client.get('/api/products/', {'sort': 'name'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/products/', {'min_price': '9', 'max_price': '1'}).status_code, 400)
+
+    def test_orm_cursor_walks_ties_without_repeats(self):
+        for sort, expected in (('price', ['SKU-SORT-1', 'SKU-SORT-2', 'SKU-SORT-3', 'SKU-SORT-0']), (None, ['SKU-SORT-3', 'SKU-SORT-2', 'SKU-SORT-1', 'SKU-SORT-0'])):
+            params = {'page_size': 1, **({'sort': sort} if sort else {})}
+            seen = []
+            while True:
+                body = self.client.get('/api/products/', params).json()
+                self.assertEqual(body['total'], 4)
+                seen += [p['sku'] for p in body['results']]
+                if not body['next_cursor']:
+                    break
+                params['cursor'] = body['next_cursor']
+            self.assertEqual(seen, expected)
+        cursor = self.client.get('/api/products/', {'page_size': 1, 'sort': 'price'}).json()['next_cursor']
+        self.assertEqual(self.client.get('/api/products/', {'cursor': cursor, 'sort': '-rating'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/products/', {'cursor': 'bogus!'}).status_code, 400)
+
+    def test_count_modes(self):
+        with self.settings(CATALOG_COUNT_ESTIMATE_LIMIT=2):
+            body = self.client.get('/api/products/', {'page_size': 1, 'count': 'estimate'}).json()
+        self.assertEqual((body['total'], body['total_estimated']), (2, True))
+        self.assertIsNone(self.client.get('/api/products/', {'count': 'none'}).json()['total'])
+        self.assertEqual(self.client.get('/api/products/', {'count': 'all'}).status_code, 400)
+        body = self.client.get('/api/products/', {'page_size': 1, 'min_price': '15'}).json()
+        self.assertEqual(body['total'], 3)
+        self.assertNotIn('total_estimated', body)
+        # The next page reuses the cached exact total: catalog version, page, images
+        with self.assertNumQueries(3):
+            body = self.client.get('/api/products/', {'page_size': 1, 'min_price': '15', 'cursor': body['next_cursor']}).json()
+        self.assertEqual(body['total'], 3)
+        # A write by another process only bumps the shared version; the cached total must not outlive it
+        from django.db.models import F
+        from .cache import _version_local
+        from .models import CatalogVersion
+        Product.objects.filter(sku='SKU-SORT-0').update(price=1)
+        CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1)
+        _version_local.update(token=None, checked=0.0)
+        self.assertEqual(self.client.get('/api/products/', {'page_size': 1, 'min_price': '15'}).json()['total'], 2)
+
+    def test_sqlite_plans_need_no_temp_sort(self):
+        from .views import ProductListView
+        from rest_framework.request import Request
+        from rest_framework.test import APIRequestFactory
+        cases = [{'sort': s} for s in LISTING_SORTS] + [{'sort': 'price', 'min_price': '5', 'max_price': '50'}, {'sort': '-rating', 'category': 'Rings'}]
+        for params in cases:
+            view = ProductListView()
+            view.request = Request(APIRequestFactory().get('/api/products/', params))
+            view.format_kwarg = None
+            plan = view.filter_queryset(view.get_queryset()).explain()
+            self.assertNotIn('TEMP B-TREE FOR ORDER BY', plan, params)
+
+    def test_keyset_filter_continues_after_ties(self):
+        keyset = mongo_keyset_filter({'id': '65a000000000000000000001', 's': 'price', 'k': 20}, 'price')
+        self.assertEqual(keyset['price'], {'$gte': 20})
+        self.assertEqual(keyset['$or'][0], {'price': {'$gt': 20}})
+        self.assertIsNone(mongo_keyset_filter({'id': '65a000000000000000000001', 's': 'price', 'k': 20}, '-rating'))
+        self.assertIn('$and', _merge_query(product_list_query(min_price=5), keyset))
+
+    @skipUnless(os.environ.get('MONGO_TEST_URI'), 'set MONGO_TEST_URI to page through a real MongoDB')
+    def test_keyset_pages_reach_documents_without_the_sort_key(self):
+        import pymongo
+        from .pagination import mongo_cursor_for
+        client = pymongo.MongoClient(os.environ['MONGO_TEST_URI'])
+        db = client['stylesathi_keyset_' + secrets.token_hex(3)]
+        try:
+            # Legacy documents may lack price or rating, or hold null there
+            docs = [{'sku': f'K{i}', 'price': [None, 3.0, 1.0][i % 3], 'rating': 2.0} for i in range(7)]
+            docs += [{'sku': 'K-BARE'}]
+            db['products'].insert_many(docs)
+            for sort in ('price', '-price', 'rating', '-rating'):
+                everything = [d['sku'] for d in db['products'].find({}).sort(mongo_sort(sort))]
+                seen, keyset = [], {}
+                while True:
+                    page = list(db['products'].find(keyset).sort(mongo_sort(sort)).limit(2))
+                    seen += [d['sku'] for d in page]
+                    if len(page) < 2:
+                        break
+                    keyset = mongo_keyset_filter(decode_cursor(mongo_cursor_for(page[-1], sort)), sort)
+                    self.assertIsNotNone(keyset, sort)
+                self.assertEqual(seen, everything, sort)
+        finally:
+            client.drop_database(db.name)
+
+@skipUnless(os.environ.get('MONGO_TEST_URI'), 'set MONGO_TEST_URI to explain against a real MongoDB')
+class MongoSortedListingPlanTests(TestCase):
+    def test_sorted_listings_have_no_blocking_sort(self):
+        import pymongo
+        client = pymongo.MongoClient(os.environ['MONGO_TEST_URI'])
+        db = client['stylesathi_plan_' + secrets.token_hex(3)]
+        try:
+            for spec in INDEXES['products']:
+                db['products'].create_index(spec['keys'], **{k: v for k, v in spec.items() if k != 'keys'})
+            db['products'].insert_many([
+                {'title': f'P{i}', 'price': float(i % 40), 'rating': (i % 5) + 0.5, 'category': ['Rings', 'Watches'][i % 2], 'is_public': True, 'in_stock': True, 'sku': f'P{i}'}
+                for i in range(200)
+            ])
+            last = db['products'].find_one()
+            for sort in LISTING_SORTS:
+                field = LISTING_SORTS[sort][0]
+                keyset = mongo_keyset_filter({'id': str(last['_id']), 's': sort, 'k': last.get(field)} if field else {'id': str(last['_id'])}, sort)
+                for query in (product_list_query(), product_list_query('Rings'), _merge_query(product_list_query(), keyset)):
+                    plan = plan_summary(db['products'].find(query).sort(mongo_sort(sort)).limit(21).explain())
+                    self.assertNotIn('SORT', plan['stages'], (sort, query))
+            plan = plan_summary(db['products'].find(product_list_query(min_price=5, max_price=20)).sort(mongo_sort('-price')).limit(21).explain())
+            self.assertNotIn('SORT', plan['stages'])
+        finally:
+            client.drop_database(db.name)
+
+class SerializationQueryCountTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from .models import ProductImage
+        cat = Category.objects.create(name='Rings')
+        self.products = [Product.objects.create(title=f'Ring {i}', price=i, category=cat, sku=f'SKU-N1-{i}') for i in range(100)]
+        ProductImage.objects.bulk_create([ProductImage(product=p, image=f'uploads/n1-{p.pk}.png') for p in self.products for _ in range(2)])
+        self.user = get_user_model().objects.create_user(username='n1', email='n1@example.com', password='x', role='admin')
+
+    def _client(self):
+        from rest_framework.test import APIClient
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client
+
+    def test_listing_query_count_is_independent_of_page_size(self):
+        # Catalog version, count, products with their category, images
+        with self.assertNumQueries(4):
+            resp = self.client.get("/api/products/?page_size=100")
+        self.assertEqual(len(resp.json()['results']), 100)
+        self.assertEqual(len(resp.json()['results'][0]['images']), 2)
+        self.assertTrue(resp.json()['results'][0]['images'][0].startswith('http://testserver/media/uploads/'))
+
+    def test_cart_and_order_lists_prefetch_products(self):
+        from cart.models import Cart, CartItem
+        from orders.models import Order, OrderItem
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=p, quantity=1) for p in self.products])
+        order = Order.objects.create(user=self.user, total=0)
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=p, quantity=1, price=p.price) for p in self.products])
+        client = self._client()
+        with self.assertNumQueries(3):
+            resp = client.get("/api/cart/")
+        self.assertEqual(len(resp.json()['items']), 100)
+        self.assertEqual(resp.json()['items'][0]['product']['category']['name'], 'Rings')
+        with self.assertNumQueries(3):
+            resp = client.get("/api/orders/admin")
+        self.assertEqual(len(resp.json()[0]['items']), 100)
+        self.assertEqual(len(resp.json()[0]['items'][0]['product']['images']), 2)
+
+class SellerListingTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from rest_framework.test import APIClient
+        cat = Category.objects.create(name='Rings')
+        self.user = get_user_model().objects.create_user(username='seller', email='seller@example.com', password='x', role='seller')
+        self.skus = [Product.objects.create(title=f'Ring {i}', price=1, category=cat, owner=self.user, sku=f'SKU-MINE-{i}').sku for i in range(5)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_without_paging_params_returns_bare_list(self):
+        self.assertEqual(len(self.client.get('/api/products/mine').json()), 5)
+
+    def test_cursor_pages_cover_the_inventory(self):
+        params, seen = {'page_size': 2}, []
+        while True:
+            body = self.client.get('/api/products/mine', params).json()
+            self.assertEqual(body['total'], 5)
+            seen += [p['sku'] for p in body['results']]
+            if not body['next_cursor']:
+                break
+            params['cursor'] = body['next_cursor']
+        self.assertEqual(seen, self.skus[::-1])
+
+    def test_ndjson_stream(self):
+        import json
+        resp = self.client.get('/api/products/mine', {'stream': 'ndjson', 'fields': 'sku'})
+        self.assertEqual(resp['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(resp.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(l)['sku'] for l in lines], self.skus[::-1])
+
+    def test_accept_negotiated_formats_get_their_own_validators(self):
+        as_json = self.client.get('/api/products/mine')
+        self.assertIn('Accept', as_json['Vary'])
+        # A client that cached the JSON array must not be told its copy is the NDJSON stream
+        as_ndjson = self.client.get('/api/products/mine', HTTP_ACCEPT='application/x-ndjson', HTTP_IF_NONE_MATCH=as_json['ETag'])
+        self.assertEqual(as_ndjson.status_code, 200)
+        self.assertEqual(as_ndjson['Content-Type'], 'application/x-ndjson')
+        self.assertNotEqual(as_ndjson['ETag'], as_json['ETag'])
+        again = self.client.get('/api/products/mine', HTTP_ACCEPT='application/x-ndjson', HTTP_IF_NONE_MATCH=as_ndjson['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertIn('Accept', again['Vary'])
+
+class ProductImportTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from rest_framework.test import APIClient
+        User = get_user_model()
+        self.user = User.objects.create_user(username='importer', email='importer@example.com', password='x', role='seller')
+        other = User.objects.create_user(username='other', email='other@example.com', password='x', role='seller')
+        Product.objects.create(title='Theirs', price=1, category=Category.objects.create(name='Rings'), owner=other, sku='SKU-IMP-OTHER')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        reset_search_index()
+
+    def tearDown(self):
+        reset_search_index()
+
+    def test_csv_upload_creates_updates_and_reports_rows(self):
+        body = (
+            'sku,title,price,category,stock,in_stock\n'
+            'SKU-IMP-1,Band,10,Rings,3,true\n'
+            'SKU-IMP-2,Cap,5,cap,0,false\n'
+            'SKU-IMP-3,,5,Rings,1,true\n'
+            'SKU-IMP-OTHER,Mine now,5,Rings,1,true\n'
+            'SKU-IMP-4,Bad price,abc,Rings,1,true\n'
+        )
+        upload = SimpleUploadedFile('products.csv', body.encode(), content_type='text/csv')
+        stats = self.client.post('/api/products/import', {'file': upload}, format='multipart').json()
+        self.assertEqual((stats['rows'], stats['created'], stats['updated'], stats['failed']), (5, 2, 0, 3))
+        self.assertEqual({(e['row'], e['error']) for e in stats['errors']}, {(4, 'Missing title'), (5, 'SKU belongs to another seller'), (6, 'Invalid price')})
+        cap = Product.objects.get(sku='SKU-IMP-2')
+        self.assertEqual((cap.category.name, cap.in_stock, cap.owner, cap.is_public), ('Hat/Cap', False, self.user, True))
+        self.assertEqual(Product.objects.get(sku='SKU-IMP-OTHER').title, 'Theirs')
+
+    def test_ndjson_body_upserts_and_refreshes_listings(self):
+        self.assertEqual(self.client.get('/api/products/', {'search': 'opal'}).json()['results'], [])
+        rows = [{'sku': 'SKU-IMP-5', 'title': 'Opal band', 'price': 12, 'category': 'Rings', 'stock': 2}, 'not json']
+        body = '\n'.join(json.dumps(r) if isinstance(r, dict) else r for r in rows)
+        stats = self.client.generic('POST', '/api/products/import', body, content_type='application/x-ndjson').json()
+        self.assertEqual((stats['created'], stats['failed']), (1, 1))
+        body = json.dumps({'sku': 'SKU-IMP-5', 'title': 'Opal band', 'price': 15, 'category': 'Rings', 'stock': 2})
+        stats = self.client.generic('POST', '/api/products/import', body, content_type='application/x-ndjson').json()
+        self.assertEqual(stats['updated'], 1)
+        self.assertEqual(float(Product.objects.get(sku='SKU-IMP-5').price), 15.0)
+        self.assertEqual([p['sku'] for p in self.client.get('/api/products/', {'search': 'opal'}).json()['results']], ['SKU-IMP-5'])
+
+    @skipUnless(os.environ.get('MONGO_TEST_URI'), 'set MONGO_TEST_URI to import into a real MongoDB')
+    def test_rows_mongo_rejects_fail_alone(self):
+        import pymongo
+        from django.test import override_settings
+        from .importer import ProductImporter
+        client = pymongo.MongoClient(os.environ['MONGO_TEST_URI'])
+        db = client['stylesathi_import_' + secrets.token_hex(3)]
+        try:
+            # A unique index makes one document of the unordered bulk write fail
+            db['products'].create_index('title', unique=True)
+            db['products'].insert_one({'sku': 'SKU-IMP-TAKEN', 'title': 'Taken'})
+            rows = [(n, {'sku': f'SKU-IMP-B{n}', 'title': title, 'price': '5', 'category': 'Rings', 'stock': '1'}, None)
+                    for n, title in ((2, 'Band'), (3, 'Taken'), (4, 'Hoop'))]
+            with override_settings(MONGO_DB=db):
+                stats = ProductImporter(self.user).run(rows)
+            self.assertEqual((stats['created'], stats['failed']), (2, 1))
+            self.assertEqual([(e['row'], e['sku']) for e in stats['errors']], [(3, 'SKU-IMP-B3')])
+            self.assertEqual(sorted(Product.objects.filter(sku__startswith='SKU-IMP-B').values_list('sku', flat=True)), ['SKU-IMP-B2', 'SKU-IMP-B4'])
+            self.assertEqual(db['categories'].find_one({'name': 'Rings'})['product_count'], 2)
+        finally:
+            client.drop_database(db.name)
+
+    def test_customers_cannot_import(self):
+        self.user.role = 'customer'
+        self.user.save()
+        self.assertEqual(self.client.generic('POST', '/api/products/import', '', content_type='text/csv').status_code, 403)
+
+class BulkPriceStockTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from rest_framework.test import APIClient
+        User = get_user_model()
+        self.user = User.objects.create_user(username='bulk', email='bulk@example.com', password='x', role='seller')
+        other = User.objects.create_user(username='bulk2', email='bulk2@example.com', password='x', role='seller')
+        cat = Category.objects.create(name='Rings')
+        for i in range(3):
+            Product.objects.create(title=f'Ring {i}', price=10, stock=5, category=cat, owner=self.user, sku=f'SKU-BULK-{i}')
+        Product.objects.create(title='Theirs', price=10, category=cat, owner=other, sku='SKU-BULK-OTHER')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_applies_owned_changes_in_one_batch(self):
+        items = [
+            {'sku': 'SKU-BULK-0', 'price': 12.5},
+            {'sku': 'SKU-BULK-1', 'stock': 0},
+            {'sku': 'SKU-BULK-2', 'price': -1},
+            {'sku': 'SKU-BULK-OTHER', 'price': 1},
+            {'sku': 'SKU-BULK-MISSING', 'stock': 3},
+        ]
+        body = self.client.patch('/api/products/bulk', items, format='json').json()
+        self.assertEqual((body['updated'], body['failed']), (2, 3))
+        self.assertEqual([(e['index'], e['error']) for e in body['errors']], [(2, 'Invalid price'), (3, 'Forbidden'), (4, 'Product not found')])
+        ring0, ring1 = Product.objects.get(sku='SKU-BULK-0'), Product.objects.get(sku='SKU-BULK-1')
+        self.assertEqual((float(ring0.price), ring0.stock, ring0.in_stock), (12.5, 5, True))
+        self.assertEqual((ring1.stock, ring1.in_stock), (0, False))
+        self.assertEqual(float(Product.objects.get(sku='SKU-BULK-OTHER').price), 10.0)
+        skus = [p['sku'] for p in self.client.get('/api/products/').json()['results']]
+        self.assertNotIn('SKU-BULK-1', skus)
+
+    def test_rejects_non_list_body(self):
+        self.assertEqual(self.client.patch('/api/products/bulk', {'sku': 'SKU-BULK-0'}, format='json').status_code, 400)
+
+    @skipUnless(os.environ.get('MONGO_TEST_URI'), 'set MONGO_TEST_URI to bulk update a real MongoDB')
+    def test_mongo_writes_only_the_primary_and_reports_failures_per_item(self):
+        import pymongo
+        from unittest import mock
+        from django.test import override_settings
+        from pymongo.errors import AutoReconnect
+        from .mongo import save_product_doc
+        client = pymongo.MongoClient(os.environ['MONGO_TEST_URI'])
+        db = client['stylesathi_bulk_' + secrets.token_hex(3)]
+        try:
+            for i, price in enumerate((10, 20, 30)):
+                save_product_doc(db, product_doc_from_request({'title': f'Ring {i}', 'price': price, 'category': 'Rings', 'sku': f'SKU-BULK-{i}', 'stock': 5}, None, self.user.email))
+            # A unique index makes one update of the unordered bulk write fail
+            db['products'].create_index('price', unique=True)
+            items = [{'sku': 'SKU-BULK-0', 'price': 30}, {'sku': 'SKU-BULK-1', 'price': 25}, {'sku': 'SKU-BULK-2', 'stock': 0}]
+            with override_settings(MONGO_DB=db):
+                body = self.client.patch('/api/products/bulk', items, format='json').json()
+                self.assertEqual((body['updated'], [(e['index'], e['sku']) for e in body['errors']]), (2, [(0, 'SKU-BULK-0')]))
+                self.assertEqual(db['products'].find_one({'sku': 'SKU-BULK-1'})['price'], 25)
+                self.assertEqual(db['categories'].find_one({'name': 'Rings'})['product_count'], 2)
+                # The ORM copies are left to the outbox
+                self.assertEqual(float(Product.objects.get(sku='SKU-BULK-1').price), 10.0)
+                self.assertEqual(sorted(d['key'] for d in db['outbox'].find()), ['SKU-BULK-0', 'SKU-BULK-1', 'SKU-BULK-2'])
+                with mock.patch('catalog.bulk.write_mongo_changes', side_effect=AutoReconnect('down')):
+                    resp = self.client.patch('/api/products/bulk', [{'sku': 'SKU-BULK-1', 'price': 26}], format='json')
+                self.assertEqual((resp.status_code, resp.json()['failed']), (200, 1))
+        finally:
+            client.drop_database(db.name)
+
+class CatalogChecksumTests(TestCase):
+    def test_mirrored_copies_share_a_checksum(self):
+        from .mirror import doc_checksum, row_checksum, orm_product_doc
+        product = Product.objects.create(title='Ring', price='12.50', category=Category.objects.create(name='Rings'), sku='SKU-SUM', stock=3, features=['gold'])
+        product = Product.objects.select_related('category', 'owner').get(pk=product.pk)
+        doc = orm_product_doc(product)
+        self.assertEqual(doc_checksum(doc), row_checksum(product))
+        self.assertNotEqual(doc_checksum({**doc, 'stock': 4}), row_checksum(product))
+        self.assertNotEqual(doc_checksum({**doc, 'price': 12.49}), row_checksum(product))
+
+@skipUnless(os.environ.get('MONGO_TEST_URI'), 'set MONGO_TEST_URI to reconcile against a real MongoDB')
+class ReconcileCatalogTests(TestCase):
+    def test_repairs_drift_and_duplicate_skus_in_small_chunks(self):
+        import pymongo
+        from io import StringIO
+        from django.core.management import call_command
+        from django.test import override_settings
+        client = pymongo.MongoClient(os.environ['MONGO_TEST_URI'])
+        db = client['stylesathi_reconcile_' + secrets.token_hex(3)]
+        try:
+            docs = [product_doc_from_request({'title': f'P{i}', 'price': 10 + i, 'category': 'Rings', 'sku': f'SKU-R{i:02d}', 'stock': 1}, None, None) for i in range(7)]
+            docs.append({**docs[3], 'title': 'Copy'})
+            db['products'].insert_many([dict(d) for d in docs])
+            cat = Category.objects.create(name='Rings')
+            Product.objects.create(title='Stale', price=1, category=cat, sku='SKU-R01')
+            Product.objects.create(title='Orphan', price=1, category=cat, sku='SKU-ZZ')
+            with override_settings(MONGO_DB=db):
+                call_command('reconcile_catalog', '--chunk-size', '3', '--dry-run', stdout=StringIO())
+                self.assertEqual(Product.objects.count(), 2)
+                call_command('reconcile_catalog', '--chunk-size', '3', '--prune', stdout=StringIO())
+            skus = sorted(d['sku'] for d in db['products'].find())
+            self.assertEqual(len(set(skus)), 8)
+            self.assertEqual(sorted(Product.objects.values_list('sku', flat=True)), skus)
+            self.assertEqual(Product.objects.get(sku='SKU-R01').title, 'P1')
+        finally:
+            client.drop_database(db.name)
+
+    def test_leaves_queued_writes_and_ordered_products_alone(self):
+        import pymongo
+        from io import StringIO
+        from django.contrib.auth import get_user_model
+        from django.core.management import call_command
+        from django.test import override_settings
+        from orders.models import Order, OrderItem
+        from outbox.models import OutboxEvent
+        client = pymongo.MongoClient(os.environ['MONGO_TEST_URI'])
+        db = client['stylesathi_reconcile_' + secrets.token_hex(3)]
+        try:
+            db['products'].insert_one(product_doc_from_request({'title': 'Old title', 'price': 10, 'category': 'Rings', 'sku': 'SKU-RQ', 'stock': 1}, None, None))
+            cat = Category.objects.create(name='Rings')
+            Product.objects.create(title='Edited title', price=10, category=cat, sku='SKU-RQ')
+            OutboxEvent.objects.create(kind='product', key='SKU-RQ')
+            ordered = Product.objects.create(title='Sold', price=5, category=cat, sku='SKU-RO')
+            buyer = get_user_model().objects.create_user(username='rb', email='rb@example.com', password='x')
+            OrderItem.objects.create(order=Order.objects.create(user=buyer), product=ordered, price=5)
+            with override_settings(MONGO_DB=db):
+                call_command('reconcile_catalog', '--prune', stdout=StringIO(), stderr=StringIO())
+            self.assertEqual(Product.objects.get(sku='SKU-RQ').title, 'Edited title')
+            self.assertTrue(Product.objects.filter(sku='SKU-RO').exists())
+        finally:
+            client.drop_database(db.name)
+
+class MediaUploadPipelineTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        self.root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.root, MEDIA_UPLOADER='catalog.media.local_upload')
+        self.settings.enable()
+
+    def tearDown(self):
+        import shutil
+        self.settings.disable()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_files_are_staged_when_uploads_are_async(self):
+        from .media import staged_path
+        from .mongo import _save_file
+        url = _save_file(SimpleUploadedFile('ring.png', b'\x89PNG\r\n\x1a\n'))
+        self.assertIn('/media/blobs/', url)
+        self.assertTrue(os.path.isfile(staged_path(url)))
+
+    def test_files_upload_in_the_request_when_async_is_off(self):
+        from django.test import override_settings
+        from .mongo import _save_file
+        with override_settings(MEDIA_UPLOAD_ASYNC=False):
+            url = _save_file(SimpleUploadedFile('ring.png', b'\x89PNG\r\n\x1a\n'))
+        self.assertIn('/media/remote/', url)
+        self.assertTrue(url.endswith(hashlib.sha256(b'\x89PNG\r\n\x1a\n').hexdigest() + '.png'))
+
+    @skipUnless(os.environ.get('MONGO_TEST_URI'), 'set MONGO_TEST_URI to run the media worker against a real MongoDB')
+    def test_worker_swaps_in_uploaded_urls(self):
+        import pymongo
+        from django.test import override_settings
+        from .media import claim_media_job, run_media_job, queue_media_upload
+        from .mongo import save_product_doc
+        client = pymongo.MongoClient(os.environ['MONGO_TEST_URI'])
+        db = client['stylesathi_media_' + secrets.token_hex(3)]
+        try:
+            with override_settings(MONGO_DB=db):
+                files = {'image': SimpleUploadedFile('a.png', b'a'), 'model_glb': SimpleUploadedFile('m.glb', b'glb')}
+                doc = product_doc_from_request({'title': 'Ring', 'price': 5, 'category': 'Rings', 'sku': 'SKU-MEDIA', 'images': ['https://cdn.example.com/x.jpg']}, files, None)
+                save_product_doc(db, doc)
+                self.assertTrue(queue_media_upload(db, doc))
+                self.assertEqual(run_media_job(db, claim_media_job(db)), 2)
+                self.assertIsNone(claim_media_job(db))
+            stored = db['products'].find_one({'sku': 'SKU-MEDIA'})
+            self.assertIn('/media/remote/', stored['image_url'])
+            self.assertEqual(stored['public']['model_glb_url'], stored['model_glb_url'])
+            self.assertEqual(stored['images'], ['https://cdn.example.com/x.jpg'])
+            # The local blobs are no longer referenced and go once their grace period is over
+            self.assertFalse(MediaReference.objects.filter(sku='SKU-MEDIA').exists())
+            self.assertEqual(collect_blobs(grace=0), 2)
+            self.assertTrue(MediaBlob.objects.get(key=blob_key(hashlib.sha256(b'a').hexdigest(), '.png')).remote_url)
+        finally:
+            client.drop_database(db.name)
+
+    def test_request_files_upload_concurrently_in_order(self):
+        import time
+        from django.test import override_settings
+        from django.utils.datastructures import MultiValueDict
+        class Broken(SimpleUploadedFile):
+            def chunks(self, chunk_size=None):
+                raise OSError('disk full')
+        files = MultiValueDict({'image': [SimpleUploadedFile('main.png', b'm')],
+                                'images': [SimpleUploadedFile(f'g{i}.png', b'g%d' % i) for i in range(3)] + [Broken('bad.png', b'x')]})
+        errors = []
+        with override_settings(MEDIA_UPLOAD_ASYNC=False, MEDIA_LOCAL_UPLOAD_DELAY=0.2, MEDIA_UPLOAD_CONCURRENCY=5):
+            started = time.monotonic()
+            doc = product_doc_from_request({'title': 'Ring', 'price': 5, 'category': 'Rings'}, files, None, errors)
+            elapsed = time.monotonic() - started
+        self.assertLess(elapsed, 0.6)
+        self.assertTrue(doc['image_url'].endswith(hashlib.sha256(b'm').hexdigest() + '.png'))
+        self.assertEqual([u.rsplit('/', 1)[-1] for u in doc['images']], [hashlib.sha256(b'g%d' % i).hexdigest() + '.png' for i in range(3)])
+        self.assertEqual(errors, [{'field': 'images', 'file': 'bad.png', 'error': 'disk full'}])
+
+    def test_slow_uploads_are_reported_as_timed_out(self):
+        import time
+        from .media import run_bounded
+        results = run_bounded(lambda d: time.sleep(d) or d, [(0,), (1,)], limit=2, timeout=0.2)
+        self.assertEqual(results[0], (0, None))
+        self.assertIn('Timed out', results[1][1])
+
+    def test_single_slow_upload_is_cut_off_and_reported_when_it_lands(self):
+        import threading
+        import time
+        from .media import run_bounded
+        landed, late = threading.Event(), []
+        def record(a, result):
+            late.append((a, result))
+            landed.set()
+        started = time.monotonic()
+        results = run_bounded(lambda d: time.sleep(d) or 'url', [(0.5,)], limit=1, timeout=0.1, on_late=record)
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertIn('Timed out', results[0][1])
+        self.assertTrue(landed.wait(2))
+        self.assertEqual(late, [((0.5,), 'url')])
+
+
+def png_bytes(width, height, mode='RGBA'):
+    import io
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new(mode, (width, height), (200, 30, 30, 128) if mode == 'RGBA' else (200, 30, 30)).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        self.root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.root, IMAGE_VARIANT_WIDTHS=[200, 400, 800, 1600])
+        self.settings.enable()
+
+    def tearDown(self):
+        import shutil
+        self.settings.disable()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_derivatives_keep_aspect_ratio_and_never_upscale(self):
+        import io
+        from PIL import Image
+        from .variants import render_variants
+        out = render_variants(png_bytes(1000, 500), (200, 400, 800, 1600), 80)
+        self.assertEqual([(w, fmt) for w, fmt, _, _ in out],
+                         [(200, 'jpeg'), (200, 'webp'), (400, 'jpeg'), (400, 'webp'), (800, 'jpeg'), (800, 'webp')])
+        with Image.open(io.BytesIO(out[0][3])) as img:
+            self.assertEqual((img.format, img.size, img.mode), ('JPEG', (200, 100), 'RGB'))
+
+    def test_mongo_document_carries_variants_and_srcset(self):
+        doc = product_doc_from_request({'title': 'Ring', 'price': 5, 'category': 'Rings'},
+                                       {'image': SimpleUploadedFile('ring.png', png_bytes(900, 900))}, None)
+        self.assertEqual([v['width'] for v in doc['image_variants']], [200, 400, 800])
+        self.assertTrue(doc['image_variants'][0]['webp'].endswith('.webp'))
+        srcset = product_public(doc)['srcset']
+        self.assertIn(' 800w', srcset['jpeg'])
+        self.assertTrue(os.path.isfile(local_blob_path(blob_key_of(doc['image_variants'][1]['jpeg']))))
+
+    def test_orm_create_stores_variants(self):
+        from django.contrib.auth import get_user_model
+        from rest_framework.test import APIClient
+        user = get_user_model().objects.create_user(username='iv', email='iv@example.com', password='x', role='seller')
+        client = APIClient()
+        client.force_authenticate(user)
+        res = client.post('/api/products/create', {'title': 'Ring', 'price': '5', 'category_name': 'Rings', 'sku': 'SKU-IV',
+                                                   'image': SimpleUploadedFile('ring.png', png_bytes(500, 250), content_type='image/png')})
+        self.assertEqual(res.status_code, 201, res.data)
+        self.assertEqual([v['width'] for v in res.data['image_variants']], [200, 400])
+        self.assertTrue(res.data['srcset']['webp'].startswith('http://testserver/media/blobs/'))
+        self.assertEqual(len(Product.objects.get(sku='SKU-IV').image_variants), 2)
+
+    def test_backfill_fills_products_without_variants(self):
+        from io import StringIO
+        from django.core.files.base import ContentFile
+        from django.core.management import call_command
+        product = Product(title='Ring', price=5, category=Category.objects.create(name='Rings'), sku='SKU-OLD')
+        product.image.save('old.png', ContentFile(png_bytes(600, 600, 'RGB')), save=True)
+        Product.objects.create(title='Hat', price=5, category=product.category, sku='SKU-URL', image_url='https://cdn.example.com/h.jpg')
+        out = StringIO()
+        call_command('build_image_variants', '--workers', '2', stdout=out)
+        self.assertIn('products=1 files=4', out.getvalue())
+        product.refresh_from_db()
+        self.assertEqual([v['width'] for v in product.image_variants], [200, 400])
+        self.assertTrue(os.path.isfile(local_blob_path(blob_key_of(product.image_variants[1]['webp']))))
+
+    @skipUnless(os.environ.get('MONGO_TEST_URI'), 'set MONGO_TEST_URI to backfill against a real MongoDB')
+    def test_mongo_backfill_fetches_remote_originals_and_survives_missing_files(self):
+        import pymongo
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import call_command
+        from django.test import override_settings
+        client = pymongo.MongoClient(os.environ['MONGO_TEST_URI'])
+        db = client['stylesathi_variants_' + secrets.token_hex(3)]
+        db['products'].insert_many([
+            {'sku': 'SKU-IV-GONE', 'image_url': 'http://testserver/media/uploads/gone.png'},
+            {'sku': 'SKU-IV-CDN', 'image_url': 'https://cdn.example.com/ring.jpg'},
+        ])
+        fetch = 'catalog.management.commands.build_image_variants.fetch_original'
+        try:
+            with override_settings(MONGO_DB=db), mock.patch(fetch, return_value=png_bytes(600, 600, 'RGB')) as fetched:
+                out, err = StringIO(), StringIO()
+                call_command('build_image_variants', '--workers', '1', stdout=out, stderr=err)
+                self.assertIn('products=0 files=0 skipped=0 remote=1 failed=1', out.getvalue())
+                self.assertIn('SKU-IV-GONE', err.getvalue())
+                self.assertIn('--fetch-remote', err.getvalue())
+                fetched.assert_not_called()
+                call_command('build_image_variants', '--workers', '1', '--fetch-remote', stdout=StringIO(), stderr=StringIO())
+            fetched.assert_called_once_with('https://cdn.example.com/ring.jpg', 30)
+            doc = db['products'].find_one({'sku': 'SKU-IV-CDN'})
+            self.assertEqual([v['width'] for v in doc['image_variants']], [200, 400])
+            self.assertEqual(doc['image_url'], 'https://cdn.example.com/ring.jpg')
+        finally:
+            client.drop_database(db.name)
+
+
+class MediaBlobTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        from django.contrib.auth import get_user_model
+        from rest_framework.test import APIClient
+        self.root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.root, MEDIA_BLOB_GRACE_SECONDS=0, IMAGE_VARIANT_WIDTHS=[])
+        self.settings.enable()
+        self.user = get_user_model().objects.create_user(username='mb', email='mb@example.com', password='x', role='seller')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        import shutil
+        self.settings.disable()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def create(self, sku, data):
+        res = self.client.post('/api/products/create', {'title': 'Ring', 'price': '5', 'category_name': 'Rings', 'sku': sku,
+                                                         'image': SimpleUploadedFile('ring.png', data, content_type='image/png')})
+        self.assertEqual(res.status_code, 201, res.data)
+        return Product.objects.get(sku=sku)
+
+    def test_identical_uploads_share_one_blob_until_the_last_product_goes(self):
+        data = png_bytes(50, 50)
+        first, second = self.create('SKU-B1', data), self.create('SKU-B2', data)
+        self.assertEqual(first.image.name, blob_key(hashlib.sha256(data).hexdigest(), '.png'))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(MediaReference.objects.filter(blob__key=first.image.name).count(), 2)
+        path = local_blob_path(first.image.name)
+        self.client.delete(f'/api/products/{first.pk}/manage', {'reason': 'dup'}, format='json')
+        self.assertTrue(os.path.isfile(path))
+        self.client.delete(f'/api/products/{second.pk}/manage', {'reason': 'dup'}, format='json')
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_blobs_are_served_as_immutable(self):
+        product = self.create('SKU-B3', png_bytes(20, 20))
+        res = self.client.get('/media/' + product.image.name)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('immutable', res['Cache-Control'])
+
+    def test_gc_rebuilds_the_index_and_removes_unused_files(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .blobs import save_local_blob
+        kept = self.create('SKU-B4', png_bytes(30, 30))
+        stray = save_local_blob(b'never saved', 'x.png')
+        MediaReference.objects.all().delete()
+        call_command('gc_media_blobs', '--grace', '0', stdout=StringIO())
+        self.assertEqual(list(MediaReference.objects.values_list('sku', flat=True)), ['SKU-B4'])
+        self.assertTrue(os.path.isfile(local_blob_path(kept.image.name)))
+        self.assertFalse(os.path.exists(local_blob_path(stray)))
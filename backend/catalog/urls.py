@@ -1,11 +1,16 @@
 from django.urls import path
-from .views import ProductListView, ProductDetailView, CategoryListView, MyProductListView, ProductCreateView, ProductUpdateDeleteView
+from .views import ProductListView, ProductDetailView, CategoryListView, MyProductListView, ProductCreateView, ProductUpdateDeleteView, CatalogCacheStatsView, ProductSuggestView, ProductImportView, ProductBulkUpdateView
 
 urlpatterns = [
     path('', ProductListView.as_view()),
     path('<int:pk>', ProductDetailView.as_view()),
     path('categories', CategoryListView.as_view()),
+    path('suggest', ProductSuggestView.as_view()),
     path('mine', MyProductListView.as_view()),
     path('create', ProductCreateView.as_view()),
+    path('import', ProductImportView.as_view()),
+    path('bulk', ProductBulkUpdateView.as_view()),
     path('<int:pk>/manage', ProductUpdateDeleteView.as_view()),
+    path('cache/stats', CatalogCacheStatsView.as_view()),
+    path('<str:pk>', ProductDetailView.as_view()),
 ]
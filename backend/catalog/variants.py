@@ -0,0 +1,80 @@
+import io
+import os
+from django.conf import settings
+
+# Fixed-width derivatives of product images: JPEG for every browser plus WebP where Pillow can write it
+VARIANT_FORMATS = (('jpeg', 'jpg'), ('webp', 'webp'))
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp')
+
+def variant_widths():
+    return tuple(sorted({int(w) for w in getattr(settings, 'IMAGE_VARIANT_WIDTHS', (200, 400, 800)) if int(w) > 0}))
+
+def variant_quality():
+    return int(getattr(settings, 'IMAGE_VARIANT_QUALITY', 80))
+
+def is_image_name(name):
+    return os.path.splitext(name or '')[1].lower() in IMAGE_EXTENSIONS
+
+def render_variants(data, widths, quality):
+    # Bytes in, [(width, format, extension, bytes)] out, with no Django state so it can run in a process pool.
+    # Widths at or above the source width are skipped; images are never upscaled.
+    from PIL import Image, ImageOps, features
+    formats = [(fmt, ext) for fmt, ext in VARIANT_FORMATS if fmt != 'webp' or features.check('webp')]
+    with Image.open(io.BytesIO(data)) as src:
+        img = ImageOps.exif_transpose(src)
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if img.mode in ('LA', 'PA') or 'transparency' in img.info else 'RGB')
+    out = []
+    for width in widths:
+        if width >= img.width:
+            continue
+        resized = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+        for fmt, ext in formats:
+            frame = resized
+            options = {'quality': quality}
+            if fmt == 'jpeg':
+                options.update(optimize=True, progressive=True)
+                if frame.mode == 'RGBA':
+                    # JPEG has no alpha channel; flatten onto white
+                    frame = Image.new('RGB', resized.size, (255, 255, 255))
+                    frame.paste(resized, mask=resized.getchannel('A'))
+            buf = io.BytesIO()
+            frame.save(buf, fmt.upper(), **options)
+            out.append((width, fmt, ext, buf.getvalue()))
+    return out
+
+def local_variants(key):
+    # Derivatives of a local blob, stored as blobs themselves; returns [(width, format, key)]
+    from .blobs import local_blob_path, save_local_blob
+    with open(local_blob_path(key), 'rb') as f:
+        data = f.read()
+    return [(width, fmt, save_local_blob(body, f'w{width}.{ext}'))
+            for width, fmt, ext, body in render_variants(data, variant_widths(), variant_quality())]
+
+def storage_variants(name, storage=None):
+    # Same for a file in Django storage (local media or Cloudinary); returns [(width, format, stored name)]
+    from django.core.files.storage import default_storage
+    from .blobs import save_storage_blob
+    storage = storage or default_storage
+    with storage.open(name, 'rb') as f:
+        data = f.read()
+    return [(width, fmt, save_storage_blob(body, f'w{width}.{ext}', storage))
+            for width, fmt, ext, body in render_variants(data, variant_widths(), variant_quality())]
+
+def group_variants(items):
+    # [(width, format, url)] -> [{'width': w, 'jpeg': url, 'webp': url}], narrowest first
+    by_width = {}
+    for width, fmt, url in items:
+        by_width.setdefault(width, {'width': width})[fmt] = url
+    return [by_width[w] for w in sorted(by_width)]
+
+def variant_srcset(variants):
+    # {'jpeg': 'url 200w, url 400w', 'webp': ...} for <picture>/<img srcset>
+    parts = {}
+    for v in variants or []:
+        if not isinstance(v, dict):
+            continue
+        for fmt, _ in VARIANT_FORMATS:
+            if v.get(fmt):
+                parts.setdefault(fmt, []).append(f"{v[fmt]} {v['width']}w")
+    return {fmt: ', '.join(p) for fmt, p in parts.items()}
@@ -1,119 +1,576 @@
+import itertools
+import logging
 from rest_framework import generics, filters, permissions
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
+from rest_framework.renderers import BaseRenderer
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.exceptions import PermissionDenied
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
 from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.db import transaction
+from django.db.models import Case, Count, When, IntegerField, Q
 from .models import Product, Category
-SEED_SKUS = {
-    'RING-PREM-001',
-    'WATCH-LUX-001',
-    'GLASS-DES-001',
-    'GLASS-AR-TEST-001',
-    'GLB-SAMPLE-001',
-    'SHOE-CLASS-001',
-}
-SEED_BRAND = 'Sample'
-SEED_OWNER_EMAIL = 'seller@stylesathi.com'
-from .mongo import product_doc_from_request, product_public
+from .mongo import product_doc_from_request, product_public, products_public, derive_product_fields, requested_fields, mongo_projection, save_product_doc, delete_product_doc
+from .pagination import encode_cursor, mongo_cursor_for, mongo_keyset_filter, mongo_sort, orm_ordering, LISTING_SORTS, ProductPagination, page_params
 from cart.models import CartItem
-from .serializers import ProductSerializer, CategorySerializer
+from .serializers import ProductSerializer, CategorySerializer, shape_product_queryset
+from .cache import cached_response, bump_catalog_version, cache_stats, cached_product_doc, invalidate_product_doc, catalog_version, category_cache
+from .search import drop_deleted, get_search_index, reindex_products, index_source
+from .suggest import get_suggest_index, reindex_suggestions
+from .counts import count_mode, mongo_total
+from .importer import ProductImporter, import_format, iter_rows
+from .bulk import apply_price_stock_changes
+from outbox.events import enqueue, mirrored_write
+from .media import queue_media_upload
+from .blobs import doc_blob_keys, product_blob_keys, release_media, track_media
+from .facets import requested_facets, facet_cache_key, facet_cache, mongo_facet_stages, mongo_facets_from, orm_facets
 
-class ProductListView(generics.ListAPIView):
-    queryset = Product.objects.select_related('category', 'owner').all().order_by('-id')
+logger = logging.getLogger(__name__)
+
+def product_list_query(category=None, search=None, brand=None, min_price=None, max_price=None):
+    query = {'is_public': True, 'in_stock': True}
+    if category:
+        query['category'] = category
+    if brand:
+        query['brand'] = brand
+    price = price_condition(min_price, max_price)
+    if price:
+        query['price'] = price
+    if search:
+        query['$text'] = {'$search': search}
+    return query
+
+def price_condition(min_price=None, max_price=None):
+    cond = {}
+    if min_price is not None:
+        cond['$gte'] = min_price
+    if max_price is not None:
+        cond['$lte'] = max_price
+    return cond
+
+def listing_options(params):
+    # (sort, min_price, max_price, error); sort is None when the request did not ask for one
+    sort = params.get('sort') or None
+    if sort is not None and sort not in LISTING_SORTS:
+        return None, None, None, 'Invalid sort'
+    prices = []
+    for key in ('min_price', 'max_price'):
+        raw = params.get(key)
+        if raw in (None, ''):
+            prices.append(None)
+            continue
+        try:
+            value = float(raw)
+        except Exception:
+            return None, None, None, 'Invalid price range'
+        if value != value or value < 0:
+            return None, None, None, 'Invalid price range'
+        prices.append(value)
+    if None not in prices and prices[0] > prices[1]:
+        return None, None, None, 'Invalid price range'
+    return sort, prices[0], prices[1], None
+
+def _merge_query(query, extra):
+    if any(k in query for k in extra):
+        return {'$and': [query, extra]}
+    return {**query, **extra}
+
+def _listing_projection(fields, sort):
+    projection = mongo_projection(fields)
+    field = LISTING_SORTS[sort][0]
+    if field:
+        projection[field] = 1
+    return projection
+
+class RankedIds(list):
+    # capped is set when SEARCH_MAX_RESULTS cut the ranking short, so a total counted from it is a lower bound
+    capped = False
+
+def search_ranked(search, category=None, brand=None, in_stock=True):
+    # Ranked ids from the in-process index, or None so callers keep their existing search path
+    try:
+        index = get_search_index()
+        if index is None:
+            return None
+        filters = {'is_public': True, 'in_stock': in_stock, 'category': category or None, 'brand': brand or None}
+        limit = int(getattr(settings, 'SEARCH_MAX_RESULTS', 1000))
+        # One hit past the cap tells a full ranking from a cut one
+        ids = drop_deleted(index, [doc_id for doc_id, _ in index.search(search, filters, limit=limit + 1)])
+        ranked = RankedIds(ids[:limit])
+        ranked.capped = len(ids) > limit
+        return ranked
+    except Exception:
+        return None
+
+# Rows per Mongo batch / ORM chunk when streaming a seller's inventory
+STREAM_BATCH = 500
+
+def product_changed(*skus):
+    invalidate_product_doc(*skus)
+    try:
+        reindex_products(*skus)
+        reindex_suggestions(*skus)
+    except Exception:
+        pass
+    bump_catalog_version()
+
+class SparseFieldsMixin:
+    # ?fields=a,b or ?view=card trims both the query and the serialized product
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = requested_fields(self.request.query_params)
+        return context
+
+    def shape_queryset(self, qs):
+        return shape_product_queryset(qs, requested_fields(self.request.query_params))
+
+class ProductListView(SparseFieldsMixin, generics.ListAPIView):
+    queryset = Product.objects.select_related('category').all().order_by('-id')
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
     filter_backends = [filters.SearchFilter]
     search_fields = ['title', 'brand', 'description']
+    pagination_class = ProductPagination
+    rank_ordered = False
+    search_capped = False
 
     def get_queryset(self):
-        qs = super().get_queryset().filter(in_stock=True).exclude(sku__in=SEED_SKUS).exclude(brand__iexact=SEED_BRAND)
+        qs = super().get_queryset().filter(is_public=True, in_stock=True)
         category = self.request.query_params.get('category')
         if category:
             qs = qs.filter(category__name__iexact=category)
-        return qs
+        brand = self.request.query_params.get('brand')
+        if brand:
+            qs = qs.filter(brand__iexact=brand)
+        sort, min_price, max_price, _ = listing_options(self.request.query_params)
+        if min_price is not None:
+            qs = qs.filter(price__gte=min_price)
+        if max_price is not None:
+            qs = qs.filter(price__lte=max_price)
+        return self.shape_queryset(qs.order_by(*orm_ordering(sort or 'newest')))
+
+    def filter_queryset(self, queryset):
+        params = self.request.query_params
+        search = params.get('search')
+        if search and getattr(settings, 'MONGO_DB', None) is None:
+            ranked = search_ranked(search, params.get('category'), params.get('brand'))
+            if ranked is not None:
+                self.search_capped = ranked.capped
+                ids = [int(i) for i in ranked]
+                if not ids:
+                    return queryset.none()
+                queryset = queryset.filter(pk__in=ids)
+                if params.get('sort'):
+                    return queryset
+                rank = Case(*[When(pk=pk, then=pos) for pos, pk in enumerate(ids)], output_field=IntegerField())
+                self.rank_ordered = True
+                return queryset.order_by(rank, 'id')
+        return super().filter_queryset(queryset)
 
     def list(self, request, *args, **kwargs):
+        return cached_response('products', request, lambda: self._list(request, *args, **kwargs))
+
+    def _list(self, request, *args, **kwargs):
+        sort, min_price, max_price, error = listing_options(request.query_params)
+        if error:
+            return Response({'detail': error}, status=400)
+        counting = count_mode(request.query_params)
+        if counting is None:
+            return Response({'detail': 'Invalid count'}, status=400)
         mongo = getattr(settings, 'MONGO_DB', None)
         if mongo is not None:
             params = request.query_params
             cat = params.get('category')
+            brand = params.get('brand')
             search = params.get('search')
+            fields = requested_fields(params)
+            page, page_size, after = page_params(params)
+            if after is False:
+                return Response({'detail': 'Invalid cursor'}, status=400)
+            facets = requested_facets(params)
+            counts = None
+            if facets:
+                # Cached counts ride along with the ordinary indexed page; only a miss runs the $facet aggregation
+                counts = facet_cache.get(facet_cache_key('mongo', params, facets))
+                if counts is None:
+                    try:
+                        return self._faceted_page(mongo, params, facets, fields, page, page_size, after, sort, (min_price, max_price))
+                    except Exception:
+                        logger.exception('Facet aggregation failed; serving the page without facets')
+                        counts = False
+            ranked = search_ranked(search, cat, brand) if search else None
+            if ranked is not None:
+                try:
+                    return self._with_facets(self._search_page(mongo, ranked, product_list_query(cat, None, brand, min_price, max_price), fields, page, page_size, after, sort, counting), counts)
+                except Exception:
+                    pass
+            query = product_list_query(cat, search, brand, min_price, max_price)
+            order = sort or 'newest'
+            # Keyset paging: an opaque cursor replaces skip() so deep pages cost the same as the first one
+            if after:
+                keyset = mongo_keyset_filter(after, order)
+                if keyset is None:
+                    return Response({'detail': 'Invalid cursor'}, status=400)
             try:
-                page = max(1, int(params.get('page', '1')))
-            except Exception:
-                page = 1
-            try:
-                page_size = min(100, max(1, int(params.get('page_size', '20'))))
-            except Exception:
-                page_size = 20
-            query = {'in_stock': True, 'brand': {'$ne': SEED_BRAND}, 'sku': {'$nin': list(SEED_SKUS)}, 'owner_email': {'$ne': SEED_OWNER_EMAIL}}
-            if cat:
-                query['category'] = cat
-            if search:
-                query['$text'] = {'$search': search}
-            try:
-                cursor = mongo['products'].find(query).sort('_id', -1)
-                total = cursor.count() if hasattr(cursor, 'count') else mongo['products'].count_documents(query)
-                docs = list(cursor.skip((page-1)*page_size).limit(page_size))
-                data = [product_public(d) for d in docs]
+                total, estimated = mongo_total(mongo['products'], query, params, counting)
+                projection = _listing_projection(fields, order)
+                if after:
+                    cursor = mongo['products'].find(_merge_query(query, keyset), projection).sort(mongo_sort(order))
+                else:
+                    cursor = mongo['products'].find(query, projection).sort(mongo_sort(order)).skip((page-1)*page_size)
+                docs = list(cursor.limit(page_size + 1))
+                next_cursor = mongo_cursor_for(docs[page_size - 1], order) if len(docs) > page_size else None
+                data = products_public(mongo['products'], docs[:page_size], fields)
                 # Fallback to ORM if collection empty
-                if not data:
-                    return super().list(request, *args, **kwargs)
-                return Response({'results': data, 'page': page, 'page_size': page_size, 'total': total})
+                if not data and not after:
+                    return self._orm_list(request, *args, **kwargs)
+                body = {'results': data, 'page': None if after else page, 'page_size': page_size, 'total': total, 'next_cursor': next_cursor}
+                if estimated:
+                    body['total_estimated'] = True
+                return self._with_facets(Response(body), counts)
             except Exception:
                 # Any Mongo error -> fallback
-                return super().list(request, *args, **kwargs)
-        return super().list(request, *args, **kwargs)
+                return self._orm_list(request, *args, **kwargs)
+        return self._orm_list(request, *args, **kwargs)
+
+    def _search_page(self, mongo, ranked, query, fields, page, page_size, after, sort=None, counting='exact'):
+        # Relevance order has no keyset, so search cursors carry an offset into the ranked ids
+        offset = after.get('o') if after else (page - 1) * page_size
+        if not isinstance(offset, int) or offset < 0:
+            return Response({'detail': 'Invalid cursor'}, status=400)
+        from bson import ObjectId
+        capped = getattr(ranked, 'capped', False)
+        if sort or 'price' in query:
+            # Price ranges and explicit sorts are applied by Mongo to the matched ids (at most SEARCH_MAX_RESULTS)
+            matched = mongo['products'].find({**query, '_id': {'$in': [ObjectId(i) for i in ranked if ObjectId.is_valid(i)]}}, {'_id': 1})
+            if sort:
+                ranked = [str(d['_id']) for d in matched.sort(mongo_sort(sort))]
+            else:
+                keep = {str(d['_id']) for d in matched}
+                ranked = [i for i in ranked if i in keep]
+        ids = ranked[offset:offset + page_size]
+        oids = [ObjectId(i) for i in ids if ObjectId.is_valid(i)]
+        docs = list(mongo['products'].find({**query, '_id': {'$in': oids}}, mongo_projection(fields))) if oids else []
+        by_id = {str(d['_id']): d for d in docs}
+        ordered = [by_id[i] for i in ids if i in by_id]
+        next_cursor = encode_cursor({'o': offset + page_size}) if offset + page_size < len(ranked) else None
+        data = products_public(mongo['products'], ordered, fields)
+        total = None if counting == 'none' else len(ranked)
+        body = {'results': data, 'page': None if after else page, 'page_size': page_size, 'total': total, 'next_cursor': next_cursor}
+        if capped and total is not None:
+            body['total_estimated'] = True
+        return Response(body)
 
-class ProductDetailView(generics.RetrieveAPIView):
-    queryset = Product.objects.select_related('category', 'owner').all()
+    def _with_facets(self, response, counts):
+        # counts is a cached (facets, total) pair, False when computing them failed, or None when none were asked for
+        if counts is None or response.status_code != 200:
+            return response
+        if counts is False:
+            response.data.update(facets=None, facets_unavailable=True)
+            # Not kept in the response cache, so the next request tries the counts again
+            response.uncacheable = True
+        else:
+            response.data['facets'] = counts[0]
+        return response
+
+    def _faceted_page(self, mongo, params, facets, fields, page, page_size, after, sort=None, prices=(None, None)):
+        # On a facet cache miss the page, the total and every facet come back from a single $facet aggregation
+        from bson import ObjectId
+        search = params.get('search')
+        base = {'is_public': True}
+        ranked = search_ranked(search, in_stock=None) if search else None
+        capped = getattr(ranked, 'capped', False)
+        if ranked is not None:
+            ranked = [ObjectId(i) for i in ranked if ObjectId.is_valid(i)]
+            base['_id'] = {'$in': ranked}
+        elif search:
+            base['$text'] = {'$search': search}
+        facet_filters = {'in_stock': {'in_stock': True}}
+        if params.get('category'):
+            facet_filters['category'] = {'category': params.get('category')}
+        if params.get('brand'):
+            facet_filters['brand'] = {'brand': params.get('brand')}
+        if price_condition(*prices):
+            facet_filters['price'] = {'price': price_condition(*prices)}
+        order_by = sort or 'newest'
+        sort_stage = {'$sort': dict(mongo_sort(order_by))}
+        offset = 0
+        if ranked is not None:
+            offset = after.get('o') if after else (page - 1) * page_size
+            if not isinstance(offset, int) or offset < 0:
+                return Response({'detail': 'Invalid cursor'}, status=400)
+            if sort:
+                order = [sort_stage, {'$skip': offset}]
+            else:
+                order = [{'$addFields': {'_rank': {'$indexOfArray': [ranked, '$_id']}}}, {'$sort': {'_rank': 1}}, {'$skip': offset}]
+        elif after:
+            keyset = mongo_keyset_filter(after, order_by)
+            if keyset is None:
+                return Response({'detail': 'Invalid cursor'}, status=400)
+            order = [{'$match': keyset}, sort_stage]
+        else:
+            order = [sort_stage, {'$skip': (page - 1) * page_size}]
+        stages = mongo_facet_stages(facet_filters, facets)
+        matched = {}
+        for cond in facet_filters.values():
+            matched.update(cond)
+        stages['results'] = [{'$match': matched}] + order + [{'$limit': page_size + 1}, {'$project': _listing_projection(fields, order_by)}]
+        row = next(iter(mongo['products'].aggregate([{'$match': base}, {'$facet': stages}])), {})
+        counts, total = mongo_facets_from(row, facets)
+        facet_cache.set(facet_cache_key('mongo', params, facets), (counts, total))
+        docs = row.get('results') or []
+        if not docs and not after and not total:
+            return self._orm_list(self.request)
+        if len(docs) <= page_size:
+            next_cursor = None
+        elif ranked is not None:
+            next_cursor = encode_cursor({'o': offset + page_size})
+        else:
+            next_cursor = mongo_cursor_for(docs[page_size - 1], order_by)
+        data = products_public(mongo['products'], docs[:page_size], fields)
+        body = {'results': data, 'page': None if after else page, 'page_size': page_size, 'total': total, 'next_cursor': next_cursor, 'facets': counts}
+        if capped:
+            body['total_estimated'] = True
+        return Response(body)
+
+    def _orm_list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        facets = requested_facets(request.query_params)
+        if not facets or response.status_code != 200:
+            return response
+        key = facet_cache_key('orm', request.query_params, facets)
+        cached = facet_cache.get(key)
+        if cached is None:
+            cached = orm_facets(self._facet_base(), self._facet_filters(), facets)
+            facet_cache.set(key, cached)
+        response.data['facets'] = cached[0]
+        return response
+
+    def _facet_base(self):
+        qs = Product.objects.filter(is_public=True)
+        search = self.request.query_params.get('search')
+        if not search:
+            return qs
+        ranked = search_ranked(search, in_stock=None) if getattr(settings, 'MONGO_DB', None) is None else None
+        if ranked is not None:
+            return qs.filter(pk__in=[int(i) for i in ranked])
+        return filters.SearchFilter().filter_queryset(self.request, qs, self)
+
+    def _facet_filters(self):
+        params = self.request.query_params
+        conds = {'in_stock': Q(in_stock=True)}
+        if params.get('category'):
+            conds['category'] = Q(category__name__iexact=params.get('category'))
+        if params.get('brand'):
+            conds['brand'] = Q(brand__iexact=params.get('brand'))
+        _, min_price, max_price, _ = listing_options(params)
+        price = Q()
+        if min_price is not None:
+            price &= Q(price__gte=min_price)
+        if max_price is not None:
+            price &= Q(price__lte=max_price)
+        if price:
+            conds['price'] = price
+        return conds
+
+class ProductDetailView(SparseFieldsMixin, generics.RetrieveAPIView):
+    queryset = Product.objects.select_related('category').all()
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
 
+    def get_queryset(self):
+        return self.shape_queryset(super().get_queryset())
+
+    def retrieve(self, request, *args, **kwargs):
+        return cached_response('detail', request, lambda: self._retrieve(request, *args, **kwargs), extra=(str(kwargs.get('pk')),))
+
+    def _retrieve(self, request, *args, **kwargs):
+        pk = str(kwargs.get('pk'))
+        mongo = getattr(settings, 'MONGO_DB', None)
+        if mongo is not None:
+            try:
+                doc = cached_product_doc(mongo, pk)
+                if doc:
+                    return Response(product_public(doc, requested_fields(request.query_params)))
+            except Exception:
+                pass
+        if not pk.isdigit():
+            return Response({'detail': 'Product not found'}, status=404)
+        return super().retrieve(request, *args, **kwargs)
+
 class CategoryListView(generics.ListAPIView):
     queryset = Category.objects.all().order_by('name')
     serializer_class = CategorySerializer
     permission_classes = [permissions.AllowAny]
 
     def list(self, request, *args, **kwargs):
+        return cached_response('categories', request, lambda: self._list(request, *args, **kwargs))
+
+    def _list(self, request, *args, **kwargs):
+        # Rows survive response-cache churn from listing queries; the next catalog write retires them
+        key = (index_source(), catalog_version(max_age=1)[0])
+        data = category_cache.get(key)
+        if data is None:
+            data = self._rows()
+            category_cache.set(key, data)
+        return Response(data)
+
+    def _rows(self):
         mongo = getattr(settings, 'MONGO_DB', None)
         if mongo is not None:
             try:
-                docs = list(mongo['categories'].find({}, {'name': 1}).sort('name', 1).limit(200))
-                data = [{'id': str(d.get('_id')), 'name': d.get('name')} for d in docs if d.get('name')]
-                if not data:
-                    return super().list(request, *args, **kwargs)
-                return Response(data)
+                docs = list(mongo['categories'].find({}, {'name': 1, 'product_count': 1}).sort('name', 1).limit(200))
+                data = [{'id': str(d.get('_id')), 'name': d.get('name'), 'product_count': max(0, int(d.get('product_count') or 0))} for d in docs if d.get('name')]
+                if data:
+                    return data
             except Exception:
-                return super().list(request, *args, **kwargs)
-        return super().list(request, *args, **kwargs)
+                pass
+        visible = Q(products__is_public=True, products__in_stock=True)
+        rows = self.get_queryset().annotate(product_count=Count('products', filter=visible))
+        return [{'id': c.id, 'name': c.name, 'product_count': c.product_count} for c in rows]
+
+class NDJSONRenderer(BaseRenderer):
+    # Lets content negotiation accept application/x-ndjson; listings stream their own rows, this renders the
+    # rest (errors) as one object per line
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
 
-class MyProductListView(generics.ListAPIView):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        encoder = JSONEncoder()
+        return ''.join(encoder.encode(row) + '\n' for row in (data if isinstance(data, list) else [data])).encode('utf-8')
+
+class MyProductListView(SparseFieldsMixin, generics.ListAPIView):
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ProductPagination
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
+
+    @property
+    def count_scope(self):
+        return ('mine', getattr(self.request.user, 'email', None))
 
     def get_queryset(self):
-        return Product.objects.filter(owner=self.request.user).exclude(sku__in=SEED_SKUS).exclude(brand__iexact=SEED_BRAND).order_by('-id')
+        return self.shape_queryset(Product.objects.filter(owner=self.request.user, is_seed=False).order_by('-id'))
+
+    def paginate_queryset(self, queryset):
+        # Without paging parameters the endpoint keeps returning a bare list
+        if not any(k in self.request.query_params for k in ('page', 'page_size', 'cursor')):
+            return None
+        return super().paginate_queryset(queryset)
 
     def list(self, request, *args, **kwargs):
+        # Seller listings are private: conditional GET support only, never the shared response cache
+        # The body format follows Accept as well as ?stream, so it is part of the ETag and of Vary
+        email = getattr(request.user, 'email', None)
+        fmt = 'ndjson' if self.wants_ndjson(request) else 'json'
+        response = cached_response('mine', request, lambda: self._list(request, *args, **kwargs), extra=(email, fmt), shared=False)
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+    @staticmethod
+    def wants_ndjson(request):
+        return request.query_params.get('stream') == 'ndjson' or getattr(request.accepted_renderer, 'format', None) == 'ndjson'
+
+    def _list(self, request, *args, **kwargs):
+        params = request.query_params
+        streaming = self.wants_ndjson(request)
+        paged = any(k in params for k in ('page', 'page_size', 'cursor'))
+        page, page_size, after = page_params(params)
+        if after is False:
+            return Response({'detail': 'Invalid cursor'}, status=400)
+        counting = count_mode(params)
+        if counting is None:
+            return Response({'detail': 'Invalid count'}, status=400)
         mongo = getattr(settings, 'MONGO_DB', None)
         if mongo is not None:
             email = getattr(request.user, 'email', None)
+            fields = requested_fields(params)
+            query = {'owner_email': email, 'is_seed': False}
+            keyset = mongo_keyset_filter(after) if after else None
+            if after and keyset is None:
+                return Response({'detail': 'Invalid cursor'}, status=400)
             try:
-                docs = list(mongo['products'].find({'owner_email': email, 'brand': {'$ne': SEED_BRAND}, 'sku': {'$nin': list(SEED_SKUS)}}).sort('_id', -1).limit(500))
-                data = [product_public(d) for d in docs]
-                return Response(data)
+                if streaming:
+                    return self._stream(self._mongo_batches(mongo, query, fields), 'application/x-ndjson')
+                if not paged:
+                    # The whole inventory as one JSON array, built batch by batch instead of in memory
+                    return self._stream(self._mongo_batches(mongo, query, fields), 'application/json')
+                total, estimated = mongo_total(mongo['products'], query, params, counting, scope=self.count_scope)
+                if after:
+                    cursor = mongo['products'].find(_merge_query(query, keyset), mongo_projection(fields))
+                else:
+                    cursor = mongo['products'].find(query, mongo_projection(fields)).skip((page - 1) * page_size)
+                docs = list(cursor.sort('_id', -1).limit(page_size + 1))
+                next_cursor = mongo_cursor_for(docs[page_size - 1]) if len(docs) > page_size else None
+                body = {'results': products_public(mongo['products'], docs[:page_size], fields), 'page': None if after else page, 'page_size': page_size, 'total': total, 'next_cursor': next_cursor}
+                if estimated:
+                    body['total_estimated'] = True
+                return self._with_facets(Response(body), counts)
             except Exception:
                 pass
+        if streaming:
+            return self._stream(self._orm_batches(), 'application/x-ndjson')
         return super().list(request, *args, **kwargs)
 
+    def _mongo_batches(self, mongo, query, fields):
+        cursor = mongo['products'].find(query, mongo_projection(fields)).sort('_id', -1).batch_size(STREAM_BATCH)
+        batch = []
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= STREAM_BATCH:
+                yield products_public(mongo['products'], batch, fields)
+                batch = []
+        if batch:
+            yield products_public(mongo['products'], batch, fields)
+
+    def _orm_batches(self):
+        context = self.get_serializer_context()
+        batch = []
+        for product in self.get_queryset().iterator(chunk_size=STREAM_BATCH):
+            batch.append(product)
+            if len(batch) >= STREAM_BATCH:
+                yield ProductSerializer(batch, many=True, context=context).data
+                batch = []
+        if batch:
+            yield ProductSerializer(batch, many=True, context=context).data
+
+    def _stream(self, batches, content_type):
+        batches = iter(batches)
+        # The first batch is read here so a failing query still falls back before any byte is sent
+        first = next(batches, [])
+        def chunks():
+            encoder = JSONEncoder()
+            if content_type == 'application/x-ndjson':
+                for batch in itertools.chain([first], batches):
+                    yield ''.join(encoder.encode(row) + '\n' for row in batch)
+                return
+            sep = '['
+            for batch in itertools.chain([first], batches):
+                for row in batch:
+                    yield sep + encoder.encode(row)
+                    sep = ','
+            yield ']' if sep == ',' else '[]'
+        return StreamingHttpResponse(chunks(), content_type=content_type)
+
 class ProductCreateView(generics.CreateAPIView):
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser, JSONParser]
 
     def create(self, request, *args, **kwargs):
+        response = self._create(request, *args, **kwargs)
+        if response.status_code == 201:
+            product_changed((response.data or {}).get('sku'))
+        return response
+
+    def _create(self, request, *args, **kwargs):
         user = request.user
         if getattr(user, 'role', 'customer') not in ['seller', 'admin']:
             return Response({'detail': 'Only sellers or admins can create products'}, status=403)
@@ -121,7 +578,8 @@ class ProductCreateView(generics.CreateAPIView):
         if mongo is not None:
             import secrets
             owner_email = getattr(user, 'email', None)
-            doc = product_doc_from_request(request.data, getattr(request, 'FILES', None), owner_email)
+            upload_errors = []
+            doc = product_doc_from_request(request.data, getattr(request, 'FILES', None), owner_email, upload_errors)
             existing_doc = None
             try:
                 existing_doc = mongo['products'].find_one({'sku': doc['sku']})
@@ -129,60 +587,34 @@ class ProductCreateView(generics.CreateAPIView):
                 existing_doc = None
             if existing_doc and existing_doc.get('owner_email') != owner_email:
                 doc['sku'] = 'SKU-' + secrets.token_hex(4).upper()
+                derive_product_fields(doc)
             try:
-                mongo['products'].update_one({'sku': doc['sku']}, {'$set': doc}, upsert=True)
+                # The ORM copy is written by the outbox worker
+                with mirrored_write('product', doc['sku']):
+                    save_product_doc(mongo, doc)
             except Exception:
                 return Response({'detail': 'Failed to save product to database'}, status=400)
+            # The product is saved from here on; gc_media_blobs repairs a missed reference
             try:
-                mongo['categories'].update_one({'name': doc['category']}, {'$set': {'name': doc['category']}}, upsert=True)
+                track_media(doc['sku'], doc_blob_keys(doc))
             except Exception:
                 pass
             try:
-                cat, _ = Category.objects.get_or_create(name=doc.get('category') or '')
-                orm_existing = Product.objects.filter(sku=doc.get('sku') or '').first()
-                if orm_existing:
-                    orm_existing.title = doc.get('title') or orm_existing.title
-                    orm_existing.price = doc.get('price') or orm_existing.price
-                    orm_existing.original_price = doc.get('original_price') or orm_existing.original_price
-                    orm_existing.category = cat
-                    orm_existing.brand = doc.get('brand') or ''
-                    orm_existing.description = doc.get('description') or ''
-                    orm_existing.image_url = doc.get('image_url') or ''
-                    orm_existing.model_glb_url = doc.get('model_glb_url') or ''
-                    orm_existing.sketchfab_embed_url = doc.get('sketchfab_embed_url') or ''
-                    orm_existing.in_stock = bool(doc.get('in_stock'))
-                    orm_existing.rating = float(doc.get('rating') or 0)
-                    orm_existing.features = list(doc.get('features') or [])
-                    orm_existing.owner = user
-                    orm_existing.stock = int(doc.get('stock') or 0)
-                    orm_existing.save()
-                    # Ignore extra image URLs for ORM sync; primary URL stored in image_url
-                else:
-                    p = Product.objects.create(
-                        title=doc.get('title') or '',
-                        price=doc.get('price') or 0,
-                        original_price=doc.get('original_price') or 0,
-                        category=cat,
-                        brand=doc.get('brand') or '',
-                        description=doc.get('description') or '',
-                        image_url=doc.get('image_url') or '',
-                        model_glb_url=doc.get('model_glb_url') or '',
-                        sketchfab_embed_url=doc.get('sketchfab_embed_url') or '',
-                        in_stock=bool(doc.get('in_stock')),
-                        rating=float(doc.get('rating') or 0),
-                        features=list(doc.get('features') or []),
-                        owner=user,
-                        sku=doc.get('sku') or '',
-                        stock=int(doc.get('stock') or 0)
-                    )
-                    # Ignore extra image URLs for ORM sync; primary URL stored in image_url
+                # Uploaded files are served from local staging until the media worker swaps in remote URLs
+                queue_media_upload(mongo, doc)
             except Exception:
                 pass
             try:
-                out = mongo['products'].find_one({'sku': doc['sku']})
-                return Response(product_public(out), status=201)
+                mongo['categories'].update_one({'name': doc['category']}, {'$set': {'name': doc['category']}}, upsert=True)
+            except Exception:
+                pass
+            try:
+                out = product_public(mongo['products'].find_one({'sku': doc['sku']}))
             except Exception:
-                return Response({'detail': 'Failed to return product'}, status=400)
+                out = product_public(doc)
+            if upload_errors:
+                out['upload_errors'] = upload_errors
+            return Response(out, status=201)
         allowed = {
             'title', 'price', 'original_price', 'category_name', 'category_id', 'brand', 'description',
             'image_url', 'images', 'image', 'model_glb', 'model_glb_url', 'sketchfab_embed_url', 'in_stock',
@@ -197,30 +629,13 @@ class ProductCreateView(generics.CreateAPIView):
         if not serializer.is_valid():
             return Response({'errors': serializer.errors}, status=400)
         try:
-            product = serializer.save()
+            with transaction.atomic():
+                product = serializer.save()
+                track_media(product.sku, product_blob_keys(product))
+                if getattr(settings, 'MONGO_DB', None) is not None:
+                    enqueue('product', product.sku, target='mongo')
         except Exception as e:
             return Response({'detail': str(e) or 'Failed to create product'}, status=400)
-        mongo = getattr(settings, 'MONGO_DB', None)
-        if mongo is not None:
-            try:
-                doc = product_doc_from_request({'title': product.title,
-                                                'price': product.price,
-                                                'original_price': product.original_price,
-                                                'category': product.category.name,
-                                                'brand': product.brand,
-                                                'description': product.description,
-                                                'image_url': product.image_url,
-                                                'model_glb_url': product.model_glb_url,
-                                                'sketchfab_embed_url': getattr(product, 'sketchfab_embed_url', ''),
-                                                'in_stock': bool(product.in_stock),
-                                                'rating': product.rating,
-                                                'features': list(product.features or []),
-                                                'sku': product.sku,
-                                                'stock': product.stock}, {}, getattr(product.owner, 'email', None))
-                mongo['products'].update_one({'sku': doc['sku']}, {'$set': doc}, upsert=True)
-                mongo['categories'].update_one({'name': doc['category']}, {'$set': {'name': doc['category']}}, upsert=True)
-            except Exception:
-                pass
         return Response(ProductSerializer(product).data, status=201)
 
 class ProductUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
@@ -237,30 +652,31 @@ class ProductUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
             raise PermissionDenied('Not allowed to modify this product')
 
     def perform_update(self, serializer):
-        mongo = getattr(settings, 'MONGO_DB', None)
-        if mongo is not None:
-            try:
-                product = self.get_object()
-                doc = product_doc_from_request(self.request.data, getattr(self.request, 'FILES', None), getattr(self.request.user, 'email', None))
-                doc['sku'] = self.request.data.get('sku') or product.sku
-                mongo['products'].update_one({'sku': doc['sku']}, {'$set': doc}, upsert=True)
-                if doc.get('category'):
-                    mongo['categories'].update_one({'name': doc['category']}, {'$set': {'name': doc['category']}}, upsert=True)
-            except Exception:
-                pass
-        product = serializer.save()
+        old_sku = serializer.instance.sku
+        with transaction.atomic():
+            product = serializer.save()
+            if old_sku != product.sku:
+                release_media(old_sku)
+            track_media(product.sku, product_blob_keys(product))
+            if getattr(settings, 'MONGO_DB', None) is not None:
+                # A changed SKU also queues the old one, whose Mongo document the worker then removes
+                enqueue('product', old_sku, product.sku, target='mongo')
+        product_changed(old_sku, product.sku, self.request.data.get('sku'))
 
     def perform_destroy(self, instance):
-        sku = instance.sku
-        super().perform_destroy(instance)
-        mongo = getattr(settings, 'MONGO_DB', None)
-        if mongo is not None and sku:
-            try:
-                mongo['products'].delete_one({'sku': sku})
-            except Exception:
-                pass
+        with transaction.atomic():
+            super().perform_destroy(instance)
+            release_media(instance.sku)
+            if getattr(settings, 'MONGO_DB', None) is not None:
+                enqueue('product', instance.sku, target='mongo')
 
     def destroy(self, request, *args, **kwargs):
+        response = self._destroy(request, *args, **kwargs)
+        if response.status_code == 200:
+            product_changed((response.data or {}).get('sku'))
+        return response
+
+    def _destroy(self, request, *args, **kwargs):
         reason = (request.data or {}).get('reason') if hasattr(request, 'data') else None
         if not reason:
             return Response({'detail': 'Reason is required for deletion'}, status=400)
@@ -288,11 +704,6 @@ class ProductUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
                 except Exception:
                     pass
             self.perform_destroy(instance)
-            if mongo is not None and sku:
-                try:
-                    mongo['products'].delete_one({'sku': sku})
-                except Exception:
-                    pass
             return Response({'detail': 'Product deleted', 'reason': reason, 'sku': sku}, status=200)
         mongo = getattr(settings, 'MONGO_DB', None)
         if mongo is None:
@@ -331,10 +742,83 @@ class ProductUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
             })
         except Exception:
             pass
-        mongo['products'].delete_one(query)
+        with mirrored_write('product', doc.get('sku')):
+            delete_product_doc(mongo, query)
+        release_media(doc.get('sku'))
+        return Response({'detail': 'Product deleted', 'reason': reason, 'sku': doc.get('sku') or ''}, status=200)
+
+class ProductImportView(APIView):
+    # CSV or NDJSON, either as a multipart `file` or as the raw request body; rows are parsed as they are read
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        user = request.user
+        if getattr(user, 'role', 'customer') not in ['seller', 'admin']:
+            return Response({'detail': 'Only sellers or admins can import products'}, status=403)
+        params = request.query_params
+        if request.content_type.startswith('multipart/'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                return Response({'detail': 'Missing file'}, status=400)
+            fmt = import_format(upload.name, upload.content_type, params.get('format'))
+            lines = iter(upload)
+        else:
+            fmt = import_format('', request.content_type, params.get('format'))
+            lines = iter(request.stream or ())
+        if fmt is None:
+            return Response({'detail': 'Unsupported import format; send CSV or NDJSON'}, status=400)
+        dry_run = (params.get('dry_run') or '').lower() in ('1', 'true', 'yes')
+        importer = ProductImporter(user, getattr(settings, 'CATALOG_IMPORT_CHUNK_SIZE', 500), dry_run=dry_run)
+        stats = importer.run(iter_rows(lines, fmt))
+        if importer.skus:
+            product_changed(*importer.skus)
+        return Response(stats)
+
+class ProductBulkUpdateView(APIView):
+    # [{sku, price?, stock?, in_stock?}, ...] (or {"items": [...]}) applied as one batch
+    permission_classes = [permissions.IsAuthenticated]
+
+    def patch(self, request):
+        if getattr(request.user, 'role', 'customer') not in ['seller', 'admin']:
+            return Response({'detail': 'Only sellers or admins can update products'}, status=403)
+        items = request.data.get('items') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response({'detail': 'Expected a non-empty list of changes'}, status=400)
+        limit = int(getattr(settings, 'CATALOG_BULK_UPDATE_MAX_ITEMS', 1000))
+        if len(items) > limit:
+            return Response({'detail': f'At most {limit} changes per request'}, status=400)
+        updated, errors = apply_price_stock_changes(request.user, items)
+        if updated:
+            product_changed(*updated)
+        return Response({'updated': len(updated), 'failed': len(errors), 'errors': errors})
+
+class ProductSuggestView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        q = (request.query_params.get('q') or '').strip()
         try:
-            Product.objects.filter(sku=doc.get('sku') or '').delete()
-            CartItem.objects.filter(product__sku=doc.get('sku') or '').delete()
+            limit = min(20, max(1, int(request.query_params.get('limit', '8'))))
         except Exception:
-            pass
-        return Response({'detail': 'Product deleted', 'reason': reason, 'sku': doc.get('sku') or ''}, status=200)
+            limit = 8
+        results = []
+        if q:
+            try:
+                index = get_suggest_index()
+                results = index.suggest(q, limit) if index is not None else []
+            except Exception:
+                results = []
+        response = Response({'query': q, 'results': results})
+        policy = (getattr(settings, 'CATALOG_CACHE_CONTROL', None) or {}).get('suggest')
+        if policy:
+            response['Cache-Control'] = policy
+        return response
+
+class CatalogCacheStatsView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        if getattr(request.user, 'role', 'customer') != 'admin':
+            return Response({'detail': 'Forbidden'}, status=403)
+        return Response(cache_stats())
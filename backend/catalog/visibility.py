@@ -0,0 +1,18 @@
+SEED_SKUS = {
+    'RING-PREM-001',
+    'WATCH-LUX-001',
+    'GLASS-DES-001',
+    'GLASS-AR-TEST-001',
+    'GLB-SAMPLE-001',
+    'SHOE-CLASS-001',
+}
+SEED_BRAND = 'Sample'
+SEED_OWNER_EMAIL = 'seller@stylesathi.com'
+
+def is_seed_product(sku, brand):
+    return (sku or '') in SEED_SKUS or (brand or '').strip().lower() == SEED_BRAND.lower()
+
+def visibility_fields(sku, brand, owner_email):
+    # Materialized at write time so listings filter on positive, indexable flags
+    seed = is_seed_product(sku, brand)
+    return {'is_seed': seed, 'is_public': (not seed) and owner_email != SEED_OWNER_EMAIL}
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from orders.mirror import link_legacy_orders
+from orders.models import Order
+
+class Command(BaseCommand):
+    help = 'Link ORM orders mirrored before the reference column existed to their Mongo order_id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        mongo = getattr(settings, 'MONGO_DB', None)
+        if mongo is None:
+            self.stdout.write('MONGO_DB is not configured; ORM orders have no Mongo counterpart')
+            return
+        batch_size = max(1, options['batch_size'])
+        scanned = linked = 0
+        last_id = None
+        while Order.objects.filter(reference__isnull=True).exists():
+            query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+            docs = list(mongo['orders'].find(query).sort('_id', 1).limit(batch_size))
+            if not docs:
+                break
+            last_id = docs[-1]['_id']
+            known = set(Order.objects.filter(reference__in=[d.get('order_id') for d in docs]).values_list('reference', flat=True))
+            linked += len(link_legacy_orders([d for d in docs if d.get('order_id') not in known]))
+            scanned += len(docs)
+        left = Order.objects.filter(reference__isnull=True).count()
+        self.stdout.write(self.style.SUCCESS(f'Mongo orders: scanned {scanned}, linked {linked}; {left} ORM order(s) still unreferenced'))
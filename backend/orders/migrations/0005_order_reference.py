@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_alter_order_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='reference',
+            field=models.CharField(blank=True, max_length=32, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,103 @@
+from collections import Counter
+from datetime import date
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from catalog.models import Product
+from .models import Order, OrderItem
+
+def _order_fields(doc):
+    try:
+        delivery = date.fromisoformat(doc.get('estimated_delivery') or '')
+    except (TypeError, ValueError):
+        delivery = None
+    return {
+        'status': doc.get('status') or 'confirmed',
+        'total': round(float(doc.get('total') or 0), 2),
+        'estimated_delivery': delivery,
+        'full_name': doc.get('full_name') or '',
+        'email': doc.get('email') or '',
+        'phone_number': doc.get('phone_number') or '',
+        'street_address': doc.get('street_address') or '',
+        'city': doc.get('city') or '',
+        'zip_code': doc.get('zip_code') or '',
+        'country': doc.get('country') or '',
+        'payment_method': doc.get('payment_method') or '',
+    }
+
+def link_legacy_orders(docs):
+    # Orders mirrored before the reference column existed have reference=NULL. Each Mongo order without a
+    # referenced row adopts the unreferenced order of the same user, shipping address, day and items, so a
+    # later event updates that row instead of creating a second copy. Returns {order_id: Order}.
+    docs = [d for d in docs if d.get('order_id')]
+    emails = {d.get('user_email') for d in docs}
+    users = dict(get_user_model().objects.filter(email__in=emails).values_list('email', 'id'))
+    candidates = list(
+        Order.objects.filter(user_id__in=users.values(), reference__isnull=True).prefetch_related('items')
+    ) if users else []
+    if not candidates:
+        return {}
+    skus = {it.get('product_sku') for d in docs for it in (d.get('items') or [])}
+    products = dict(Product.objects.filter(sku__in=skus).values_list('sku', 'id'))
+    linked = {}
+    for doc in docs:
+        try:
+            day = date.fromisoformat(doc.get('created_at') or '')
+        except (TypeError, ValueError):
+            day = None
+        wanted = Counter((products.get(it.get('product_sku')), int(it.get('quantity') or 1)) for it in (doc.get('items') or []))
+        fields = _order_fields(doc)
+        for order in candidates:
+            if order.reference or order.user_id != users.get(doc.get('user_email')):
+                continue
+            if any(getattr(order, f) != fields[f] for f in ('full_name', 'email', 'street_address', 'zip_code')):
+                continue
+            # created_at is a UTC timestamp and the Mongo date is local, so allow a day either way
+            if day is not None and abs((order.created_at.date() - day).days) > 1:
+                continue
+            # The old mirror skipped lines whose product it could not find, so its items may be a subset
+            have = Counter((i.product_id, i.quantity) for i in order.items.all())
+            if not have or have - wanted:
+                continue
+            if Order.objects.filter(id=order.id, reference__isnull=True).update(reference=doc['order_id']):
+                order.reference = doc['order_id']
+                linked[order.reference] = order
+                break
+    return linked
+
+def orders_to_orm(mongo, order_ids, queued_at=None):
+    # Outbox handler: creates the ORM copy of each Mongo order once, then keeps its status in step
+    docs = {d['order_id']: d for d in mongo['orders'].find({'order_id': {'$in': order_ids}})}
+    existing = {o.reference: o for o in Order.objects.filter(reference__in=order_ids).only('id', 'reference', 'status')}
+    existing.update(link_legacy_orders([d for oid, d in docs.items() if oid not in existing]))
+    missing = [d for oid, d in docs.items() if oid not in existing]
+    emails = {d.get('user_email') for d in missing}
+    users = dict(get_user_model().objects.filter(email__in=emails).values_list('email', 'id'))
+    skus = {it.get('product_sku') for d in missing for it in (d.get('items') or [])}
+    products = dict(Product.objects.filter(sku__in=skus).values_list('sku', 'id'))
+    errors = {oid: 'Order not found' for oid in order_ids if oid not in docs}
+    changed = []
+    for oid, doc in docs.items():
+        order = existing.get(oid)
+        if order is not None:
+            if order.status != doc.get('status'):
+                order.status = doc.get('status') or order.status
+                changed.append(order)
+            continue
+        # The user and product mirrors may still be queued; the event is retried until they land
+        if doc.get('user_email') not in users:
+            errors[oid] = f"User {doc.get('user_email')} is not mirrored yet"
+            continue
+        lines = doc.get('items') or []
+        absent = [it.get('product_sku') for it in lines if it.get('product_sku') not in products]
+        if absent:
+            errors[oid] = f"Products not mirrored yet: {', '.join(str(s) for s in absent)}"
+            continue
+        with transaction.atomic():
+            order = Order.objects.create(user_id=users[doc['user_email']], reference=oid, **_order_fields(doc))
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=products[it['product_sku']], quantity=int(it.get('quantity') or 1), price=round(float(it.get('price') or 0), 2))
+                for it in lines
+            ])
+    if changed:
+        Order.objects.bulk_update(changed, ['status'])
+    return errors
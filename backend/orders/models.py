@@ -15,6 +15,8 @@ class Order(models.Model):
     total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     estimated_delivery = models.DateField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # order_id of the Mongo order this row mirrors
+    reference = models.CharField(max_length=32, unique=True, null=True, blank=True)
 
     # shipping fields
     full_name = models.CharField(max_length=255, blank=True)
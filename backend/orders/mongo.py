@@ -1,15 +1,6 @@
 import secrets
 from datetime import date, timedelta
 
-def ensure_indexes(mongo):
-    try:
-        mongo['orders'].create_index('order_id', unique=True)
-        mongo['orders'].create_index('user_email')
-        mongo['orders'].create_index('status')
-        mongo['orders'].create_index('created_at')
-    except Exception:
-        pass
-
 def _product_for_item(mongo, item):
     sku = item.get('product_sku') or item.get('sku')
     if sku:
@@ -1,6 +1,10 @@
 from rest_framework import serializers
+from django.db.models import Prefetch
 from .models import Order, OrderItem
-from catalog.serializers import ProductSerializer
+from catalog.serializers import ProductSerializer, shape_product_queryset
+
+def order_items_prefetch():
+    return Prefetch('items', queryset=shape_product_queryset(OrderItem.objects.order_by('id'), prefix='product__', extra=('order', 'quantity', 'price', 'product')))
 
 class OrderItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer()
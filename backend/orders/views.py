@@ -7,9 +7,11 @@ from rest_framework import serializers
 from .models import Order, OrderItem
 from cart.models import Cart, CartItem
 from catalog.models import Product
-from .serializers import OrderSerializer
+from .serializers import OrderSerializer, order_items_prefetch
 from django.conf import settings
-from .mongo import ensure_indexes, build_order_doc, public_order
+from django.db.models import prefetch_related_objects
+from .mongo import build_order_doc, public_order
+from outbox.events import mirrored_write
 
 class SimpleAutoSchema(AutoSchema):
     def get_request_body(self, path, method):
@@ -53,43 +55,16 @@ class OrderCreateView(APIView):
         mongo = getattr(settings, 'MONGO_DB', None)
         if mongo is not None:
             try:
-                ensure_indexes(mongo)
                 doc = build_order_doc(mongo, getattr(request.user, 'email', None), items, shipping, payment_method)
-                mongo['orders'].insert_one(doc)
+                # The ORM copy is written by the outbox worker
+                with mirrored_write('order', doc['order_id']):
+                    mongo['orders'].insert_one(doc)
                 # clear cart (optional, still using ORM cart for now)
                 try:
                     cart, _ = Cart.objects.get_or_create(user=request.user)
                     CartItem.objects.filter(cart=cart).delete()
                 except Exception:
                     pass
-                try:
-                    order = Order.objects.create(
-                        user=request.user,
-                        status='confirmed',
-                        estimated_delivery=date.today() + timedelta(days=5),
-                        full_name=shipping.get('fullName', ''),
-                        email=shipping.get('email', ''),
-                        phone_number=shipping.get('phoneNumber', ''),
-                        street_address=shipping.get('streetAddress', ''),
-                        city=shipping.get('city', ''),
-                        zip_code=shipping.get('zipCode', ''),
-                        country=shipping.get('country', ''),
-                        payment_method=payment_method,
-                    )
-                    total = 0
-                    for it in items:
-                        try:
-                            product = Product.objects.get(id=it['product_id'])
-                        except Product.DoesNotExist:
-                            continue
-                        qty = int(it.get('quantity', 1))
-                        price = product.price
-                        OrderItem.objects.create(order=order, product=product, quantity=qty, price=price)
-                        total += price * qty
-                    order.total = total
-                    order.save()
-                except Exception:
-                    pass
                 return Response(public_order(doc), status=status.HTTP_201_CREATED)
             except ValueError as e:
                 return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -122,6 +97,7 @@ class OrderCreateView(APIView):
         order.save()
         cart, _ = Cart.objects.get_or_create(user=request.user)
         CartItem.objects.filter(cart=cart).delete()
+        prefetch_related_objects([order], order_items_prefetch())
         return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
 
 class OrderDetailView(APIView):
@@ -143,7 +119,7 @@ class OrderDetailView(APIView):
             except Exception:
                 pass
         try:
-            order = Order.objects.get(id=pk, user=request.user)
+            order = Order.objects.prefetch_related(order_items_prefetch()).get(id=pk, user=request.user)
         except Order.DoesNotExist:
             return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
         return Response(OrderSerializer(order).data)
@@ -176,7 +152,7 @@ class SellerOrderListView(APIView):
         orders = (
             Order.objects.filter(id__in=order_ids)
             .order_by('-created_at')
-            .prefetch_related('items__product__category', 'items__product')
+            .prefetch_related(order_items_prefetch())
         )
         data = OrderSerializer(orders, many=True).data
         return Response(data)
@@ -209,7 +185,7 @@ class SellerOrderDetailView(APIView):
         try:
             order = (
                 Order.objects.filter(id=pk)
-                .prefetch_related('items__product__category', 'items__product')
+                .prefetch_related(order_items_prefetch())
             ).first()
         except Order.DoesNotExist:
             return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -254,12 +230,9 @@ class OrderStatusUpdateView(APIView):
                 allowed = {'confirmed', 'processing', 'in_transit', 'delivered', 'cancelled'}
                 if new_status not in allowed:
                     return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
-                mongo['orders'].update_one({'order_id': str(pk)}, {'$set': {'status': new_status}})
+                with mirrored_write('order', str(pk)):
+                    mongo['orders'].update_one({'order_id': str(pk)}, {'$set': {'status': new_status}})
                 doc['status'] = new_status
-                try:
-                    Order.objects.filter(id=pk).update(status=new_status)
-                except Exception:
-                    pass
                 return Response(public_order(doc))
             except Exception:
                 return Response({'error': 'Failed to update status'}, status=status.HTTP_400_BAD_REQUEST)
@@ -277,6 +250,7 @@ class OrderStatusUpdateView(APIView):
             return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
         order.status = new_status
         order.save()
+        prefetch_related_objects([order], order_items_prefetch())
         return Response(OrderSerializer(order).data)
 
 class AdminOrderListView(APIView):
@@ -296,6 +270,6 @@ class AdminOrderListView(APIView):
         orders = (
             Order.objects.all()
             .order_by('-created_at')
-            .prefetch_related('items__product__category', 'items__product')
+            .prefetch_related(order_items_prefetch())
         )[:500]
         return Response(OrderSerializer(orders, many=True).data)
@@ -0,0 +1,197 @@
+import logging
+import secrets
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+# Events queued in Mongo mirror into the ORM ('orm'); OutboxEvent rows mirror into Mongo ('mongo').
+# Each handler takes (mongo, keys, queued_at), where queued_at maps each key to when its newest claimed
+# event was queued, copies the current primary state of those keys in bulk and returns {key: error} for
+# the ones it could not apply yet.
+MIRRORS = {
+    'orm': {
+        'product': 'catalog.mirror.products_to_orm',
+        'order': 'orders.mirror.orders_to_orm',
+        'user': 'users.mirror.users_to_orm',
+    },
+    'mongo': {
+        'product': 'catalog.mirror.products_to_mongo',
+        'user': 'users.mirror.users_to_mongo',
+    },
+}
+TARGETS = tuple(MIRRORS)
+
+def max_attempts():
+    return int(getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8))
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(2 ** attempts, int(getattr(settings, 'OUTBOX_MAX_RETRY_DELAY', 300))))
+
+def intent_delay():
+    return timedelta(seconds=float(getattr(settings, 'OUTBOX_INTENT_DELAY', 30)))
+
+def enqueue(kind, *keys, target='orm'):
+    # ORM primary: call inside the transaction of the primary write. Mongo primary: use mirrored_write, since
+    # a separate insert after the write is lost if the process dies between the two.
+    keys = [str(k) for k in dict.fromkeys(keys) if k]
+    if not keys:
+        return
+    now = timezone.now()
+    if target == 'orm':
+        settings.MONGO_DB['outbox'].insert_many([
+            {'kind': kind, 'key': k, 'created_at': now, 'available_at': now, 'attempts': 0} for k in keys
+        ])
+    else:
+        OutboxEvent.objects.bulk_create([OutboxEvent(kind=kind, key=k, created_at=now, available_at=now) for k in keys])
+
+@contextmanager
+def mirrored_write(kind, *keys):
+    # Wraps a Mongo primary write. Its events are inserted first but held back for OUTBOX_INTENT_DELAY, then
+    # released as soon as the write returns. A request that dies in between still gets its write mirrored once
+    # the hold expires, and a write that failed only costs a mirror of unchanged state; handlers copy current state.
+    keys = [str(k) for k in dict.fromkeys(keys) if k]
+    if not keys:
+        yield
+        return
+    now = timezone.now()
+    result = settings.MONGO_DB['outbox'].insert_many([
+        {'kind': kind, 'key': k, 'created_at': now, 'available_at': now + intent_delay(), 'attempts': 0} for k in keys
+    ])
+    yield
+    try:
+        settings.MONGO_DB['outbox'].update_many(
+            {'_id': {'$in': result.inserted_ids}, 'claim': {'$exists': False}}, {'$set': {'available_at': timezone.now()}}
+        )
+    except Exception as e:
+        # The write already succeeded; its events still drain when the hold runs out
+        logger.warning('outbox: could not release %s %s: %s', kind, ', '.join(keys), e)
+
+def _claim_mongo(mongo, limit, lease):
+    # Claimed events are hidden for the lease; a worker that dies mid-batch leaves them to the next one
+    now = timezone.now()
+    due = {'available_at': {'$lte': now}, 'attempts': {'$lt': max_attempts()}}
+    ids = [d['_id'] for d in mongo['outbox'].find(due, {'_id': 1}).sort('_id', 1).limit(limit)]
+    if not ids:
+        return []
+    token = secrets.token_hex(8)
+    mongo['outbox'].update_many({'_id': {'$in': ids}, **due}, {'$set': {'available_at': now + lease, 'claim': token}})
+    return [
+        {'id': d['_id'], 'kind': d.get('kind'), 'key': d.get('key'), 'attempts': d.get('attempts') or 0, 'created_at': d.get('created_at')}
+        for d in mongo['outbox'].find({'claim': token})
+    ]
+
+def _claim_orm(limit, lease):
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(available_at__lte=now, attempts__lt=max_attempts())
+            .order_by('available_at', 'id')[:limit]
+        )
+        OutboxEvent.objects.filter(id__in=[r.id for r in rows]).update(available_at=now + lease)
+    return [{'id': r.id, 'kind': r.kind, 'key': r.key, 'attempts': r.attempts, 'created_at': r.created_at} for r in rows]
+
+def _apply(mongo, target, kind, keys, queued_at):
+    path = MIRRORS[target].get(kind)
+    if path is None:
+        return {k: f'No mirror for {kind!r}' for k in keys}
+    handler = import_string(path)
+    try:
+        return handler(mongo, keys, queued_at) or {}
+    except Exception as e:
+        if len(keys) == 1:
+            return {keys[0]: str(e) or e.__class__.__name__}
+    # One bad key must not hold back the rest of the batch, so a failed batch is retried key by key
+    errors = {}
+    for key in keys:
+        errors.update(_apply(mongo, target, kind, [key], queued_at))
+    return errors
+
+def drain(target, limit=None):
+    mongo = getattr(settings, 'MONGO_DB', None)
+    if mongo is None:
+        return {'claimed': 0, 'applied': 0, 'failed': 0}
+    limit = limit or int(getattr(settings, 'OUTBOX_BATCH_SIZE', 200))
+    lease = timedelta(seconds=int(getattr(settings, 'OUTBOX_LEASE_SECONDS', 60)))
+    events = _claim_mongo(mongo, limit, lease) if target == 'orm' else _claim_orm(limit, lease)
+    # Handlers mirror current state, so repeated events for one key collapse into a single write
+    keys = {}
+    for ev in events:
+        keys.setdefault(ev['kind'], {}).setdefault(ev['key'], []).append(ev)
+    done, failed = [], []
+    for kind, by_key in keys.items():
+        queued_at = {key: max((ev['created_at'] for ev in evs if ev['created_at']), default=None) for key, evs in by_key.items()}
+        errors = _apply(mongo, target, kind, list(by_key), queued_at)
+        for key, evs in by_key.items():
+            if key in errors:
+                failed.extend((ev, errors[key]) for ev in evs)
+            else:
+                done.extend(ev['id'] for ev in evs)
+    now = timezone.now()
+    if target == 'orm':
+        if done:
+            mongo['outbox'].delete_many({'_id': {'$in': done}})
+        if failed:
+            from pymongo import UpdateOne
+            mongo['outbox'].bulk_write([
+                UpdateOne({'_id': ev['id']}, {
+                    '$set': {'available_at': now + retry_delay(ev['attempts']), 'last_error': err[:1000]},
+                    '$inc': {'attempts': 1},
+                    '$unset': {'claim': ''},
+                })
+                for ev, err in failed
+            ], ordered=False)
+    else:
+        if done:
+            OutboxEvent.objects.filter(id__in=done).delete()
+        if failed:
+            OutboxEvent.objects.bulk_update([
+                OutboxEvent(id=ev['id'], attempts=ev['attempts'] + 1, available_at=now + retry_delay(ev['attempts']), last_error=err[:1000])
+                for ev, err in failed
+            ], ['attempts', 'available_at', 'last_error'])
+    for ev, err in failed:
+        if ev['attempts'] + 1 >= max_attempts():
+            logger.error('outbox: giving up on %s %s:%s after %d attempts: %s', target, ev['kind'], ev['key'], ev['attempts'] + 1, err)
+    return {'claimed': len(events), 'applied': len(done), 'failed': len(failed)}
+
+def _age(oldest, now):
+    return round((now - oldest).total_seconds(), 3) if oldest else 0.0
+
+def outbox_stats():
+    # Lag is the age of the oldest event still waiting to be applied
+    now = timezone.now()
+    limit = max_attempts()
+    stats = {}
+    mongo = getattr(settings, 'MONGO_DB', None)
+    if mongo is not None:
+        coll = mongo['outbox']
+        oldest = coll.find_one({'attempts': {'$lt': limit}}, {'created_at': 1}, sort=[('created_at', 1)])
+        stats['orm'] = {
+            'pending': coll.count_documents({'attempts': {'$lt': limit}}),
+            'failed': coll.count_documents({'attempts': {'$gte': limit}}),
+            'lag_seconds': _age((oldest or {}).get('created_at'), now),
+        }
+    pending = OutboxEvent.objects.filter(attempts__lt=limit)
+    stats['mongo'] = {
+        'pending': pending.count(),
+        'failed': OutboxEvent.objects.filter(attempts__gte=limit).count(),
+        'lag_seconds': _age(pending.order_by('created_at').values_list('created_at', flat=True).first(), now),
+    }
+    return stats
+
+def retry_failed(target=None):
+    # Gives events that ran out of attempts another full round
+    mongo = getattr(settings, 'MONGO_DB', None)
+    now = timezone.now()
+    n = 0
+    if mongo is not None and target in (None, 'orm'):
+        n += mongo['outbox'].update_many({'attempts': {'$gte': max_attempts()}}, {'$set': {'attempts': 0, 'available_at': now}}).modified_count
+    if target in (None, 'mongo'):
+        n += OutboxEvent.objects.filter(attempts__gte=max_attempts()).update(attempts=0, available_at=now)
+    return n
@@ -0,0 +1,55 @@
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import close_old_connections
+from outbox.events import TARGETS, drain, outbox_stats, retry_failed
+
+class Command(BaseCommand):
+    help = 'Apply queued mirror writes (Mongo -> ORM and ORM -> Mongo) in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain what is due and exit')
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'OUTBOX_BATCH_SIZE', 200))
+        parser.add_argument('--poll', type=float, default=getattr(settings, 'OUTBOX_POLL_SECONDS', 1.0), help='Seconds to sleep when nothing is due')
+        parser.add_argument('--stats', action='store_true', help='Print queue depth and lag, then exit')
+        parser.add_argument('--retry-failed', action='store_true', help='Requeue events that ran out of attempts, then exit')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(outbox_stats(), indent=2))
+            return
+        if options['retry_failed']:
+            self.stdout.write(f'{retry_failed()} event(s) requeued')
+            return
+        if getattr(settings, 'MONGO_DB', None) is None:
+            # A worker deployed without the web service's DB_ENGINE/DB_* settings must not look healthy
+            raise CommandError('MONGO_DB is not configured (set DB_ENGINE=mongodb and the DB_*/MONGO_URI settings); there is no mirror to write')
+        report_every = float(getattr(settings, 'OUTBOX_STATS_INTERVAL', 60))
+        reported = time.monotonic()
+        errors = 0
+        while True:
+            busy = False
+            try:
+                for target in TARGETS:
+                    result = drain(target, options['batch_size'])
+                    if result['claimed']:
+                        busy = result['claimed'] >= options['batch_size'] or busy
+                        self.stdout.write(f"{target}: applied {result['applied']}, failed {result['failed']}")
+                errors = 0
+            except Exception as e:
+                # A lost Mongo or database connection must not end the worker; claimed events come back after their lease
+                errors += 1
+                delay = min(options['poll'] * 2 ** errors, float(getattr(settings, 'WORKER_MAX_BACKOFF', 60)))
+                self.stderr.write(f'drain failed ({str(e) or e.__class__.__name__}); retrying in {delay:.0f}s')
+                close_old_connections()
+                time.sleep(delay)
+                continue
+            if options['once'] and not busy:
+                break
+            if time.monotonic() - reported >= report_every:
+                self.stdout.write(json.dumps(outbox_stats()))
+                reported = time.monotonic()
+            if not busy:
+                close_old_connections()
+                time.sleep(options['poll'])
@@ -0,0 +1,20 @@
+from django.db import models
+from django.utils import timezone
+
+class OutboxEvent(models.Model):
+    # A pending ORM -> Mongo mirror write, committed with the ORM change it describes.
+    # Mongo-primary writes queue theirs in the Mongo `outbox` collection instead.
+    kind = models.CharField(max_length=32)
+    key = models.CharField(max_length=128)
+    created_at = models.DateTimeField(default=timezone.now)
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['available_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f'{self.kind}:{self.key}'
@@ -0,0 +1,141 @@
+import os
+import secrets
+from datetime import timedelta
+from unittest import skipUnless
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from catalog.models import Category, Product
+from orders.mirror import link_legacy_orders
+from orders.models import Order, OrderItem
+from .events import drain, enqueue, mirrored_write, outbox_stats, retry_failed, max_attempts
+from .models import OutboxEvent
+
+
+class OutboxEventTests(TestCase):
+    def test_enqueue_into_the_orm_skips_blank_and_repeated_keys(self):
+        enqueue('product', 'SKU-1', '', 'SKU-1', 'SKU-2', target='mongo')
+        self.assertEqual(sorted(OutboxEvent.objects.values_list('key', flat=True)), ['SKU-1', 'SKU-2'])
+
+    def test_stats_report_pending_failed_and_lag(self):
+        old = timezone.now() - timedelta(seconds=30)
+        OutboxEvent.objects.create(kind='product', key='SKU-1', created_at=old)
+        OutboxEvent.objects.create(kind='product', key='SKU-2', attempts=max_attempts())
+        stats = outbox_stats()['mongo']
+        self.assertEqual((stats['pending'], stats['failed']), (1, 1))
+        self.assertGreaterEqual(stats['lag_seconds'], 30)
+        self.assertEqual(retry_failed('mongo'), 1)
+        self.assertEqual(outbox_stats()['mongo']['failed'], 0)
+
+    def test_nothing_is_queued_or_drained_without_mongo(self):
+        from rest_framework.test import APIClient
+        user = get_user_model().objects.create_user(username='ob', email='ob@example.com', password='x', role='seller')
+        product = Product.objects.create(title='Ring', price=10, category=Category.objects.create(name='Rings'), owner=user, sku='SKU-OB')
+        client = APIClient()
+        client.force_authenticate(user)
+        self.assertEqual(client.patch(f'/api/products/{product.pk}/manage', {'title': 'Gold ring'}, format='json').status_code, 200)
+        self.assertFalse(OutboxEvent.objects.exists())
+        self.assertEqual(drain('mongo'), {'claimed': 0, 'applied': 0, 'failed': 0})
+
+    def test_worker_without_mongo_fails_instead_of_exiting_cleanly(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        with override_settings(MONGO_DB=None), self.assertRaisesMessage(CommandError, 'MONGO_DB is not configured'):
+            call_command('run_outbox_worker', '--once')
+
+    def test_orders_mirrored_before_the_reference_column_are_linked_not_duplicated(self):
+        user = get_user_model().objects.create_user(username='old', email='old@example.com', password='x')
+        product = Product.objects.create(title='Ring', price=10, category=Category.objects.create(name='Rings'), sku='SKU-OLD')
+        order = Order.objects.create(user=user, full_name='Ann', street_address='1 Main St', zip_code='111')
+        OrderItem.objects.create(order=order, product=product, quantity=2, price=10)
+        doc = {'order_id': 'ORD-OLD', 'user_email': 'old@example.com', 'created_at': timezone.now().date().isoformat(),
+               'full_name': 'Ann', 'street_address': '1 Main St', 'zip_code': '111',
+               'items': [{'product_sku': 'SKU-OLD', 'quantity': 2}]}
+        self.assertEqual(link_legacy_orders([dict(doc, order_id='ORD-OTHER', street_address='2 Side St')]), {})
+        self.assertEqual(link_legacy_orders([doc])['ORD-OLD'].pk, order.pk)
+        self.assertEqual(Order.objects.get(pk=order.pk).reference, 'ORD-OLD')
+        self.assertEqual(link_legacy_orders([dict(doc, order_id='ORD-AGAIN')]), {})
+
+
+@skipUnless(os.environ.get('MONGO_TEST_URI'), 'set MONGO_TEST_URI to mirror against a real MongoDB')
+class OutboxMirrorTests(TestCase):
+    def setUp(self):
+        import pymongo
+        self.client = pymongo.MongoClient(os.environ['MONGO_TEST_URI'])
+        self.mongo = self.client['stylesathi_outbox_' + secrets.token_hex(3)]
+        self.settings = override_settings(MONGO_DB=self.mongo)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.client.drop_database(self.mongo.name)
+
+    def test_mongo_writes_reach_the_orm_once_drained(self):
+        from catalog.mongo import product_doc_from_request, save_product_doc
+        self.mongo['users'].insert_one({'email': 'buyer@example.com', 'role': 'customer', 'is_active': True})
+        enqueue('user', 'buyer@example.com')
+        save_product_doc(self.mongo, product_doc_from_request({'title': 'Ring', 'price': 12, 'category': 'Rings', 'sku': 'SKU-MIR', 'stock': 2}, None, None))
+        enqueue('product', 'SKU-MIR', 'SKU-MIR')
+        order = {'order_id': 'ORD-MIR', 'user_email': 'buyer@example.com', 'status': 'confirmed', 'total': 24.0,
+                 'items': [{'product_sku': 'SKU-MIR', 'price': 12.0, 'quantity': 2}]}
+        self.mongo['orders'].insert_one(order)
+        # The order waits for its user and product mirrors, whichever order the events drain in
+        enqueue('order', 'ORD-MIR')
+        drain('orm')
+        self.mongo['outbox'].update_many({}, {'$set': {'available_at': timezone.now()}})
+        drain('orm')
+        self.assertEqual(self.mongo['outbox'].count_documents({}), 0)
+        self.assertEqual(float(Product.objects.get(sku='SKU-MIR').price), 12.0)
+        self.assertEqual(Order.objects.get(reference='ORD-MIR').items.get().quantity, 2)
+        self.mongo['orders'].update_one({'order_id': 'ORD-MIR'}, {'$set': {'status': 'delivered'}})
+        enqueue('order', 'ORD-MIR')
+        drain('orm')
+        self.assertEqual(Order.objects.get(reference='ORD-MIR').status, 'delivered')
+
+    def test_orm_writes_reach_mongo_once_drained(self):
+        product = Product.objects.create(title='Watch', price=40, category=Category.objects.create(name='Watches'), sku='SKU-ORM')
+        enqueue('product', 'SKU-ORM', target='mongo')
+        self.assertEqual(drain('mongo')['applied'], 1)
+        self.assertEqual(self.mongo['products'].find_one({'sku': 'SKU-ORM'})['price'], 40.0)
+        product.delete()
+        enqueue('product', 'SKU-ORM', target='mongo')
+        drain('mongo')
+        self.assertIsNone(self.mongo['products'].find_one({'sku': 'SKU-ORM'}))
+
+    def test_stale_events_do_not_revert_a_newer_edit_in_either_store(self):
+        from rest_framework.test import APIClient
+        from catalog.mongo import product_doc_from_request, save_product_doc, targeted_set
+        admin = get_user_model().objects.create_user(username='lww', email='lww@example.com', password='x', role='admin')
+        save_product_doc(self.mongo, product_doc_from_request({'title': 'Ring', 'price': 12, 'category': 'Rings', 'sku': 'SKU-LWW', 'stock': 2}, None, None))
+        enqueue('product', 'SKU-LWW')
+        drain('orm')
+        # A Mongo-side event still queued from before the seller's ORM edit
+        enqueue('product', 'SKU-LWW')
+        client = APIClient()
+        client.force_authenticate(admin)
+        pk = Product.objects.get(sku='SKU-LWW').pk
+        self.assertEqual(client.patch(f'/api/products/{pk}/manage', {'title': 'Gold ring'}, format='json').status_code, 200)
+        drain('orm')
+        drain('mongo')
+        self.assertEqual(Product.objects.get(sku='SKU-LWW').title, 'Gold ring')
+        self.assertEqual(self.mongo['products'].find_one({'sku': 'SKU-LWW'})['title'], 'Gold ring')
+        # And the other way round: a queued ORM event does not undo a newer Mongo write
+        enqueue('product', 'SKU-LWW', target='mongo')
+        self.mongo['products'].update_one({'sku': 'SKU-LWW'}, {'$set': targeted_set({'price': 15.0})})
+        enqueue('product', 'SKU-LWW')
+        drain('mongo')
+        drain('orm')
+        self.assertEqual(self.mongo['products'].find_one({'sku': 'SKU-LWW'})['price'], 15.0)
+        self.assertEqual(float(Product.objects.get(sku='SKU-LWW').price), 15.0)
+
+    def test_mongo_primary_events_are_held_until_the_write_returns(self):
+        with mirrored_write('product', 'SKU-HELD'):
+            self.assertEqual(drain('orm')['claimed'], 0)
+        self.assertEqual(drain('orm')['claimed'], 1)
+        # A request that dies mid-write leaves its event to drain once OUTBOX_INTENT_DELAY runs out
+        with self.assertRaises(RuntimeError):
+            with mirrored_write('product', 'SKU-LOST'):
+                raise RuntimeError('worker killed')
+        self.assertEqual(drain('orm')['claimed'], 0)
+        held = self.mongo['outbox'].find_one({'key': 'SKU-LOST'})
+        self.assertGreater(held['available_at'], timezone.now() - timedelta(seconds=1))
@@ -0,0 +1,6 @@
+from django.urls import path
+from .views import OutboxStatsView
+
+urlpatterns = [
+    path('stats', OutboxStatsView.as_view()),
+]
@@ -0,0 +1,12 @@
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .events import outbox_stats
+
+class OutboxStatsView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        if getattr(request.user, 'role', 'customer') != 'admin':
+            return Response({'detail': 'Forbidden'}, status=403)
+        return Response(outbox_stats())
@@ -0,0 +1,124 @@
+import logging
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever INDEXES changes; sync_indexes rebuilds only when the stored version differs.
+INDEX_VERSION = 6
+
+# Index names are left to pymongo's default except where an index was first created with an explicit name,
+# so existing deployments do not hit IndexOptionsConflict on the first sync.
+INDEXES = {
+    'categories': [
+        {'keys': [('name', 1)], 'unique': True},
+    ],
+    'products': [
+        {'keys': [('sku', 1)], 'unique': True},
+        {'keys': [('category', 1)]},
+        {'keys': [('title', 'text'), ('brand', 'text'), ('description', 'text')]},
+        {'keys': [('is_public', 1), ('in_stock', 1), ('category', 1), ('_id', -1)], 'name': 'public_listing_by_category', 'partialFilterExpression': {'is_public': True}},
+        {'keys': [('is_public', 1), ('in_stock', 1), ('_id', -1)], 'name': 'public_listing', 'partialFilterExpression': {'is_public': True}},
+        # Sorted listings: equality fields, then the sort key, then _id as the tiebreaker
+        {'keys': [('is_public', 1), ('in_stock', 1), ('price', 1), ('_id', 1)], 'name': 'public_listing_by_price', 'partialFilterExpression': {'is_public': True}},
+        {'keys': [('is_public', 1), ('in_stock', 1), ('category', 1), ('price', 1), ('_id', 1)], 'name': 'public_listing_by_category_price', 'partialFilterExpression': {'is_public': True}},
+        {'keys': [('is_public', 1), ('in_stock', 1), ('rating', 1), ('_id', 1)], 'name': 'public_listing_by_rating', 'partialFilterExpression': {'is_public': True}},
+        {'keys': [('is_public', 1), ('in_stock', 1), ('category', 1), ('rating', 1), ('_id', 1)], 'name': 'public_listing_by_category_rating', 'partialFilterExpression': {'is_public': True}},
+        {'keys': [('owner_email', 1), ('_id', -1)]},
+        {'keys': [('updated_at', 1)]},
+    ],
+    'carts': [
+        {'keys': [('user_email', 1)], 'unique': True},
+        {'keys': [('items.product_sku', 1)]},
+    ],
+    'orders': [
+        {'keys': [('order_id', 1)], 'unique': True},
+        {'keys': [('user_email', 1)]},
+        {'keys': [('status', 1)]},
+        {'keys': [('created_at', 1)]},
+        {'keys': [('items.owner_email', 1), ('created_at', -1)]},
+    ],
+    'users': [
+        {'keys': [('email', 1)], 'unique': True},
+        {'keys': [('role', 1)]},
+        {'keys': [('date_joined', 1)]},
+    ],
+    'outbox': [
+        # Workers claim due events oldest first, then re-read their claim
+        {'keys': [('available_at', 1), ('_id', 1)]},
+        {'keys': [('claim', 1)], 'sparse': True},
+        {'keys': [('created_at', 1)]},
+    ],
+    'media_jobs': [
+        {'keys': [('sku', 1)], 'unique': True},
+        {'keys': [('available_at', 1)]},
+    ],
+    # Deleted products, read by in-process indexes catching up (catalog.search.deleted_since); kept a week
+    'product_tombstones': [
+        {'keys': [('deleted_at', 1)], 'expireAfterSeconds': 7 * 24 * 3600},
+    ],
+}
+
+_checked = False
+
+def applied_version(mongo):
+    meta = mongo['_meta'].find_one({'_id': 'indexes'}) or {}
+    return meta.get('version')
+
+def sync_indexes(mongo, force=False):
+    current = applied_version(mongo)
+    if current == INDEX_VERSION and not force:
+        return {'version': INDEX_VERSION, 'created': [], 'errors': [], 'skipped': True}
+    created = []
+    errors = []
+    for coll, specs in INDEXES.items():
+        for spec in specs:
+            opts = {k: v for k, v in spec.items() if k != 'keys'}
+            try:
+                created.append(f"{coll}.{mongo[coll].create_index(spec['keys'], **opts)}")
+            except Exception as e:
+                logger.error('Failed to create index %s on %s: %s', spec['keys'], coll, e)
+                errors.append(f"{coll} {spec['keys']}: {e}")
+    # The version is only recorded once every index exists, so a failed build is retried next deploy
+    if not errors:
+        mongo['_meta'].update_one(
+            {'_id': 'indexes'},
+            {'$set': {'version': INDEX_VERSION, 'applied_at': timezone.now().isoformat(), 'indexes': created}},
+            upsert=True,
+        )
+    return {'version': INDEX_VERSION, 'created': created, 'errors': errors, 'skipped': False}
+
+def check_indexes(mongo):
+    # Worker boot only reads the _meta marker once per process; building is left to sync_indexes
+    global _checked
+    if _checked:
+        return True
+    _checked = True
+    try:
+        current = applied_version(mongo)
+    except Exception as e:
+        logger.warning('Could not read Mongo index version: %s', e)
+        return False
+    if current != INDEX_VERSION:
+        logger.warning('Mongo indexes are at version %s, expected %s; run manage.py sync_indexes', current, INDEX_VERSION)
+        return False
+    return True
+
+def plan_summary(explain):
+    stages = []
+    indexes = set()
+    def walk(node):
+        if isinstance(node, list):
+            for n in node:
+                walk(n)
+            return
+        if not isinstance(node, dict):
+            return
+        if node.get('stage'):
+            stages.append(node['stage'])
+        if node.get('indexName'):
+            indexes.add(node['indexName'])
+        for key in ('queryPlan', 'inputStage', 'inputStages', 'shards', 'winningPlan'):
+            if key in node:
+                walk(node[key])
+    walk((explain or {}).get('queryPlanner', {}).get('winningPlan'))
+    return {'stages': stages, 'indexes': indexes}
@@ -27,6 +27,7 @@ INSTALLED_APPS = [
     'cart',
     'orders',
     'tryon',
+    'outbox',
     # Optional: Cloudinary
     'cloudinary',
     'cloudinary_storage',
@@ -242,6 +243,72 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 GROQ_API_KEY = os.environ.get('GROQ_API_KEY')
 
+# Per-process LRU cache for public catalog responses; 0 disables it
+CATALOG_CACHE_MAX_ENTRIES = int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', '512'))
+# Seconds a worker may reuse the catalog version before re-reading it; 0 reads it on every request
+CATALOG_VERSION_TTL = float(os.environ.get('CATALOG_VERSION_TTL', '0'))
+# Per-process product document cache behind the detail endpoint
+CATALOG_DETAIL_CACHE_MAX_ENTRIES = int(os.environ.get('CATALOG_DETAIL_CACHE_MAX_ENTRIES', '2048'))
+CATALOG_DETAIL_CACHE_TTL = float(os.environ.get('CATALOG_DETAIL_CACHE_TTL', '60'))
+# Cache-Control sent with catalog reads (and their 304s), per endpoint
+CATALOG_CACHE_CONTROL = {
+    'products': os.environ.get('CATALOG_CACHE_CONTROL_PRODUCTS', 'public, no-cache'),
+    'detail': os.environ.get('CATALOG_CACHE_CONTROL_DETAIL', 'public, no-cache'),
+    'categories': os.environ.get('CATALOG_CACHE_CONTROL_CATEGORIES', 'public, max-age=300'),
+    'mine': os.environ.get('CATALOG_CACHE_CONTROL_MINE', 'private, no-cache'),
+    'suggest': os.environ.get('CATALOG_CACHE_CONTROL_SUGGEST', 'public, max-age=60'),
+}
+# Upper bounds of the ?facets= price buckets; the last bucket is open-ended
+CATALOG_PRICE_BUCKETS = [float(x) for x in os.environ.get('CATALOG_PRICE_BUCKETS', '0,25,50,100,250,500,1000').split(',') if x.strip()]
+CATALOG_FACET_CACHE_MAX_ENTRIES = int(os.environ.get('CATALOG_FACET_CACHE_MAX_ENTRIES', '256'))
+CATALOG_FACET_CACHE_TTL = float(os.environ.get('CATALOG_FACET_CACHE_TTL', '300'))
+# Listing totals: ?count=exact|estimate|none, defaulting to CATALOG_COUNT_DEFAULT; estimates stop counting
+# at CATALOG_COUNT_ESTIMATE_LIMIT and are flagged with total_estimated
+CATALOG_COUNT_DEFAULT = os.environ.get('CATALOG_COUNT_DEFAULT', 'exact')
+CATALOG_COUNT_ESTIMATE_LIMIT = int(os.environ.get('CATALOG_COUNT_ESTIMATE_LIMIT', '10000'))
+CATALOG_COUNT_CACHE_MAX_ENTRIES = int(os.environ.get('CATALOG_COUNT_CACHE_MAX_ENTRIES', '1024'))
+CATALOG_COUNT_CACHE_TTL = float(os.environ.get('CATALOG_COUNT_CACHE_TTL', '30'))
+# In-process BM25 index used for ?search= on product listings
+SEARCH_INDEX_ENABLED = os.environ.get('SEARCH_INDEX_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Snapshot written by build_search_index so new workers start warm; empty disables snapshots
+SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH', '')
+# Seconds between catch-up scans for products changed by other workers
+SEARCH_INDEX_REFRESH = float(os.environ.get('SEARCH_INDEX_REFRESH', '5'))
+SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', '1000'))
+# Without a snapshot, catalogs larger than this are indexed on a background thread (searches use the database meanwhile)
+SEARCH_INDEX_INLINE_BUILD_LIMIT = int(os.environ.get('SEARCH_INDEX_INLINE_BUILD_LIMIT', '5000'))
+# Rows written per bulk_write/bulk_create round by product imports
+CATALOG_IMPORT_CHUNK_SIZE = int(os.environ.get('CATALOG_IMPORT_CHUNK_SIZE', '500'))
+CATALOG_BULK_UPDATE_MAX_ITEMS = int(os.environ.get('CATALOG_BULK_UPDATE_MAX_ITEMS', '1000'))
+# Mirror writes between Mongo and the ORM are queued and applied by `manage.py run_outbox_worker`
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '200'))
+OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', '1'))
+OUTBOX_LEASE_SECONDS = int(os.environ.get('OUTBOX_LEASE_SECONDS', '60'))
+# Events of a Mongo primary write are held this long unless the write returns and releases them first
+OUTBOX_INTENT_DELAY = float(os.environ.get('OUTBOX_INTENT_DELAY', '30'))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_MAX_RETRY_DELAY = int(os.environ.get('OUTBOX_MAX_RETRY_DELAY', '300'))
+OUTBOX_STATS_INTERVAL = float(os.environ.get('OUTBOX_STATS_INTERVAL', '60'))
+# Longest pause of a worker loop after repeated connection errors
+WORKER_MAX_BACKOFF = float(os.environ.get('WORKER_MAX_BACKOFF', '60'))
+# Product media: files are staged under MEDIA_ROOT/uploads and uploaded by `manage.py run_media_worker` when a
+# remote uploader is configured (Cloudinary, or MEDIA_UPLOADER='catalog.media.local_upload' for tests/benchmarks)
+MEDIA_UPLOADER = os.environ.get('MEDIA_UPLOADER', '')
+MEDIA_UPLOAD_ASYNC = os.environ.get('MEDIA_UPLOAD_ASYNC', 'true').lower() in ('1', 'true', 'yes')
+MEDIA_UPLOAD_MAX_ATTEMPTS = int(os.environ.get('MEDIA_UPLOAD_MAX_ATTEMPTS', '5'))
+MEDIA_UPLOAD_LEASE_SECONDS = int(os.environ.get('MEDIA_UPLOAD_LEASE_SECONDS', '300'))
+MEDIA_LOCAL_UPLOAD_DELAY = float(os.environ.get('MEDIA_LOCAL_UPLOAD_DELAY', '0'))
+# Files of one request (or one media job) upload on up to this many threads; stragglers past the timeout are reported
+MEDIA_UPLOAD_CONCURRENCY = int(os.environ.get('MEDIA_UPLOAD_CONCURRENCY', '4'))
+MEDIA_UPLOAD_TIMEOUT = float(os.environ.get('MEDIA_UPLOAD_TIMEOUT', '60'))
+# Responsive derivatives of product images (JPEG + WebP), never wider than the original
+IMAGE_VARIANT_WIDTHS = [int(w) for w in os.environ.get('IMAGE_VARIANT_WIDTHS', '200,400,800').split(',') if w.strip()]
+IMAGE_VARIANT_QUALITY = int(os.environ.get('IMAGE_VARIANT_QUALITY', '80'))
+# Uploads are stored once per content under MEDIA_ROOT/blobs and served as immutable; blobs no product references
+# are deleted once untouched for MEDIA_BLOB_GRACE_SECONDS (on release, or by `manage.py gc_media_blobs`)
+MEDIA_BLOB_GRACE_SECONDS = int(os.environ.get('MEDIA_BLOB_GRACE_SECONDS', '3600'))
+MEDIA_BLOB_CACHE_CONTROL = os.environ.get('MEDIA_BLOB_CACHE_CONTROL', 'public, max-age=31536000, immutable')
+
 USE_CLOUDINARY = os.environ.get('USE_CLOUDINARY', 'false').lower() in ('1', 'true', 'yes')
 try:
     import cloudinary  # type: ignore
@@ -1,3 +1,4 @@
+import re
 from django.contrib import admin
 from django.urls import path, include, re_path
 from django.conf import settings
@@ -17,6 +18,17 @@ urlpatterns = [
     path('api/orders/', include('orders.urls')),
     path('api/profile/', include('users.profile_urls')),
     path('api/skin/', include('tryon.urls')),
+    path('api/outbox/', include('outbox.urls')),
+]
+
+# Content-addressed uploads (catalog.blobs): a blob URL's bytes never change, so clients and CDNs may keep them
+def immutable_media_serve(request, path):
+    response = static_serve(request, path, document_root=settings.MEDIA_ROOT)
+    response['Cache-Control'] = settings.MEDIA_BLOB_CACHE_CONTROL
+    return response
+
+urlpatterns += [
+    re_path(r'^%s(?P<path>blobs/.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), immutable_media_serve),
 ]
 
 # Serve media files
@@ -58,6 +70,7 @@ def openapi_json_view(request):
             '/api/orders': 'orders',
             '/api/skin': 'tryon',
             '/api/profile': 'auth',
+            '/api/outbox': 'outbox',
         }
         tags_set = set(tag_map.values())
         for p, ops in (data.get('paths') or {}).items():
@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from .mongo import sync_user
+
+PROFILE_FIELDS = ('first_name', 'last_name', 'role', 'phone', 'business_name', 'business_type', 'is_active')
+
+def users_to_orm(mongo, emails, queued_at=None):
+    # Outbox handler: Mongo signups get an ORM account (same password hash) so ORM-side rows such as orders can point at them
+    User = get_user_model()
+    docs = {d['email']: d for d in mongo['users'].find({'email': {'$in': emails}})}
+    existing = {u.email: u for u in User.objects.filter(email__in=emails)}
+    created, updated = [], []
+    for email, doc in docs.items():
+        values = {f: doc.get(f) or '' for f in PROFILE_FIELDS}
+        values['role'] = values['role'] or 'customer'
+        values['is_active'] = doc.get('is_active', True) is not False
+        user = existing.get(email)
+        if user is None:
+            created.append(User(email=email, username=doc.get('username') or email, password=doc.get('password') or make_password(None), **values))
+        elif any(getattr(user, f) != v for f, v in values.items()):
+            for f, v in values.items():
+                setattr(user, f, v)
+            updated.append(user)
+    User.objects.bulk_create(created)
+    User.objects.bulk_update(updated, list(PROFILE_FIELDS))
+    return {e: 'User not found' for e in emails if e not in docs}
+
+def users_to_mongo(mongo, emails, queued_at=None):
+    for user in get_user_model().objects.filter(email__in=emails):
+        sync_user(mongo, user)
+    return {}
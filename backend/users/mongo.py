@@ -1,14 +1,6 @@
 import secrets
 from django.contrib.auth.hashers import make_password, check_password
 
-def ensure_indexes(mongo):
-    try:
-        mongo['users'].create_index('email', unique=True)
-        mongo['users'].create_index('role')
-        mongo['users'].create_index('date_joined')
-    except Exception:
-        pass
-
 def to_doc(user):
     return {
         'email': user.email,
@@ -24,12 +16,10 @@ def to_doc(user):
     }
 
 def sync_user(mongo, user):
-    ensure_indexes(mongo)
     doc = to_doc(user)
     mongo['users'].update_one({'email': user.email}, {'$set': doc}, upsert=True)
 
 def create_user_doc(mongo, email, password, role='customer', extra=None):
-    ensure_indexes(mongo)
     hashed = make_password(password)
     payload = {'email': email, 'password': hashed, 'role': role, 'is_active': True}
     if isinstance(extra, dict):
@@ -1,5 +1,5 @@
 from rest_framework import status, permissions
-from django.db import models
+from django.db import models, transaction
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.schemas.openapi import AutoSchema
@@ -13,6 +13,7 @@ from catalog.models import Product, Category
 from orders.models import Order, OrderItem
 from .mongo import sync_user, soft_delete_user, create_user_doc, get_user_doc, check_user_password
 from .jwt import create_tokens
+from outbox.events import enqueue, mirrored_write
 
 RESET_TOKENS = {}
 MODERATION_STATUSES = {}
@@ -56,13 +57,14 @@ class SignupView(APIView):
             if not email or not password:
                 return Response({'detail': 'Email and password required'}, status=status.HTTP_400_BAD_REQUEST)
             try:
-                create_user_doc(mongo, email, password, role, {
-                    'phone': data.get('phone'),
-                    'business_name': data.get('business_name'),
-                    'business_type': data.get('business_type'),
-                    'first_name': (data.get('fullName') or '').split(' ', 1)[0] if data.get('fullName') else '',
-                    'last_name': (data.get('fullName') or '').split(' ', 1)[1] if data.get('fullName') and ' ' in data.get('fullName') else '',
-                })
+                with mirrored_write('user', email):
+                    create_user_doc(mongo, email, password, role, {
+                        'phone': data.get('phone'),
+                        'business_name': data.get('business_name'),
+                        'business_type': data.get('business_type'),
+                        'first_name': (data.get('fullName') or '').split(' ', 1)[0] if data.get('fullName') else '',
+                        'last_name': (data.get('fullName') or '').split(' ', 1)[1] if data.get('fullName') and ' ' in data.get('fullName') else '',
+                    })
                 doc = get_user_doc(mongo, email)
                 tokens = create_tokens(email, role)
                 return Response({'user': {
@@ -76,11 +78,10 @@ class SignupView(APIView):
                 return Response({'detail': 'Signup failed'}, status=status.HTTP_400_BAD_REQUEST)
         serializer = SignupSerializer(data=request.data)
         if serializer.is_valid():
-            user = serializer.save()
-            try:
-                sync_user(getattr(settings, 'MONGO_DB', None), user)
-            except Exception:
-                pass
+            with transaction.atomic():
+                user = serializer.save()
+                if getattr(settings, 'MONGO_DB', None) is not None:
+                    enqueue('user', user.email, target='mongo')
             tokens = build_tokens(user)
             return Response({'user': UserSerializer(user).data, 'tokens': tokens}, status=status.HTTP_201_CREATED)
         return Response({'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
@@ -101,11 +102,12 @@ class SellerSignupView(APIView):
             if not email or not password:
                 return Response({'detail': 'Email and password required'}, status=status.HTTP_400_BAD_REQUEST)
             try:
-                create_user_doc(mongo, email, password, 'seller', {
-                    'phone': data.get('phone'),
-                    'business_name': data.get('business_name'),
-                    'business_type': data.get('business_type'),
-                })
+                with mirrored_write('user', email):
+                    create_user_doc(mongo, email, password, 'seller', {
+                        'phone': data.get('phone'),
+                        'business_name': data.get('business_name'),
+                        'business_type': data.get('business_type'),
+                    })
                 doc = get_user_doc(mongo, email)
                 tokens = create_tokens(email, 'seller')
                 return Response({'user': {
@@ -119,11 +121,10 @@ class SellerSignupView(APIView):
         data['role'] = 'seller'
         serializer = SignupSerializer(data=data)
         if serializer.is_valid():
-            user = serializer.save()
-            try:
-                sync_user(getattr(settings, 'MONGO_DB', None), user)
-            except Exception:
-                pass
+            with transaction.atomic():
+                user = serializer.save()
+                if getattr(settings, 'MONGO_DB', None) is not None:
+                    enqueue('user', user.email, target='mongo')
             tokens = build_tokens(user)
             return Response({'user': UserSerializer(user).data, 'tokens': tokens}, status=status.HTTP_201_CREATED)
         return Response({'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)